@@ -0,0 +1,25 @@
+"""add timezone to preferences
+
+Revision ID: 0b6e3d9a2f71
+Revises: f52d8b1e7c04
+Create Date: 2026-10-19 19:52:15.067834
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0b6e3d9a2f71"
+down_revision = "f52d8b1e7c04"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("preferences", sa.Column("timezone", sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("preferences", "timezone")
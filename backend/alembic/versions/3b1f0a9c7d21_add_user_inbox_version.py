@@ -0,0 +1,28 @@
+"""add inbox version to users
+
+Revision ID: 3b1f0a9c7d21
+Revises: c056c455979f
+Create Date: 2026-10-19 09:12:41.118204
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "3b1f0a9c7d21"
+down_revision = "c056c455979f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column("inbox_version", sa.Integer(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("users", "inbox_version")
@@ -0,0 +1,45 @@
+"""add llm cache entries
+
+Revision ID: 5f9a3e6b2c84
+Revises: 8e4c2d7a51f0
+Create Date: 2026-10-19 13:40:52.276113
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "5f9a3e6b2c84"
+down_revision = "8e4c2d7a51f0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "llm_cache_entries",
+        sa.Column("key", sa.String(length=64), nullable=False),
+        sa.Column("workflow", sa.String(length=64), nullable=False),
+        sa.Column("model", sa.String(length=128), nullable=False),
+        sa.Column("result", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column("hit_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column(
+            "last_hit_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.Column(
+            "created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.create_index("ix_llm_cache_entries_expires_at", "llm_cache_entries", ["expires_at"])
+    op.create_index("ix_llm_cache_entries_last_hit_at", "llm_cache_entries", ["last_hit_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_llm_cache_entries_last_hit_at", table_name="llm_cache_entries")
+    op.drop_index("ix_llm_cache_entries_expires_at", table_name="llm_cache_entries")
+    op.drop_table("llm_cache_entries")
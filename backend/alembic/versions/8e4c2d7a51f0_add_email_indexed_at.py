@@ -0,0 +1,25 @@
+"""add indexed_at to emails
+
+Revision ID: 8e4c2d7a51f0
+Revises: 3b1f0a9c7d21
+Create Date: 2026-10-19 10:03:17.402551
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "8e4c2d7a51f0"
+down_revision = "3b1f0a9c7d21"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("emails", sa.Column("indexed_at", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("emails", "indexed_at")
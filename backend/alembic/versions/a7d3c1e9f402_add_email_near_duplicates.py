@@ -0,0 +1,40 @@
+"""add near-duplicate fields to emails
+
+Revision ID: a7d3c1e9f402
+Revises: 5f9a3e6b2c84
+Create Date: 2026-10-19 15:12:08.513920
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "a7d3c1e9f402"
+down_revision = "5f9a3e6b2c84"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("emails", sa.Column("simhash", sa.BigInteger(), nullable=True))
+    op.add_column(
+        "emails",
+        sa.Column(
+            "duplicate_of_id",
+            postgresql.UUID(as_uuid=True),
+            sa.ForeignKey("emails.id", ondelete="SET NULL"),
+            nullable=True,
+        ),
+    )
+    op.add_column("emails", sa.Column("classification_source", sa.String(length=32), nullable=True))
+    op.create_index("ix_emails_duplicate_of_id", "emails", ["duplicate_of_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_emails_duplicate_of_id", table_name="emails")
+    op.drop_column("emails", "classification_source")
+    op.drop_column("emails", "duplicate_of_id")
+    op.drop_column("emails", "simhash")
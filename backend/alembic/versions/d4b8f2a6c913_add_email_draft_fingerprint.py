@@ -0,0 +1,25 @@
+"""add draft fingerprint to emails
+
+Revision ID: d4b8f2a6c913
+Revises: a7d3c1e9f402
+Create Date: 2026-10-19 17:41:26.208417
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "d4b8f2a6c913"
+down_revision = "a7d3c1e9f402"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("emails", sa.Column("draft_fingerprint", sa.String(length=32), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("emails", "draft_fingerprint")
@@ -0,0 +1,47 @@
+"""add thread summaries
+
+Revision ID: e1c7a94b3f58
+Revises: d4b8f2a6c913
+Create Date: 2026-10-19 18:26:03.914572
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "e1c7a94b3f58"
+down_revision = "d4b8f2a6c913"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "thread_summaries",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("conversation_id", sa.String(length=255), nullable=False),
+        sa.Column("summary", sa.Text(), nullable=False),
+        sa.Column("key_points", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column("latest_student_question", sa.Text(), nullable=True),
+        sa.Column("last_email_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("last_received_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("message_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column(
+            "created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.Column(
+            "updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["last_email_id"], ["emails.id"], ondelete="SET NULL"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("user_id", "conversation_id", name="uq_thread_summaries_user_conversation"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("thread_summaries")
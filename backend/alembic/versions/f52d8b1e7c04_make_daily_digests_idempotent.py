@@ -0,0 +1,53 @@
+"""make daily digests unique per user and day
+
+Revision ID: f52d8b1e7c04
+Revises: e1c7a94b3f58
+Create Date: 2026-10-19 19:08:47.330291
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "f52d8b1e7c04"
+down_revision = "e1c7a94b3f58"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Every POST used to insert another row; keep the newest per day.
+    op.execute(
+        """
+        DELETE FROM daily_digests a
+        USING daily_digests b
+        WHERE a.user_id = b.user_id
+          AND a.summary_date = b.summary_date
+          AND (a.created_at < b.created_at OR (a.created_at = b.created_at AND a.id < b.id))
+        """
+    )
+    op.add_column(
+        "daily_digests",
+        sa.Column(
+            "email_ids",
+            postgresql.JSONB(astext_type=sa.Text()),
+            server_default=sa.text("'[]'::jsonb"),
+            nullable=False,
+        ),
+    )
+    op.add_column(
+        "daily_digests",
+        sa.Column("inbox_version", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.add_column("daily_digests", sa.Column("source_hash", sa.String(length=64), nullable=True))
+    op.create_unique_constraint("uq_daily_digests_user_date", "daily_digests", ["user_id", "summary_date"])
+
+
+def downgrade() -> None:
+    op.drop_constraint("uq_daily_digests_user_date", "daily_digests", type_="unique")
+    op.drop_column("daily_digests", "source_hash")
+    op.drop_column("daily_digests", "inbox_version")
+    op.drop_column("daily_digests", "email_ids")
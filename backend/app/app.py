@@ -3,6 +3,7 @@ from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
 import os
+import time
 from sqlalchemy import text
 
 
@@ -12,6 +13,7 @@ from .db import SessionLocal, engine, Base
 load_dotenv()
 
 def create_app():
+    started = time.perf_counter()
     app = Flask(__name__)
 
     # Configuration
@@ -41,6 +43,14 @@ def create_app():
         print("⚠️ Warning: Blueprints failed to import:", e)
         print("Running with health check only.")
 
+    try:
+        from app.modules.ask import ask_bp
+
+        app.register_blueprint(ask_bp, url_prefix="/ask")
+
+    except Exception as e:
+        print("⚠️ Warning: Ask-the-Inbox blueprint failed to import:", e)
+
     # --- ROUTES BELOW ---
 
     @app.route("/")
@@ -61,9 +71,12 @@ def create_app():
         except Exception as e:
             db_status = f"error: {str(e)}"
 
+        from app.llm.client import init_timings_ms
+
         return {
             "status": "healthy",
-            "db": db_status
+            "db": db_status,
+            "startup_ms": {**app.config["STARTUP_TIMINGS_MS"], **init_timings_ms},
         }
 
     # Simple test endpoint (frontend sanity check)
@@ -102,7 +115,8 @@ def create_app():
     @app.route("/llm/models")
     def llm_models():
         try:
-            from app.llm.client import list_available_models, is_configured
+            from app.llm.client import DEFAULT_MODEL_NAME, list_available_models, is_configured
+            from app.llm.router import describe_routes
 
             if not is_configured():
                 return {"status": "error", "message": "GEMINI_API_KEY missing"}
@@ -110,11 +124,104 @@ def create_app():
             return {
                 "status": "success",
                 "available_models": list_available_models(),
-                "current_model": "gemini-2.0-flash"
+                "current_model": DEFAULT_MODEL_NAME,
+                "routes": describe_routes(),
             }
         except Exception as e:
             return {"status": "error", "message": str(e)}
 
+    @app.route("/llm/cache-stats")
+    def llm_cache_stats():
+        try:
+            from app.llm.cache import cache_stats
+
+            return {"status": "success", "cache": cache_stats()}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    @app.route("/llm/client-stats")
+    def llm_client_stats():
+        try:
+            from app.llm.client import client_stats
+
+            return {"status": "success", "client": client_stats()}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    @app.route("/llm/token-stats")
+    def llm_token_stats():
+        try:
+            from app.llm.prompt_prefix import prefix_stats
+            from app.llm.prompting import token_stats
+
+            return {"status": "success", "tokens": token_stats(), "prefixes": prefix_stats()}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    @app.route("/llm/queue-stats")
+    def llm_queue_stats():
+        try:
+            from app.workers.llm_queue import get_llm_queue
+
+            return {"status": "success", "queue": get_llm_queue().stats()}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    @app.route("/llm/parse-stats")
+    def llm_parse_stats():
+        try:
+            from app.llm.structured import parse_stats
+
+            return {"status": "success", "parsing": parse_stats()}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    @app.route("/llm/singleflight-stats")
+    def llm_singleflight_stats():
+        try:
+            from app.singleflight import singleflight_stats
+
+            return {"status": "success", "groups": singleflight_stats()}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    @app.route("/llm/draft-prefetch-stats")
+    def llm_draft_prefetch_stats():
+        try:
+            from app.workers.drafts import get_draft_prefetcher
+
+            return {"status": "success", "prefetch": get_draft_prefetcher().stats()}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    @app.route("/llm/thread-summary-stats")
+    def llm_thread_summary_stats():
+        try:
+            from app.workers.thread_summaries import thread_summary_stats
+
+            return {"status": "success", "thread_summaries": thread_summary_stats()}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    @app.route("/llm/digest-scheduler-stats")
+    def llm_digest_scheduler_stats():
+        try:
+            from app.workers.digest_scheduler import get_digest_scheduler
+
+            return {"status": "success", "scheduler": get_digest_scheduler().stats()}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    # --- Off-peak digest precomputation (one process only) ---
+    if os.getenv("DIGEST_SCHEDULER_ENABLED", "false").lower() in ("1", "true", "yes"):
+        try:
+            from app.workers.digest_scheduler import get_digest_scheduler
+
+            get_digest_scheduler().start()
+        except Exception as e:
+            print("⚠️ Warning: Digest scheduler failed to start:", e)
+
+    app.config["STARTUP_TIMINGS_MS"] = {"create_app": round((time.perf_counter() - started) * 1000, 1)}
     return app
 
 
@@ -1,17 +1,43 @@
 """
 LLM module for Professor Inbox Copilot - Gemini-powered workflows
+
+Workflows are imported lazily on first attribute access, so
+``import app.llm`` stays cheap and never touches the Gemini SDK.
 """
 
-from .categorize_email import categorize_email
-from .summarize_thread import summarize_thread
-from .generate_reply import generate_reply
-from .daily_digest import daily_digest
-from .search_inbox import search_inbox
-
-__all__ = [
-    'categorize_email',
-    'summarize_thread', 
-    'generate_reply',
-    'daily_digest',
-    'search_inbox'
-]
\ No newline at end of file
+import importlib
+import sys
+import types
+
+_EXPORTS = {
+    'categorize_email': '.categorize_email',
+    'categorize_emails_batch': '.categorize_batch',
+    'summarize_thread': '.summarize_thread',
+    'update_thread_summary': '.summarize_thread',
+    'generate_reply': '.generate_reply',
+    'daily_digest': '.daily_digest',
+    'search_inbox': '.search_inbox',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # Importing e.g. app.llm.categorize_email binds the submodule on the
+        # package under the same name as the function it exports; keep the
+        # function, as the old eager imports did.
+        if name in _EXPORTS and isinstance(value, types.ModuleType):
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
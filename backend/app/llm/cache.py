@@ -0,0 +1,244 @@
+"""
+Content-addressed cache for LLM workflow results
+
+Results are keyed by sha256(workflow, model, prompt version, normalized
+input), so byte-identical (modulo whitespace) requests never reach Gemini
+twice. Lookups go to an in-process LRU first, then to the
+``llm_cache_entries`` table. Degraded (fallback) results are never cached.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from app.cache import TTLCache
+from .router import route_signature
+
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "2048"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "100000"))
+_EVICT_EVERY_WRITES = 500
+
+_TRAILING_SPACE_RE = re.compile(r"[ \t]+\n")
+_BLANK_RUN_RE = re.compile(r"\n{3,}")
+
+_memory = TTLCache(LLM_CACHE_MEMORY_SIZE, LLM_CACHE_TTL_SECONDS)
+_stats: dict[str, dict[str, int]] = {}
+_stats_lock = threading.Lock()
+_writes_since_evict = 0
+
+
+# ---------------------------------------------------
+# Keys
+# ---------------------------------------------------
+def _normalize(value):
+    if isinstance(value, str):
+        text = value.replace("\r\n", "\n").strip()
+        text = _TRAILING_SPACE_RE.sub("\n", text)
+        return _BLANK_RUN_RE.sub("\n\n", text)
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    fingerprint = getattr(value, "fingerprint", None)     # e.g. ProfessorContext
+    if isinstance(fingerprint, str):
+        return fingerprint
+    return value
+
+
+def cache_key(workflow: str, model: str, prompt_version: int, inputs: dict) -> str:
+    payload = json.dumps(
+        [workflow, model, prompt_version, _normalize(inputs)],
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ---------------------------------------------------
+# Counters
+# ---------------------------------------------------
+def _count(workflow: str, event: str) -> None:
+    with _stats_lock:
+        counters = _stats.setdefault(workflow, {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0})
+        counters[event] += 1
+
+
+def cache_stats() -> dict:
+    with _stats_lock:
+        workflows = {name: dict(counters) for name, counters in _stats.items()}
+    for counters in workflows.values():
+        hits = counters["memory_hits"] + counters["db_hits"]
+        lookups = hits + counters["misses"]
+        counters["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+    return {"enabled": LLM_CACHE_ENABLED, "memory": _memory.stats(), "workflows": workflows}
+
+
+# ---------------------------------------------------
+# Persistent tier (Postgres)
+# ---------------------------------------------------
+def _db_get(key: str) -> Optional[dict]:
+    from sqlalchemy import update
+
+    from app.db import get_session
+    from app.models import LLMCacheEntry
+
+    now = datetime.now(timezone.utc)
+    with get_session() as db:
+        row = (
+            db.query(LLMCacheEntry.result)
+            .filter(LLMCacheEntry.key == key, LLMCacheEntry.expires_at > now)
+            .first()
+        )
+        if row is None:
+            return None
+        db.execute(
+            update(LLMCacheEntry)
+            .where(LLMCacheEntry.key == key)
+            .values(hit_count=LLMCacheEntry.hit_count + 1, last_hit_at=now)
+        )
+        return row.result
+
+
+def _db_put(key: str, workflow: str, model: str, result: dict, ttl: int) -> None:
+    from sqlalchemy.dialects.postgresql import insert
+
+    from app.db import get_session
+    from app.models import LLMCacheEntry
+
+    now = datetime.now(timezone.utc)
+    values = {
+        "key": key,
+        "workflow": workflow,
+        "model": model,
+        "result": result,
+        "expires_at": now + timedelta(seconds=ttl),
+        "last_hit_at": now,
+    }
+    statement = insert(LLMCacheEntry).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[LLMCacheEntry.key],
+        set_={"result": values["result"], "expires_at": values["expires_at"], "last_hit_at": now},
+    )
+    with get_session() as db:
+        db.execute(statement)
+
+
+def evict_expired(max_rows: int = LLM_CACHE_MAX_ROWS) -> int:
+    """
+    Delete expired rows, then the least recently hit rows beyond ``max_rows``.
+
+    Returns:
+        Number of rows deleted
+    """
+    from sqlalchemy import delete, func, select
+
+    from app.db import get_session
+    from app.models import LLMCacheEntry
+
+    with get_session() as db:
+        deleted = db.execute(
+            delete(LLMCacheEntry).where(LLMCacheEntry.expires_at <= datetime.now(timezone.utc))
+        ).rowcount or 0
+
+        excess = (db.query(func.count(LLMCacheEntry.key)).scalar() or 0) - max_rows
+        if excess > 0:
+            oldest = select(LLMCacheEntry.key).order_by(LLMCacheEntry.last_hit_at.asc()).limit(excess)
+            deleted += db.execute(
+                delete(LLMCacheEntry).where(LLMCacheEntry.key.in_(oldest))
+            ).rowcount or 0
+    return deleted
+
+
+def _maybe_evict() -> None:
+    global _writes_since_evict
+    with _stats_lock:
+        _writes_since_evict += 1
+        if _writes_since_evict < _EVICT_EVERY_WRITES:
+            return
+        _writes_since_evict = 0
+    try:
+        evict_expired()
+    except Exception as e:
+        logger.warning("LLM cache eviction failed: %s", e)
+
+
+# ---------------------------------------------------
+# Decorator
+# ---------------------------------------------------
+def llm_cache(
+    workflow: str,
+    prompt_version: int = 1,
+    ttl: int = LLM_CACHE_TTL_SECONDS,
+    model: Optional[Callable[[], str]] = None,
+):
+    """
+    Cache a workflow function's dict result by content.
+
+    Bump ``prompt_version`` whenever the prompt or schema changes so older
+    entries stop matching. Callers see the same return value either way.
+    ``model`` defaults to the workflow's route, so re-routing a workflow
+    starts a fresh set of entries.
+    """
+    if model is None:
+        model = lambda: route_signature(workflow)
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not LLM_CACHE_ENABLED:
+                return fn(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            model_name = model()
+            key = cache_key(workflow, model_name, prompt_version, dict(bound.arguments))
+
+            result = _memory.get(key)
+            if result is not None:
+                _count(workflow, "memory_hits")
+                return json.loads(result)
+
+            try:
+                stored = _db_get(key)
+            except Exception as e:
+                logger.warning("LLM cache lookup failed for %s: %s", workflow, e)
+                stored = None
+            if stored is not None:
+                _count(workflow, "db_hits")
+                _memory.set(key, json.dumps(stored))
+                return stored
+
+            _count(workflow, "misses")
+            result = fn(*args, **kwargs)
+            if not isinstance(result, dict) or result.get("degraded"):
+                return result
+
+            # Stored serialized so callers can't mutate the cached copy.
+            _memory.set(key, json.dumps(result), ttl=ttl)
+            try:
+                _db_put(key, workflow, model_name, result, ttl)
+                _count(workflow, "stores")
+                _maybe_evict()
+            except Exception as e:
+                logger.warning("LLM cache store failed for %s: %s", workflow, e)
+            return result
+
+        wrapper.uncached = fn
+        return wrapper
+
+    return decorator
@@ -0,0 +1,160 @@
+"""
+Batched email categorization: several short emails per Gemini request
+"""
+import logging
+import os
+import time
+
+from .categorize_email import CATEGORIZATION_GUIDELINES, categorize_email
+from .client import LLMUnavailableError, degraded_reason, generate_content
+from .prompting import PromptBuilder, record_usage
+from .prompt_prefix import get_prefix
+from .schemas import categorize_batch_schema
+from .structured import parse_output
+from app.search.chunking import estimate_tokens
+
+
+CLASSIFY_BATCH_TOKENS = int(os.getenv("CLASSIFY_BATCH_TOKENS", "6000"))
+CLASSIFY_BATCH_MAX_EMAILS = int(os.getenv("CLASSIFY_BATCH_MAX_EMAILS", "20"))
+CLASSIFY_BATCH_ITEM_TOKENS = 1500   # longer emails are classified on their own
+
+_GUIDELINE_TOKENS = estimate_tokens(CATEGORIZATION_GUIDELINES) + 150
+
+logger = logging.getLogger(__name__)
+
+
+def plan_batches(
+    items: list[tuple[str, str]],
+    token_budget: int = CLASSIFY_BATCH_TOKENS,
+    max_items: int = CLASSIFY_BATCH_MAX_EMAILS,
+) -> list[list[tuple[str, str]]]:
+    """
+    Group (email_id, text) pairs into batches that fit the token budget.
+
+    The shared guidelines are counted once per batch. Emails too long to
+    share a prompt get a batch of their own.
+
+    Returns:
+        List of batches, each a list of (email_id, text)
+    """
+    batches, current, used = [], [], _GUIDELINE_TOKENS
+    for item in items:
+        cost = estimate_tokens(item[1]) + 20
+        if cost > CLASSIFY_BATCH_ITEM_TOKENS:
+            batches.append([item])
+            continue
+        if current and (used + cost > token_budget or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], _GUIDELINE_TOKENS
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _batch_prefix(preferences: str = None):
+    def render() -> str:
+        text = f"You are an AI assistant helping a professor categorize student emails.\n{CATEGORIZATION_GUIDELINES}"
+        if preferences:
+            text += f"\nProfessor preferences:\n{preferences}\n"
+        return text
+
+    return get_prefix("categorize_batch", (preferences,), render)
+
+
+def categorize_emails_batch(
+    emails: list[tuple[str, str]],
+    preferences: str = None,
+) -> dict:
+    """
+    Categorize several emails in a single Gemini request.
+
+    Any email whose result is missing, duplicated or malformed is retried
+    on its own with categorize_email, so every input gets a result.
+
+    Args:
+        emails: List of (email_id, email_text) pairs
+        preferences: Optional professor preferences
+
+    Returns:
+        dict with:
+            - results (dict): email_id -> categorize_email-style result
+            - requests (int): number of Gemini calls made
+    """
+    if not emails:
+        return {"results": {}, "requests": 0}
+
+    if len(emails) == 1:
+        email_id, text = emails[0]
+        return {"results": {email_id: categorize_email(text, preferences=preferences)}, "requests": 1}
+
+    # Short positional ids are easier for the model to copy back than UUIDs.
+    local_ids = {str(i + 1): email_id for i, (email_id, _) in enumerate(emails)}
+
+    # plan_batches keeps batches within budget, so each email's share of the
+    # prompt budget only trims outliers.
+    builder = (
+        PromptBuilder("categorize_batch")
+        .prefix(_batch_prefix(preferences))
+        .text(f"Categorize each of the {len(emails)} emails below independently.")
+        .text("Respond strictly in JSON: a \"results\" array with exactly one entry per email,")
+        .text("each carrying the email_id attribute of the email it describes.\n")
+    )
+    for local_id, (_, text) in zip(local_ids, emails):
+        builder.text(f'<email email_id="{local_id}">').body(f"email_{local_id}", text).text("</email>\n")
+    prompt = builder.build()
+
+    results: dict = {}
+    requests_made = 1
+
+    started = time.perf_counter()
+    try:
+        response = generate_content(
+            prompt.text,
+            workflow=prompt.workflow,
+            input_tokens=prompt.input_tokens,
+            prefix=prompt.prefix,
+            generation_config=dict(
+                response_mime_type="application/json",
+                response_schema=categorize_batch_schema,
+                max_output_tokens=prompt.max_output_tokens,
+            ),
+        )
+        record_usage(prompt, response, started=started)
+        # Repair keeps every complete item of a truncated or partly
+        # malformed array; only the rest are retried below. An email
+        # answered twice is ambiguous, so it is retried as well.
+        duplicated = set()
+        for item in parse_output("categorize_batch", response.text)["results"]:
+            email_id = local_ids.get(item.pop("email_id"))
+            if email_id is None:
+                continue
+            if email_id in results:
+                duplicated.add(email_id)
+                continue
+            results[email_id] = item
+        for email_id in duplicated:
+            del results[email_id]
+    except LLMUnavailableError as e:
+        # Outage / open circuit: per-email retries would fail the same way.
+        # Degraded results leave the emails unprocessed for a later job.
+        logger.warning("Batched categorization unavailable: %s", e)
+        return {
+            "results": {
+                email_id: {"category": "other", "priority_score": 5, "summary": None,
+                           "degraded": True, "degraded_reason": degraded_reason(e)}
+                for email_id, _ in emails
+            },
+            "requests": requests_made,
+        }
+    except Exception as e:
+        logger.warning("Batched categorization failed, retrying emails individually: %s", e)
+
+    # ---------- FALLBACK: single-email retries ----------
+    for email_id, text in emails:
+        if email_id not in results:
+            requests_made += 1
+            results[email_id] = categorize_email(text, preferences=preferences)
+
+    return {"results": results, "requests": requests_made}
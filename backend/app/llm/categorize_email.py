@@ -2,44 +2,14 @@
 Email categorization workflow using Gemini (Google Generative AI)
 """
 
-import json
-import google.generativeai as genai
-from .client import get_model
-from .schemas import categorize_schema
+from .client import degraded_reason
+from .cache import llm_cache
+from .prompting import PromptBuilder
+from .prompt_prefix import PromptPrefix, get_prefix
+from .structured import generate_structured
 
 
-def categorize_email(email_text: str, thread_context: str = None, preferences: str = None) -> dict:
-    """
-    Categorize a student email using semantic analysis via Gemini.
-    
-    Args:
-        email_text (str): The email content.
-        thread_context (str): Optional context from previous messages.
-        preferences (str): Optional professor preferences.
-    
-    Returns:
-        dict: Parsed JSON with category, priority_score, tone, summary, hidden_intent.
-    """
-
-    model = get_model()
-
-    # ---------- BUILD PROMPT ----------
-    prompt_parts = [
-        "You are an AI assistant helping a professor categorize student emails.",
-        "Analyze the email below and respond strictly in JSON that matches the expected schema.",
-        "",
-        "Email to analyze:",
-        email_text,
-        "",
-    ]
-
-    if thread_context:
-        prompt_parts.append(f"Thread context:\n{thread_context}\n")
-
-    if preferences:
-        prompt_parts.append(f"Professor preferences:\n{preferences}\n")
-
-    prompt_parts.append("""
+CATEGORIZATION_GUIDELINES = """
 Categorization Guidelines:
 
 Categories (choose one):
@@ -67,23 +37,62 @@ Provide:
 - tone
 - summary
 - hidden_intent
-""")
+"""
 
-    prompt = "\n".join(prompt_parts)
 
-    # ---------- CALL GEMINI ----------
-    try:
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-                response_schema=categorize_schema  # Enforces structured output
-            )
+def categorization_prefix(preferences: str = None) -> PromptPrefix:
+    """
+    Shared instructions, guidelines and professor preferences; everything
+    before the email itself, compiled once per distinct ``preferences``.
+    """
+
+    def render() -> str:
+        text = (
+            "You are an AI assistant helping a professor categorize student emails.\n"
+            "Analyze the email at the end and respond strictly in JSON that matches the expected schema.\n"
+            f"{CATEGORIZATION_GUIDELINES}"
         )
+        if preferences:
+            text += f"\nProfessor preferences:\n{preferences}\n"
+        return text
+
+    return get_prefix("categorize_email", (preferences,), render)
+
+
+@llm_cache("categorize_email", prompt_version=3)
+def categorize_email(email_text: str, thread_context: str = None, preferences: str = None) -> dict:
+    """
+    Categorize a student email using semantic analysis via Gemini.
+    
+    Args:
+        email_text (str): The email content.
+        thread_context (str): Optional context from previous messages.
+        preferences (str): Optional professor preferences.
+    
+    Returns:
+        dict: Parsed JSON with category, priority_score, tone, summary, hidden_intent.
+    """
+
+
+    # ---------- BUILD PROMPT ----------
+    # The shared prefix comes first so providers can cache it.
+    builder = (
+        PromptBuilder("categorize_email")
+        .prefix(categorization_prefix(preferences))
+        .text("Email to analyze:")
+        .body("email", email_text)
+    )
+
+    if thread_context:
+        builder.text("\nThread context:").body("thread_context", thread_context)
 
-        # Gemini returns the object as .text (stringified JSON)
-        result = json.loads(response.text)
-        return result
+    prompt = builder.build()
+
+    # ---------- CALL GEMINI ----------
+    # Truncated or chatty JSON is repaired locally; only unrecoverable
+    # output is re-requested.
+    try:
+        return generate_structured(prompt)
 
     except Exception as e:
         # ---------- FALLBACK ----------
@@ -93,4 +102,6 @@ Provide:
             "tone": "professional",
             "summary": f"Gemini categorization failed: {str(e)}",
             "hidden_intent": "undetermined",
+            "degraded": True,
+            "degraded_reason": degraded_reason(e),
         }
@@ -1,9 +1,24 @@
 """
-Gemini client configuration and model initialization for Professor Inbox Copilot
+LLM client configuration and model initialization for Professor Inbox Copilot
+
+Nothing heavy happens at import: the google SDK is imported, configured and
+the model objects are built on first use (thread-safe), so importing a
+workflow module is cheap and a missing GEMINI_API_KEY only fails the calls
+that actually need Gemini.
+
+generate_content() picks the provider and model per workflow through
+app.llm.router (see providers.py for Gemini / Anthropic / offline stub).
 """
 
+import contextlib
 import os
-import google.generativeai as genai
+import random
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
 from dotenv import load_dotenv
 
 # Load environment variables (.env)
@@ -12,39 +27,80 @@ load_dotenv()
 # Retrieve API key
 api_key = os.getenv("GEMINI_API_KEY")
 
-if not api_key:
-    raise RuntimeError(
-        "❌ GEMINI_API_KEY not found. "
-        "Please add to your .env file:\n\n  GEMINI_API_KEY=your_key_here\n"
-    )
-
-# Configure SDK
-genai.configure(api_key=api_key)
+_MISSING_KEY_MESSAGE = (
+    "❌ GEMINI_API_KEY not found. "
+    "Please add to your .env file:\n\n  GEMINI_API_KEY=your_key_here\n"
+)
 
 # ---------------------------
 # Preferred model for backend
 # ---------------------------
 DEFAULT_MODEL_NAME = "gemini-2.0-flash"   # Fast & cheap for production
 # Alternate option: "gemini-2.0-pro"     # Slower, more accurate
+EMBEDDING_MODEL_NAME = "models/embedding-001"   # Vector embeddings for RAG search
+# Used when the default model keeps failing; empty disables the fallback
+FALLBACK_MODEL_NAME = os.getenv("GEMINI_FALLBACK_MODEL", "gemini-2.5-flash")
+
+# Resilience settings
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
 
 
-# Create a reusable model instance
-_model_instance = genai.GenerativeModel(DEFAULT_MODEL_NAME)
+_genai = None
+_models: dict = {}
+_init_lock = threading.Lock()
+init_timings_ms: dict[str, float] = {}
+
+
+def get_genai():
+    """
+    The configured ``google.generativeai`` module, imported on first use.
+
+    Raises:
+        RuntimeError: GEMINI_API_KEY is not set
+    """
+    global _genai
+    if _genai is not None:
+        return _genai
+    with _init_lock:
+        if _genai is None:
+            if not api_key:
+                raise RuntimeError(_MISSING_KEY_MESSAGE)
+            started = time.perf_counter()
+            import google.generativeai as genai
+
+            genai.configure(api_key=api_key)
+            init_timings_ms["sdk_import_and_configure"] = round((time.perf_counter() - started) * 1000, 1)
+            _genai = genai
+    return _genai
 
 
-def get_model():
+def get_model(name: Optional[str] = None):
     """
     Retrieve the configured Gemini model instance.
     Safe to call repeatedly — returns a cached object.
     """
-    return _model_instance
+    name = name or DEFAULT_MODEL_NAME
+    model = _models.get(name)
+    if model is not None:
+        return model
+    genai = get_genai()
+    with _init_lock:
+        if name not in _models:
+            _models[name] = genai.GenerativeModel(name)
+        return _models[name]
 
 
 def is_configured() -> bool:
     """
-    Verify that Gemini can be used (API key present and non-empty).
+    Verify that Gemini can be used (API key present and non-empty), or that
+    every workflow is routed to the offline stub.
     """
-    return bool(api_key)
+    return bool(api_key) or os.getenv("LLM_PROVIDER", "").strip().lower() == "stub"
 
 
 def list_available_models():
@@ -53,7 +109,7 @@ def list_available_models():
     Filters to only models supporting generateContent.
     """
     try:
-        models = genai.list_models()
+        models = get_genai().list_models()
         usable = [
             m.name
             for m in models
@@ -63,68 +119,315 @@ def list_available_models():
         return sorted(usable)
     except Exception as e:
         return [f"Error listing models: {str(e)}"]
-"""
-Gemini client configuration and model initialization for Professor Inbox Copilot
-"""
 
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
 
-# Load environment variables (.env)
-load_dotenv()
+def cancel_stream(response) -> None:
+    """
+    Cancel an in-flight streaming ``generate_content`` call so the provider
+    stops generating (and billing) tokens nobody will read.
+    Safe to call on finished or non-streaming responses.
+    """
+    from .providers import get_provider
 
-# Retrieve API key
-api_key = os.getenv("GEMINI_API_KEY")
+    provider = get_provider(getattr(response, "provider", "gemini"))
+    raw = getattr(response, "response", response)     # unwrap LLMResponse
+    try:
+        provider.cancel(raw)
+    except Exception:
+        pass
+    if isinstance(response, LLMResponse):
+        response.close()
 
-if not api_key:
-    raise RuntimeError(
-        "❌ GEMINI_API_KEY not found. "
-        "Please add to your .env file:\n\n  GEMINI_API_KEY=your_key_here\n"
-    )
 
-# Configure SDK
-genai.configure(api_key=api_key)
+# ---------------------------------------------------
+# Resilient calls: deadlines, retries, circuit breaker, fallback model
+# ---------------------------------------------------
+class LLMUnavailableError(RuntimeError):
+    """
+    No model produced a response (outage, open circuit, deadline or a
+    non-retryable error). Callers should return a result marked
+    ``"degraded": True`` and leave the work to be retried later.
+    """
 
-# ---------------------------
-# Preferred model for backend
-# ---------------------------
-DEFAULT_MODEL_NAME = "gemini-2.0-flash"   # Fast & cheap for production
-# Alternate option: "gemini-2.0-pro"     # Slower, more accurate
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason            # "circuit_open" | "deadline" | "error" | "not_configured"
 
 
-# Create a reusable model instance
-_model_instance = genai.GenerativeModel(DEFAULT_MODEL_NAME)
+# Transient by class name (google.api_core / requests / builtins), so no
+# SDK internals need importing here.
+_TRANSIENT_ERRORS = {
+    "ServiceUnavailable", "TooManyRequests", "ResourceExhausted", "DeadlineExceeded",
+    "InternalServerError", "GatewayTimeout", "BadGateway", "Aborted", "RetryError",
+    "ConnectionError", "Timeout", "ReadTimeout", "TimeoutError",
+    # anthropic
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "OverloadedError",
+}
+_TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
 
 
-def get_model():
-    """
-    Retrieve the configured Gemini model instance.
-    Safe to call repeatedly — returns a cached object.
-    """
-    return _model_instance
+def is_transient(error: Exception) -> bool:
+    if any(cls.__name__ in _TRANSIENT_ERRORS for cls in type(error).__mro__):
+        return True
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return code in _TRANSIENT_STATUS
 
 
-def is_configured() -> bool:
+class CircuitBreaker:
     """
-    Verify that Gemini can be used (API key present and non-empty).
+    Opens after ``failure_threshold`` consecutive failures and fails fast
+    until ``reset_timeout`` passes. Then a single trial call is let through
+    (half-open); success closes the circuit, failure re-opens it.
     """
-    return bool(api_key)
 
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
 
-def list_available_models():
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+@dataclass
+class LLMResponse:
+    """A model response plus how it was obtained."""
+
+    response: object
+    model: str
+    attempts: int
+    fallback: bool = False
+    provider: str = "gemini"
+    _release: Optional[Callable[[], None]] = field(default=None, repr=False, compare=False)
+
+    @property
+    def text(self) -> str:
+        return self.response.text
+
+    @property
+    def usage_metadata(self):
+        return getattr(self.response, "usage_metadata", None)
+
+    def hold(self, release: Callable[[], None]) -> None:
+        """Call ``release`` once the stream is read to the end, closed or garbage-collected."""
+        self._release = weakref.finalize(self, release)
+
+    def close(self) -> None:
+        if self._release is not None:
+            self._release()
+
+    def __iter__(self):
+        try:
+            yield from self.response
+        finally:
+            self.close()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_client_stats = {"calls": 0, "retries": 0, "failures": 0, "fallbacks": 0, "short_circuited": 0, "deadline_exceeded": 0}
+_route_calls: dict[str, int] = {}
+_client_lock = threading.Lock()
+
+
+def _breaker(model_name: str) -> CircuitBreaker:
+    with _client_lock:
+        if model_name not in _breakers:
+            _breakers[model_name] = CircuitBreaker()
+        return _breakers[model_name]
+
+
+def _count(event: str, n: int = 1) -> None:
+    with _client_lock:
+        _client_stats[event] += n
+
+
+def _count_route(name: str) -> None:
+    with _client_lock:
+        _route_calls[name] = _route_calls.get(name, 0) + 1
+
+
+def _call_model(route, prompt, deadline_at: float, stream: bool, generation_config=None, prefix=None) -> LLMResponse:
+    from .providers import get_provider
+
+    name = str(route)
+    breaker = _breaker(name)
+    provider = get_provider(route.provider)
+    try:
+        provider.prepare(route.model)
+    except RuntimeError as e:
+        raise LLMUnavailableError(str(e), "not_configured") from e
+    attempts = 0
+    last_error: Optional[Exception] = None
+
+    while attempts <= (0 if stream else LLM_MAX_RETRIES):
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            _count("deadline_exceeded")
+            raise LLMUnavailableError(f"{name}: deadline exceeded after {attempts} attempt(s)", "deadline")
+        if not breaker.allow():
+            _count("short_circuited")
+            raise LLMUnavailableError(f"{name}: circuit open", "circuit_open")
+
+        attempts += 1
+        try:
+            response = provider.generate(
+                route.model, prompt, generation_config=generation_config, stream=stream,
+                timeout=remaining, prefix=prefix,
+            )
+            breaker.record_success()
+            _count_route(name)
+            return LLMResponse(response=response, model=route.model, attempts=attempts, provider=route.provider)
+        except Exception as e:
+            last_error = e
+            if not is_transient(e):
+                # Bad request / safety block: retrying or tripping the breaker won't help.
+                breaker.record_success()
+                raise LLMUnavailableError(f"{name}: {e}", "error") from e
+            breaker.record_failure()
+
+        if attempts <= LLM_MAX_RETRIES and not stream:
+            # Full jitter keeps a burst of workers from retrying in lockstep.
+            backoff = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** (attempts - 1)))
+            if time.monotonic() + backoff >= deadline_at:
+                break
+            _count("retries")
+            time.sleep(backoff)
+
+    raise LLMUnavailableError(f"{name}: {last_error}", "error") from last_error
+
+
+def generate_content(
+    prompt,
+    *,
+    workflow: Optional[str] = None,
+    input_tokens: Optional[int] = None,
+    deadline: float = LLM_DEADLINE_SECONDS,
+    stream: bool = False,
+    generation_config: Optional[dict] = None,
+    prefix=None,
+) -> LLMResponse:
     """
-    Return a list of available Gemini models that support text generation.
-    Filters to only models supporting generateContent.
+    Generate with the model routed for ``workflow`` (see app.llm.router),
+    with a per-call deadline, jittered exponential retries on transient
+    errors, a per-model circuit breaker and a fallback model.
+
+    Streaming calls are not retried (tokens may already have been shown)
+    but still honour the deadline and the breaker. Their queue slot is held
+    until the stream is read to the end or closed (cancel_stream).
+
+    Each call first waits for a slot in the LLM work queue
+    (app/workers/llm_queue.py) under the caller's ``llm_priority()``.
+
+    Args:
+        workflow: Workflow name used for routing; None uses the default model
+        input_tokens: Estimated prompt size, for size-based routing
+        prefix: The PromptPrefix ``prompt`` starts with, for provider-side caching
+
+    Returns:
+        LLMResponse (``.fallback`` is True when the secondary model answered)
+
+    Raises:
+        LLMUnavailableError: no model could answer; the caller's result is degraded
     """
+    from app.workers.llm_queue import (
+        INTERACTIVE, LLM_QUEUE_BACKGROUND_TIMEOUT, QueueTimeout, current_priority, get_llm_queue,
+    )
+
+    _count("calls")
+    started = time.monotonic()
+    # Interactive calls spend part of their deadline waiting for admission;
+    # background calls may queue for longer and then get the full deadline.
+    interactive = current_priority()[0] == INTERACTIVE
+    slot = contextlib.ExitStack()
     try:
-        models = genai.list_models()
-        usable = [
-            m.name
-            for m in models
-            if hasattr(m, "supported_generation_methods")
-            and "generateContent" in m.supported_generation_methods
-        ]
-        return sorted(usable)
-    except Exception as e:
-        return [f"Error listing models: {str(e)}"]
+        slot.enter_context(get_llm_queue().slot(timeout=deadline if interactive else LLM_QUEUE_BACKGROUND_TIMEOUT))
+    except QueueTimeout as e:
+        _count("deadline_exceeded")
+        _count("failures")
+        raise LLMUnavailableError(str(e), "deadline") from e
+
+    try:
+        remaining = deadline - (time.monotonic() - started) if interactive else deadline
+        result = _generate(prompt, workflow, input_tokens, remaining, stream, generation_config, prefix)
+    except BaseException:
+        slot.close()
+        raise
+    if not stream:
+        slot.close()
+        return result
+    # Tokens are generated while the caller reads: keep the slot until then
+    result.hold(slot.close)
+    return result
+
+
+def _generate(prompt, workflow, input_tokens, deadline, stream, generation_config, prefix) -> LLMResponse:
+    from .router import route_for
+
+    deadline_at = time.monotonic() + deadline
+    primary, *fallbacks = route_for(workflow, input_tokens)
+    try:
+        return _call_model(primary, prompt, deadline_at, stream, generation_config, prefix)
+    except LLMUnavailableError as primary_error:
+        if not fallbacks:
+            _count("failures")
+            raise
+        # Give the fallback a fresh (shorter) window if the primary used it up.
+        fallback_deadline = max(deadline_at, time.monotonic() + deadline / 2)
+        try:
+            result = _call_model(fallbacks[0], prompt, fallback_deadline, stream, generation_config, prefix)
+        except LLMUnavailableError:
+            _count("failures")
+            raise primary_error
+        _count("fallbacks")
+        result.fallback = True
+        return result
+
+
+def degraded_reason(error: Exception) -> str:
+    """Reason to report alongside ``"degraded": True`` for a failed call."""
+    return getattr(error, "reason", "invalid_output")
+
+
+def client_stats() -> dict:
+    with _client_lock:
+        stats = dict(_client_stats)
+        breakers = {name: {"state": b.state, "failures": b.failures} for name, b in _breakers.items()}
+        routes = dict(_route_calls)
+    return {
+        "model": DEFAULT_MODEL_NAME,
+        "fallback_model": FALLBACK_MODEL_NAME or None,
+        **stats,
+        "calls_by_model": routes,
+        "breakers": breakers,
+    }
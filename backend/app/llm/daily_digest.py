@@ -2,86 +2,123 @@
 Daily digest generation workflow using Gemini
 """
 
-import json
-import google.generativeai as genai
-from .client import get_model
-from .schemas import daily_digest_schema
+from .client import degraded_reason
+from .cache import llm_cache
+from .prompting import PromptBuilder
+from .structured import generate_structured
 
 
-def daily_digest(digest_inputs: list[str]) -> dict:
+@llm_cache("daily_digest", prompt_version=5)
+def daily_digest(digest_inputs: list[str], totals: str = None) -> dict:
     """
     Generate a daily digest of all messages for the professor.
 
+    Counting is left to the caller: the model writes the narrative only, and
+    category counts / priority distribution come from the database (see
+    app/workers/digests.py), passed in ``totals`` for context.
+
     Args:
-        digest_inputs: List of string summaries or JSON-like strings for each email
+        digest_inputs: List of string summaries or JSON-like strings for each
+            email (most important first), or on busy days one summary per
+            group of emails (see summarize_digest_chunk)
+        totals: The day's exact counts, as text
 
     Returns:
         dict containing:
             - summary (str)
-            - categories (dict)
             - high_priority (list)
             - common_themes (list)
             - recommendations (list)
-            - statistics (dict)
     """
 
-    model = get_model()
-
-    # Join entries safely into a block
-    formatted_inputs = "\n".join(f"- {item}" for item in digest_inputs)
-
-    prompt = f"""
-    You are an AI assistant generating a professional daily digest for a university professor.
-
-    Below is a list of student email summaries and metadata from today:
-
-    {formatted_inputs}
-
-    Produce a comprehensive JSON digest with the following fields:
-
-    {{
-        "summary": string,                               # High-level overview
-        "categories": {{                                 # Counts or lists per category
-            "<category>": int
-        }},
-        "high_priority": [string],                       # Items requiring immediate attention
-        "common_themes": [string],                       # Repeated issues/questions
-        "recommendations": [string],                     # Actionable next steps
-        "statistics": {{
-            "total_emails": int,
-            "priority_distribution": {{
-                "low": int,
-                "medium": int,
-                "high": int
-            }}
-        }}
-    }}
-
-    Guidelines:
-    - Be professional, concise, and actionable.
-    - Highlight urgent matters clearly.
-    - Identify patterns from recurring student messages.
-    - Provide useful next steps for the professor.
-    - Ensure all JSON fields are present and valid.
-    """
 
-    try:
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-                response_schema=daily_digest_schema,
-            ),
-        )
+    # Entries beyond the input budget are dropped (callers pass the most
+    # important first) and noted in the prompt.
+    builder = PromptBuilder("daily_digest").text(
+        "You are an AI assistant generating a professional daily digest for a university professor.\n"
+    )
+    if totals:
+        builder.text(f"Today's totals (exact; do not recount):\n{totals}\n")
+    prompt = (
+        builder
+        .text("Below is a list of student email summaries and metadata from today "
+              "(the most urgent and representative ones; an entry may summarize a whole group of emails):\n")
+        .items("emails", [f"- {item}" for item in digest_inputs])
+        .text("""
+Produce a JSON digest with the following fields:
+
+{
+    "summary": string,                               # High-level overview
+    "high_priority": [string],                       # Items requiring immediate attention
+    "common_themes": [string],                       # Repeated issues/questions
+    "recommendations": [string]                      # Actionable next steps
+}
+
+Guidelines:
+- Be professional, concise, and actionable.
+- Highlight urgent matters clearly.
+- Identify patterns from recurring student messages.
+- Provide useful next steps for the professor.
+- Ensure all JSON fields are present and valid.""")
+        .build()
+    )
 
-        return json.loads(response.text)
+    try:
+        return generate_structured(prompt)
 
     except Exception as e:
         return {
             "summary": "Daily digest generation failed.",
             "error": str(e),
+            "degraded": True,
+            "degraded_reason": degraded_reason(e),
             "recommendations": [
                 "Review the individual emails manually.",
                 "Retry digest generation once the LLM is available."
             ]
         }
+
+
+@llm_cache("digest_chunk", prompt_version=1)
+def summarize_digest_chunk(group: str, digest_inputs: list[str]) -> dict:
+    """
+    Map step of the hierarchical digest: summarize one group of emails
+    (same category, threads kept together) for the final daily_digest pass.
+
+    Args:
+        group: The group's label, e.g. its category
+        digest_inputs: Per-email summaries, as for daily_digest
+
+    Returns:
+        dict with summary, high_priority and common_themes
+    """
+    prompt = (
+        PromptBuilder("digest_chunk")
+        .text("You are an AI assistant preparing part of a daily digest for a university professor.\n")
+        .text(f"Below are summaries of today's student emails in the group \"{group}\":\n")
+        .items("emails", [f"- {item}" for item in digest_inputs])
+        .text("""
+Summarize this group as JSON:
+
+{
+    "summary": string,                               # What these emails are about, in 2-4 sentences
+    "high_priority": [string],                       # Items in this group requiring immediate attention
+    "common_themes": [string]                        # Repeated issues/questions in this group
+}
+
+Guidelines:
+- Be concise; this summary is combined with other groups later.
+- Name specific deadlines, assignments and requests.
+- Ensure all JSON fields are present and valid.""")
+        .build()
+    )
+
+    try:
+        return generate_structured(prompt)
+
+    except Exception as e:
+        return {
+            "summary": f"{len(digest_inputs)} emails ({group}); summary unavailable.",
+            "degraded": True,
+            "degraded_reason": degraded_reason(e),
+        }
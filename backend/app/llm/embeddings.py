@@ -0,0 +1,56 @@
+"""
+Text embeddings for RAG search using Gemini (embedding-001)
+
+With LLM_PROVIDER=stub, deterministic hashed vectors are used instead so
+indexing and retrieval run offline.
+"""
+from .client import EMBEDDING_MODEL_NAME, get_genai
+from .router import LLM_PROVIDER
+
+
+def embed_query(text: str) -> list[float]:
+    """
+    Embed a professor's question for retrieval.
+
+    Args:
+        text: The query text
+
+    Returns:
+        The embedding vector
+    """
+    if LLM_PROVIDER == "stub":
+        from .providers import StubProvider
+
+        return StubProvider.embed([text])[0]
+
+    result = get_genai().embed_content(
+        model=EMBEDDING_MODEL_NAME,
+        content=text,
+        task_type="retrieval_query",
+    )
+    return result["embedding"]
+
+
+def embed_documents(texts: list[str]) -> list[list[float]]:
+    """
+    Embed email chunks for storage in the embeddings table.
+
+    Args:
+        texts: Chunk texts to embed in one request
+
+    Returns:
+        One embedding vector per input text, in order
+    """
+    if not texts:
+        return []
+    if LLM_PROVIDER == "stub":
+        from .providers import StubProvider
+
+        return StubProvider.embed(texts)
+
+    result = get_genai().embed_content(
+        model=EMBEDDING_MODEL_NAME,
+        content=texts,
+        task_type="retrieval_document",
+    )
+    return result["embedding"]
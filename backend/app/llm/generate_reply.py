@@ -1,78 +1,157 @@
 """
 Reply generation workflow using Gemini
 """
-import json
-import google.generativeai as genai
-from .client import get_model
-from .schemas import generate_reply_schema
+import time
+from typing import Iterator
 
+from .client import cancel_stream, degraded_reason, generate_content
+from .cache import llm_cache
+from .prompting import Prompt, PromptBuilder, budget_for, record_usage, truncate_head_tail
+from .prompt_prefix import ProfessorContext, PromptPrefix, get_prefix
+from .structured import generate_structured
 
-def generate_reply(email_text: str, category: str, policies: str, professor_tone: str, thread_summary: str) -> dict:
+
+def reply_prefix(professor: ProfessorContext) -> PromptPrefix:
+    """
+    Instructions, guidelines and the professor's tone, policies and
+    signature: the part of every reply prompt that does not depend on the
+    email. Compiled once per professor and dropped when their preferences
+    change.
+    """
+
+    def render() -> str:
+        # Long policy documents get at most a third of the input budget.
+        policies = truncate_head_tail(professor.policies, budget_for("generate_reply")[0] // 3)
+        lines = [
+            "You are an AI assistant helping a professor write email replies to students. "
+            "Generate a professional, helpful response.\n",
+            "Course policies:",
+            policies,
+            f"Professor's preferred tone: {professor.tone}",
+        ]
+        if professor.reply_length:
+            lines.append(f"Preferred reply length: {professor.reply_length}")
+        if professor.signature:
+            lines.append(f"Sign the reply with exactly this signature:\n{professor.signature}")
+        lines.append(f"""
+Guidelines for the reply:
+- Be {professor.tone} in tone
+- Reference relevant course policies when applicable
+- Provide clear, actionable guidance
+- Be encouraging and supportive
+- Keep the response concise but comprehensive
+- If it's a question, provide a direct answer
+- If it's a request, clearly state next steps
+- Sign off appropriately for an academic context
+
+Depending on the email category:
+- academic_question: Provide educational guidance and point to resources
+- administrative: Reference policies and provide clear procedures
+- technical_issue: Offer troubleshooting steps or direct to support
+- personal_matter: Show empathy and provide accommodation options
+- appointment_request: Suggest times or direct to scheduling system
+- clarification: Provide clear, detailed explanations
+- complaint: Address concerns professionally and offer solutions
+""")
+        return "\n".join(lines)
+
+    parts = (professor.tone, professor.policies, professor.signature, professor.reply_length)
+    return get_prefix("generate_reply", parts, render, owner=professor.user_id)
+
+
+def _build_prompt(
+    email_text: str,
+    category: str,
+    thread_summary: str,
+    professor: ProfessorContext,
+    output_instructions: str,
+) -> Prompt:
+    # Email and thread context share what the prefix leaves of the budget
+    return (
+        PromptBuilder("generate_reply")
+        .prefix(reply_prefix(professor))
+        .text("Thread context:")
+        .body("thread_summary", thread_summary)
+        .text(f"\nEmail category: {category}")
+        .text("Original email:")
+        .body("email", email_text)
+        .text(f"\n{output_instructions}")
+        .build()
+    )
+
+
+@llm_cache("generate_reply", prompt_version=3)
+def generate_reply(email_text: str, category: str, thread_summary: str, professor: ProfessorContext) -> dict:
     """
     Generate a policy-aware, tone-aligned draft reply
     
     Args:
         email_text: The original email to reply to
         category: Email category from categorization
-        policies: Course policies and guidelines
-        professor_tone: Preferred tone (professional, friendly, formal)
         thread_summary: Summary of previous thread context
+        professor: Tone, course policies and signature (ProfessorContext.from_user)
     
     Returns:
         Dictionary with draft reply and reasoning
     """
-    model = get_model()
     
-    # Build the prompt
-    prompt = f"""
-    You are an AI assistant helping a professor write email replies to students. Generate a professional, helpful response.
+    prompt = _build_prompt(
+        email_text, category, thread_summary, professor,
+        "Please generate a draft reply and explain your reasoning for the approach taken.",
+    )
 
-    Original email:
-    {email_text}
-    
-    Email category: {category}
-    Course policies: {policies}
-    Professor's preferred tone: {professor_tone}
-    Thread context: {thread_summary}
-    
-    Guidelines for the reply:
-    - Be {professor_tone} in tone
-    - Reference relevant course policies when applicable
-    - Provide clear, actionable guidance
-    - Be encouraging and supportive
-    - Keep the response concise but comprehensive
-    - If it's a question, provide a direct answer
-    - If it's a request, clearly state next steps
-    - Sign off appropriately for an academic context
-    
-    Based on the category "{category}":
-    - academic_question: Provide educational guidance and point to resources
-    - administrative: Reference policies and provide clear procedures
-    - technical_issue: Offer troubleshooting steps or direct to support
-    - personal_matter: Show empathy and provide accommodation options
-    - appointment_request: Suggest times or direct to scheduling system
-    - clarification: Provide clear, detailed explanations
-    - complaint: Address concerns professionally and offer solutions
-    
-    Please generate a draft reply and explain your reasoning for the approach taken.
-    """
-    
     try:
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-                response_schema=generate_reply_schema
-            )
-        )
-        
-        # Parse the JSON response
-        result = json.loads(response.text)
-        return result
-        
+        return generate_structured(prompt)
+
     except Exception as e:
         # Return a fallback response if Gemini fails
         return {
             "draft": f"Thank you for your email. I'll review your message and get back to you soon. (Reply generation failed: {str(e)})",
-            "reasoning": "Fallback response due to generation error"
-        }
\ No newline at end of file
+            "reasoning": "Fallback response due to generation error",
+            "degraded": True,
+            "degraded_reason": degraded_reason(e)
+        }
+
+
+def generate_reply_stream(
+    email_text: str, category: str, thread_summary: str, professor: ProfessorContext
+) -> Iterator[str]:
+    """
+    Streaming variant of generate_reply: yields the draft as Gemini writes it.
+
+    The draft is plain text (no JSON envelope or reasoning). Closing the
+    generator cancels the upstream Gemini call.
+
+    Yields:
+        Draft text fragments, in order
+    """
+    prompt = _build_prompt(
+        email_text, category, thread_summary, professor,
+        "Reply with only the text of the email draft, ready to send.",
+    )
+
+    started = time.perf_counter()
+    response = generate_content(
+        prompt.text,
+        workflow=prompt.workflow,
+        input_tokens=prompt.input_tokens,
+        prefix=prompt.prefix,
+        stream=True,
+        generation_config=dict(max_output_tokens=prompt.max_output_tokens),
+    )
+    parts, last_chunk = [], None
+    try:
+        for chunk in response:
+            last_chunk = chunk
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk without text parts (e.g. only safety metadata)
+                continue
+            if text:
+                parts.append(text)
+                yield text
+    finally:
+        # GeneratorExit on client disconnect lands here; stop Gemini too.
+        cancel_stream(response)
+        record_usage(prompt, last_chunk, output_text="".join(parts), started=started)
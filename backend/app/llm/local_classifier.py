@@ -0,0 +1,507 @@
+"""
+Local fast-path email classifier trained on past Gemini labels
+
+A multinomial logistic regression over signed, hashed word n-grams, trained
+in pure NumPy on the ``category``/``urgency`` labels categorize_email has
+already written to the emails table. Confident
+predictions are applied directly. Anything below
+``LOCAL_CLASSIFIER_THRESHOLD`` is escalated to categorize_email. A small
+shadow sample of confident predictions also goes to Gemini, so agreement
+with the LLM stays measurable in production.
+
+There is one model per deployment, shared by every user: it is trained on
+all users' labels and serves all users. Training reads up to 50k emails
+and replaces that shared model, so it is an operator job rather than an
+API route:
+
+    python -m app.llm.local_classifier [--limit 50000] [--holdout 0.2]
+
+The model is saved to ``LOCAL_CLASSIFIER_PATH`` and reloaded by the API
+workers when the file changes.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+LOCAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_CLASSIFIER_ENABLED", "true").lower() == "true"
+LOCAL_CLASSIFIER_PATH = os.getenv(
+    "LOCAL_CLASSIFIER_PATH", os.path.join(os.getcwd(), ".local_classifier", "model.npz")
+)
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.85"))
+LOCAL_CLASSIFIER_SHADOW_RATE = float(os.getenv("LOCAL_CLASSIFIER_SHADOW_RATE", "0.05"))
+LOCAL_CLASSIFIER_MIN_EXAMPLES = int(os.getenv("LOCAL_CLASSIFIER_MIN_EXAMPLES", "200"))
+
+HASH_BITS = 17
+_DIM = 1 << HASH_BITS
+_SIGN_BIT = 1 << 31
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+_SWEEP_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95)
+_RELOAD_CHECK_SECONDS = 30.0
+
+# Priority bands from CATEGORIZATION_GUIDELINES; confidence is measured on
+# the band, since neighbouring scores (e.g. 5 vs 6) are interchangeable.
+PRIORITY_BANDS = ((1, 3), (4, 6), (7, 8), (9, 10))
+
+
+def priority_band(score: int) -> int:
+    for band, (low, high) in enumerate(PRIORITY_BANDS):
+        if score <= high:
+            return band
+    return len(PRIORITY_BANDS) - 1
+
+
+# ---------------------------------------------------
+# Features
+# ---------------------------------------------------
+def featurize(text: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Hashed unigram + bigram features, sublinear tf, L2-normalised.
+
+    Returns:
+        (indices int32, values float32) of the non-zero features
+    """
+    tokens = _TOKEN_RE.findall((text or "").lower())
+    counts: dict[int, float] = {}
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for gram in grams:
+        h = zlib.crc32(gram.encode("utf-8"))
+        index = h & (_DIM - 1)
+        counts[index] = counts.get(index, 0.0) + (1.0 if h & _SIGN_BIT else -1.0)
+
+    if not counts:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    indices = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    values = np.sign(values) * np.log1p(np.abs(values))
+    norm = np.linalg.norm(values)
+    return indices, values / norm if norm else values
+
+
+@dataclass
+class SparseRows:
+    """CSR-style batch of featurized texts."""
+
+    indptr: np.ndarray
+    indices: np.ndarray
+    values: np.ndarray
+
+    @classmethod
+    def from_texts(cls, texts: Sequence[str]) -> "SparseRows":
+        features = [featurize(text) for text in texts]
+        lengths = np.fromiter((len(i) for i, _ in features), dtype=np.int64, count=len(features))
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        indices = np.concatenate([i for i, _ in features]) if features else np.zeros(0, np.int32)
+        values = np.concatenate([v for _, v in features]) if features else np.zeros(0, np.float32)
+        return cls(indptr, indices, values)
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def gather(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Non-zeros of the given rows as (indices, values, row position)."""
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        segment = np.repeat(np.arange(len(rows)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + offsets
+        return self.indices[positions], self.values[positions], segment
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+# ---------------------------------------------------
+# Model
+# ---------------------------------------------------
+class LinearHead:
+    """Softmax regression over hashed features, trained with mini-batch SGD."""
+
+    def __init__(self, labels: Sequence, weights: Optional[np.ndarray] = None, bias: Optional[np.ndarray] = None):
+        self.labels = list(labels)
+        self.weights = weights if weights is not None else np.zeros((_DIM, len(self.labels)), np.float32)
+        self.bias = bias if bias is not None else np.zeros(len(self.labels), np.float32)
+
+    def fit(
+        self,
+        rows: SparseRows,
+        targets: np.ndarray,
+        epochs: int = 8,
+        learning_rate: float = 0.5,
+        l2: float = 1e-5,
+        batch_size: int = 64,
+        seed: int = 0,
+    ) -> None:
+        rng = np.random.default_rng(seed)
+        n = len(rows)
+        for _ in range(epochs):
+            order = rng.permutation(n)
+            for start in range(0, n, batch_size):
+                batch = order[start:start + batch_size]
+                indices, values, segment = rows.gather(batch)
+                logits = np.zeros((len(batch), len(self.labels)), np.float32)
+                np.add.at(logits, segment, self.weights[indices] * values[:, None])
+                error = _softmax(logits + self.bias)
+                error[np.arange(len(batch)), targets[batch]] -= 1.0
+
+                # Per-example (summed) updates: a hashed feature appears in few
+                # rows, so averaging over the batch would starve its weight.
+                gradient = error[segment] * values[:, None] + l2 * self.weights[indices]
+                np.add.at(self.weights, indices, -learning_rate * gradient)
+                self.bias -= learning_rate * error.mean(axis=0)
+            learning_rate *= 0.7
+
+    def predict_proba(self, indices: np.ndarray, values: np.ndarray) -> np.ndarray:
+        return _softmax(values @ self.weights[indices] + self.bias)
+
+
+@dataclass
+class LocalPrediction:
+    category: str
+    priority_score: int
+    category_confidence: float
+    priority_confidence: float
+    latency_us: float
+
+    @property
+    def confidence(self) -> float:
+        return min(self.category_confidence, self.priority_confidence)
+
+    def agrees_with(self, result: dict) -> bool:
+        """Same category and priority band as a categorize_email result."""
+        try:
+            score = int(round(float(result.get("priority_score", 5))))
+        except (TypeError, ValueError):
+            return False
+        return result.get("category") == self.category and priority_band(score) == priority_band(self.priority_score)
+
+    def to_result(self) -> dict:
+        """Shaped like a categorize_email result (no LLM-only fields)."""
+        return {
+            "category": self.category,
+            "priority_score": self.priority_score,
+            "tone": None,
+            "summary": None,
+            "confidence": round(self.confidence, 4),
+            "source": "local",
+        }
+
+
+class LocalClassifier:
+    def __init__(self, category: LinearHead, priority: LinearHead, meta: Optional[dict] = None):
+        self.category = category
+        self.priority = priority
+        self.meta = meta or {}
+        self._band_of = np.array([priority_band(int(p)) for p in priority.labels])
+
+    def predict(self, text: str) -> LocalPrediction:
+        started = time.perf_counter()
+        indices, values = featurize(text)
+        category_probs = self.category.predict_proba(indices, values)
+        priority_probs = self.priority.predict_proba(indices, values)
+
+        best_category = int(category_probs.argmax())
+        best_priority = int(priority_probs.argmax())
+        band_mass = priority_probs[self._band_of == self._band_of[best_priority]].sum()
+        return LocalPrediction(
+            category=self.category.labels[best_category],
+            priority_score=int(self.priority.labels[best_priority]),
+            category_confidence=float(category_probs[best_category]),
+            priority_confidence=float(band_mass),
+            latency_us=(time.perf_counter() - started) * 1e6,
+        )
+
+    # ---------- persistence ----------
+    def save(self, path: str = LOCAL_CLASSIFIER_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            category_weights=self.category.weights,
+            category_bias=self.category.bias,
+            category_labels=np.array(self.category.labels),
+            priority_weights=self.priority.weights,
+            priority_bias=self.priority.bias,
+            priority_labels=np.array(self.priority.labels, dtype=np.int64),
+            meta=np.array(json.dumps(self.meta)),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = LOCAL_CLASSIFIER_PATH) -> "LocalClassifier":
+        with np.load(path) as data:
+            category = LinearHead(
+                [str(label) for label in data["category_labels"]],
+                data["category_weights"],
+                data["category_bias"],
+            )
+            priority = LinearHead(
+                [int(label) for label in data["priority_labels"]],
+                data["priority_weights"],
+                data["priority_bias"],
+            )
+            meta = json.loads(str(data["meta"]))
+        return cls(category, priority, meta)
+
+
+# ---------------------------------------------------
+# Training + evaluation
+# ---------------------------------------------------
+def fit_classifier(texts: Sequence[str], categories: Sequence[str], priorities: Sequence[int], seed: int = 0) -> LocalClassifier:
+    rows = SparseRows.from_texts(texts)
+    category_labels = sorted(set(categories))
+    priority_labels = sorted(set(int(p) for p in priorities))
+
+    category = LinearHead(category_labels)
+    category.fit(rows, np.array([category_labels.index(c) for c in categories]), seed=seed)
+    priority = LinearHead(priority_labels)
+    priority.fit(rows, np.array([priority_labels.index(int(p)) for p in priorities]), seed=seed)
+    return LocalClassifier(category, priority)
+
+
+def evaluate(model: LocalClassifier, texts: Sequence[str], categories: Sequence[str], priorities: Sequence[int]) -> dict:
+    """
+    Agreement with the LLM labels on held-out emails, overall and per
+    confidence threshold (escalation rate vs. agreement on what stays local).
+    """
+    predictions = [model.predict(text) for text in texts]
+    labels = [{"category": c, "priority_score": p} for c, p in zip(categories, priorities)]
+    agree = [p.agrees_with(label) for p, label in zip(predictions, labels)]
+    n = len(predictions)
+
+    sweep = []
+    for threshold in _SWEEP_THRESHOLDS:
+        local = [a for p, a in zip(predictions, agree) if p.confidence >= threshold]
+        sweep.append({
+            "threshold": threshold,
+            "escalation_rate": round(1 - len(local) / n, 4) if n else 0.0,
+            "local_agreement": round(sum(local) / len(local), 4) if local else None,
+        })
+
+    latencies = sorted(p.latency_us for p in predictions)
+    return {
+        "examples": n,
+        "category_accuracy": round(sum(p.category == c for p, c in zip(predictions, categories)) / n, 4) if n else None,
+        "agreement": round(sum(agree) / n, 4) if n else None,
+        "p50_latency_us": round(latencies[n // 2], 1) if n else None,
+        "thresholds": sweep,
+    }
+
+
+def training_examples(db, limit: int = 50000) -> tuple[list[str], list[str], list[int]]:
+    """LLM-written labels from the emails table (excludes local/near-duplicate ones)."""
+    from app.models import Email
+    from app.workers.classification import classification_input
+
+    query = (
+        db.query(Email)
+        .filter(
+            Email.processed == True,  # noqa: E712
+            Email.category.isnot(None),
+            Email.urgency.isnot(None),
+            (Email.classification_source.is_(None)) | (Email.classification_source == "llm"),
+        )
+        .order_by(Email.received_at.desc())
+        .limit(limit)
+        .yield_per(500)
+    )
+    texts, categories, priorities = [], [], []
+    for email in query:
+        texts.append(classification_input(email))
+        categories.append(email.category)
+        priorities.append(int(email.urgency))
+    return texts, categories, priorities
+
+
+def train_local_classifier(
+    db, path: str = LOCAL_CLASSIFIER_PATH, holdout: float = 0.2, seed: int = 0, limit: int = 50000,
+) -> dict:
+    """
+    Train on the deployment's labels, report held-out agreement, then refit
+    on everything and save. Returns the evaluation report.
+    """
+    texts, categories, priorities = training_examples(db, limit=limit)
+    if len(texts) < LOCAL_CLASSIFIER_MIN_EXAMPLES:
+        return {
+            "trained": False,
+            "examples": len(texts),
+            "error": f"need at least {LOCAL_CLASSIFIER_MIN_EXAMPLES} LLM-labelled emails",
+        }
+
+    order = np.random.default_rng(seed).permutation(len(texts))
+    cut = int(len(texts) * (1 - holdout))
+    train, test = order[:cut], order[cut:]
+    pick = lambda values, idx: [values[i] for i in idx]  # noqa: E731
+
+    started = time.perf_counter()
+    candidate = fit_classifier(pick(texts, train), pick(categories, train), pick(priorities, train), seed)
+    report = evaluate(candidate, pick(texts, test), pick(categories, test), pick(priorities, test))
+
+    model = fit_classifier(texts, categories, priorities, seed)
+    model.meta = {"trained_at": time.time(), "examples": len(texts), "validation": report}
+    model.save(path)
+    _set_model(model, path)
+
+    return {
+        "trained": True,
+        "examples": len(texts),
+        "train_seconds": round(time.perf_counter() - started, 2),
+        "threshold": LOCAL_CLASSIFIER_THRESHOLD,
+        "validation": report,
+    }
+
+
+# ---------------------------------------------------
+# Serving: model handle, triage, counters
+# ---------------------------------------------------
+_model: Optional[LocalClassifier] = None
+_model_mtime = 0.0
+_last_check = 0.0
+_model_lock = threading.Lock()
+
+_stats = {
+    "predictions": 0,
+    "local": 0,
+    "escalated": 0,
+    "shadow": 0,
+    "shadow_agreed": 0,
+    "escalated_agreed": 0,
+    "latency_us_total": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def _set_model(model: LocalClassifier, path: str) -> None:
+    global _model, _model_mtime
+    with _model_lock:
+        _model = model
+        _model_mtime = os.path.getmtime(path)
+
+
+def get_local_classifier(path: str = LOCAL_CLASSIFIER_PATH) -> Optional[LocalClassifier]:
+    """The current model, reloaded when another worker retrains it."""
+    global _model, _model_mtime, _last_check
+    if not LOCAL_CLASSIFIER_ENABLED:
+        return None
+    now = time.monotonic()
+    if _model is not None and now - _last_check < _RELOAD_CHECK_SECONDS:
+        return _model
+
+    with _model_lock:
+        _last_check = now
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return _model
+        if _model is None or mtime > _model_mtime:
+            try:
+                _model, _model_mtime = LocalClassifier.load(path), mtime
+            except Exception as e:
+                logger.warning("Failed to load local classifier: %s", e)
+        return _model
+
+
+@dataclass
+class Triage:
+    prediction: Optional[LocalPrediction]
+    escalate: bool          # send to categorize_email
+    shadow: bool = False    # confident, but sampled for an agreement check
+
+    @property
+    def use_local(self) -> bool:
+        return self.prediction is not None and not self.escalate and not self.shadow
+
+
+def triage(text: str, threshold: float = LOCAL_CLASSIFIER_THRESHOLD) -> Triage:
+    """Predict locally and decide whether Gemini is still needed."""
+    model = get_local_classifier()
+    if model is None:
+        return Triage(prediction=None, escalate=True)
+
+    prediction = model.predict(text)
+    escalate = prediction.confidence < threshold
+    shadow = not escalate and random.random() < LOCAL_CLASSIFIER_SHADOW_RATE
+    with _stats_lock:
+        _stats["predictions"] += 1
+        _stats["latency_us_total"] += prediction.latency_us
+        if escalate:
+            _stats["escalated"] += 1
+        elif shadow:
+            _stats["shadow"] += 1
+        else:
+            _stats["local"] += 1
+    return Triage(prediction=prediction, escalate=escalate, shadow=shadow)
+
+
+def record_llm_result(decision: Triage, result: dict) -> None:
+    """Compare an escalated/shadow prediction with what Gemini returned."""
+    if decision.prediction is None or result.get("degraded"):
+        return
+    agreed = decision.prediction.agrees_with(result)
+    with _stats_lock:
+        if decision.shadow:
+            _stats["shadow_agreed"] += agreed
+        elif decision.escalate:
+            _stats["escalated_agreed"] += agreed
+
+
+def local_classifier_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    predictions = stats.pop("predictions")
+    latency = stats.pop("latency_us_total")
+    model = _model
+    return {
+        "enabled": LOCAL_CLASSIFIER_ENABLED,
+        "model_loaded": model is not None,
+        "model": dict(model.meta) if model else {},
+        "threshold": LOCAL_CLASSIFIER_THRESHOLD,
+        "shadow_rate": LOCAL_CLASSIFIER_SHADOW_RATE,
+        "predictions": predictions,
+        **stats,
+        "escalation_rate": round(stats["escalated"] / predictions, 4) if predictions else 0.0,
+        # Agreement on confident predictions, measured on the shadow sample
+        "llm_agreement": round(stats["shadow_agreed"] / stats["shadow"], 4) if stats["shadow"] else None,
+        # How often escalation was unnecessary (local answer was right anyway)
+        "escalated_agreement": round(stats["escalated_agreed"] / stats["escalated"], 4) if stats["escalated"] else None,
+        "mean_latency_us": round(latency / predictions, 1) if predictions else None,
+    }
+
+
+def main():
+    import argparse
+
+    from app.db import get_session
+
+    parser = argparse.ArgumentParser(description="Retrain the shared local classifier from LLM labels")
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--limit", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with get_session() as db:
+        report = train_local_classifier(db, holdout=args.holdout, seed=args.seed, limit=args.limit)
+    print(json.dumps(report, indent=2))
+    if not report["trained"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Per-professor compiled prompt prefixes
+
+categorize_email / categorize_batch / generate_reply prompts start with a
+prefix that does not depend on the email: the instructions, the guidelines
+and the professor's own material (tone, signature, course policies). A
+prefix is rendered once per (workflow, content) and reused until the
+professor's preferences change.
+
+The prefix always comes first in the prompt so providers can reuse it:
+Gemini gets it registered as cached content once it is large enough
+(providers.py), Anthropic marks it as a cacheable system block, and
+providers with implicit prefix caching benefit from the stable ordering.
+
+Keys are content-addressed, so a process that never saw the preference
+update still compiles the new prefix; the SQLAlchemy listeners below only
+free the stale local entries early. Provider-side caches are not touched:
+professors with the same preferences share a prefix, and the provider's
+TTL expires content that is no longer used.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from app.cache import TTLCache
+from app.models import Preference, User
+from .prompting import count_tokens
+
+
+PROMPT_PREFIX_CACHE_SIZE = int(os.getenv("PROMPT_PREFIX_CACHE_SIZE", "1024"))
+PROMPT_PREFIX_TTL_SECONDS = int(os.getenv("PROMPT_PREFIX_TTL_SECONDS", "3600"))
+_USER_PREFERENCE_FIELDS = ("tone_preference", "reply_length_preference", "course_policies", "signature")
+
+
+@dataclass(frozen=True)
+class ProfessorContext:
+    """The per-professor material that goes into reply prompts."""
+
+    user_id: Optional[str] = None
+    tone: str = "professional"
+    policies: str = "None provided"
+    signature: Optional[str] = None
+    reply_length: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user) -> "ProfessorContext":
+        prefs = user.preferences
+        policies = (prefs and prefs.course_policies) or user.course_policies
+        if isinstance(policies, (dict, list)):
+            policies = json.dumps(policies, sort_keys=True)
+        return cls(
+            user_id=str(user.id),
+            tone=(prefs and prefs.tone) or user.tone_preference or "professional",
+            policies=policies or "None provided",
+            signature=(prefs and prefs.signature) or user.signature,
+            reply_length=(prefs and prefs.reply_length) or user.reply_length_preference,
+        )
+
+    @property
+    def fingerprint(self) -> str:
+        """Content hash; stands in for the context in LLM cache keys."""
+        payload = json.dumps([self.tone, self.policies, self.signature, self.reply_length])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    key: str            # "<workflow>:<content hash>", stable across processes
+    text: str
+    tokens: int
+
+
+_prefixes = TTLCache(PROMPT_PREFIX_CACHE_SIZE, PROMPT_PREFIX_TTL_SECONDS)
+_owned: dict[str, set[str]] = {}          # user_id -> prefix keys
+_stats = {"compiled": 0, "invalidations": 0}
+_lock = threading.Lock()
+
+
+def get_prefix(workflow: str, parts: tuple, render: Callable[[], str], owner: Optional[str] = None) -> PromptPrefix:
+    """
+    The compiled prefix for ``workflow`` and ``parts`` (the values the
+    prefix depends on); ``render`` builds the text on a miss.
+
+    Args:
+        owner: user_id whose preference changes should drop this prefix
+    """
+    digest = hashlib.sha256(json.dumps([workflow, *parts], default=str).encode("utf-8")).hexdigest()[:32]
+    key = f"{workflow}:{digest}"
+    prefix = _prefixes.get(key)
+    if prefix is None:
+        text = render()
+        prefix = PromptPrefix(key=key, text=text, tokens=count_tokens(text))
+        _prefixes.set(key, prefix)
+        with _lock:
+            _stats["compiled"] += 1
+    if owner:
+        with _lock:
+            _owned.setdefault(owner, set()).add(key)
+    return prefix
+
+
+def invalidate_user(user_id) -> int:
+    """
+    Drop a professor's compiled prefixes from this process. Local only, so
+    it is safe inside a flush; another user sharing a prefix just
+    recompiles it.
+    """
+    with _lock:
+        keys = _owned.pop(str(user_id), set())
+        _stats["invalidations"] += 1
+    for key in keys:
+        _prefixes.pop(key)
+    return len(keys)
+
+
+def prefix_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats["users"] = len(_owned)
+    return {**stats, "cache": _prefixes.stats()}
+
+
+# ---------------------------------------------------
+# Invalidation on preference changes
+# ---------------------------------------------------
+@event.listens_for(Preference, "after_insert")
+@event.listens_for(Preference, "after_update")
+@event.listens_for(Preference, "after_delete")
+def _preference_changed(mapper, connection, target) -> None:
+    invalidate_user(target.user_id)
+
+
+@event.listens_for(User, "after_update")
+def _user_changed(mapper, connection, target) -> None:
+    # Users are updated on every sync (inbox_version); only preference
+    # fields matter here.
+    state = sa_inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in _USER_PREFERENCE_FIELDS):
+        invalidate_user(target.id)
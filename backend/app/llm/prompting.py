@@ -0,0 +1,329 @@
+"""
+Token-budgeted prompt construction and per-call token accounting
+
+Every workflow builds its prompt with PromptBuilder: fixed instruction text
+is always kept, and variable sections (email bodies, threads, digest items,
+retrieved contexts) are truncated to fit the workflow's input budget.
+
+- ``head_tail``: keep the start and end of one long text (greetings and
+  the actual question usually sit at either end)
+- ``recent_first``: keep the newest thread messages whole, dropping the
+  oldest first
+- ``items``: keep list entries in order until the budget runs out
+
+A compiled per-professor prefix (prompt_prefix.py) can lead the prompt via
+PromptBuilder.prefix(); it counts against the budget as fixed text.
+
+record_usage() logs input/output tokens per call (Gemini's usage metadata
+when present, otherwise the estimate) for /llm/token-stats.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+from app.search.chunking import estimate_tokens, html_to_text
+
+
+# (input budget, output budget) in tokens; override with
+# PROMPT_BUDGET_<WORKFLOW>=<input>[,<output>]
+_DEFAULT_BUDGETS = {
+    "categorize_email": (2000, 512),
+    "categorize_batch": (8000, 4096),
+    "generate_reply": (4000, 1024),
+    "summarize_thread": (8000, 1024),
+    "thread_summary_update": (4000, 1024),
+    "daily_digest": (12000, 2048),
+    "digest_chunk": (6000, 1024),
+    "search_inbox": (8000, 1024),
+}
+_FALLBACK_BUDGET = (4000, 1024)
+_RECENT_CALLS = 200
+
+_HTML_HINT_RE = re.compile(r"<\s*(html|body|div|p|br|table|span)\b", re.IGNORECASE)
+_BLANK_RUN_RE = re.compile(r"\n[ \t]*\n(?:[ \t]*\n)+")
+
+
+def _env_budget(workflow: str) -> Optional[tuple[int, int]]:
+    value = os.getenv(f"PROMPT_BUDGET_{workflow.upper()}")
+    if not value:
+        return None
+    parts = [int(p) for p in value.split(",")]
+    default_output = _DEFAULT_BUDGETS.get(workflow, _FALLBACK_BUDGET)[1]
+    return parts[0], parts[1] if len(parts) > 1 else default_output
+
+
+def budget_for(workflow: str) -> tuple[int, int]:
+    """(input_tokens, output_tokens) budget for a workflow."""
+    return _env_budget(workflow) or _DEFAULT_BUDGETS.get(workflow, _FALLBACK_BUDGET)
+
+
+def count_tokens(text: str) -> int:
+    """Fast approximate token count (no tokenizer round-trip)."""
+    return estimate_tokens(text or "")
+
+
+def clean_text(text: str) -> str:
+    """Strip HTML markup and collapse runs of blank lines."""
+    text = (text or "").replace("\r\n", "\n")
+    if _HTML_HINT_RE.search(text):
+        text = html_to_text(text)
+    return _BLANK_RUN_RE.sub("\n\n", text).strip()
+
+
+# ---------------------------------------------------
+# Truncation strategies
+# ---------------------------------------------------
+def truncate_head_tail(text: str, max_tokens: int, head_ratio: float = 0.6) -> str:
+    """Keep the head and tail of ``text`` within ~max_tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(max_tokens - 12, 0) * 4       # room for the marker
+    head_chars = int(max_chars * head_ratio)
+    tail_chars = max_chars - head_chars
+
+    head = text[:head_chars]
+    head = head[: head.rfind(" ")] if " " in head[-40:] else head
+    tail = text[len(text) - tail_chars:] if tail_chars else ""
+    tail = tail[tail.find(" ") + 1:] if " " in tail[:40] else tail
+    omitted = count_tokens(text) - count_tokens(head) - count_tokens(tail)
+    return f"{head}\n[... {omitted} tokens omitted ...]\n{tail}"
+
+
+def truncate_recent_first(messages: Sequence[str], max_tokens: int, separator: str = "\n\n") -> str:
+    """
+    Keep the newest messages (``messages`` is oldest first) that fit. If
+    even the newest one does not fit, it is head+tail truncated.
+    """
+    kept: list[str] = []
+    used = 0
+    for message in reversed(messages):
+        cost = count_tokens(message) + 1
+        if used + cost > max_tokens:
+            if not kept:
+                kept.append(truncate_head_tail(message, max_tokens))
+            break
+        kept.append(message)
+        used += cost
+
+    dropped = len(messages) - len(kept)
+    kept.reverse()
+    if dropped:
+        kept.insert(0, f"[{dropped} earlier message(s) omitted]")
+    return separator.join(kept)
+
+
+def truncate_items(items: Sequence[str], max_tokens: int, separator: str = "\n") -> str:
+    """Keep list entries in order until the budget is used up."""
+    kept: list[str] = []
+    used = 0
+    for item in items:
+        cost = count_tokens(item) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(item)
+        used += cost
+    if len(kept) < len(items):
+        kept.append(f"[... {len(items) - len(kept)} more item(s) omitted]")
+    return separator.join(kept)
+
+
+# ---------------------------------------------------
+# Builder
+# ---------------------------------------------------
+@dataclass
+class _Section:
+    key: str
+    mode: str                    # "fixed" | "head_tail" | "recent_first" | "items"
+    content: object              # str, or a list of str for recent_first/items
+    tokens: int
+    separator: str = "\n"
+
+
+@dataclass
+class Prompt:
+    workflow: str
+    text: str
+    input_tokens: int            # estimated, after truncation
+    original_tokens: int         # estimated, before truncation
+    max_output_tokens: int
+    truncated: list = field(default_factory=list)
+    prefix: Optional[object] = None      # prompt_prefix.PromptPrefix; text starts with prefix.text
+
+
+class PromptBuilder:
+    """
+    Assemble a prompt from fixed text and budgeted variable sections.
+
+    Variable sections share whatever the fixed text leaves of the input
+    budget: small sections are kept whole and the rest is split among the
+    larger ones.
+    """
+
+    def __init__(self, workflow: str, budget: Optional[int] = None):
+        self.workflow = workflow
+        self.input_budget, self.output_budget = budget_for(workflow)
+        if budget is not None:
+            self.input_budget = budget
+        self._sections: list[_Section] = []
+        self._prefix = None
+
+    def prefix(self, prefix) -> "PromptBuilder":
+        """Lead the prompt with a compiled PromptPrefix (must come first)."""
+        if self._sections:
+            raise ValueError("prefix() must be called before any other section")
+        self._prefix = prefix
+        self._sections.append(_Section("", "fixed", prefix.text, prefix.tokens))
+        return self
+
+    def text(self, content: str) -> "PromptBuilder":
+        self._sections.append(_Section("", "fixed", content, count_tokens(content)))
+        return self
+
+    def body(self, key: str, content: Optional[str]) -> "PromptBuilder":
+        content = clean_text(content)
+        self._sections.append(_Section(key, "head_tail", content, count_tokens(content)))
+        return self
+
+    def thread(self, key: str, messages: Sequence[str], separator: str = "\n\n") -> "PromptBuilder":
+        messages = [clean_text(m) for m in messages if m]
+        tokens = sum(count_tokens(m) + 1 for m in messages)
+        self._sections.append(_Section(key, "recent_first", messages, tokens, separator))
+        return self
+
+    def items(self, key: str, entries: Sequence[str], separator: str = "\n") -> "PromptBuilder":
+        entries = [e for e in entries if e]
+        tokens = sum(count_tokens(e) + 1 for e in entries)
+        self._sections.append(_Section(key, "items", entries, tokens, separator))
+        return self
+
+    def _allocate(self) -> dict[int, int]:
+        fixed = sum(s.tokens for s in self._sections if s.mode == "fixed")
+        remaining = max(self.input_budget - fixed, 0)
+        variable = sorted(
+            (i for i, s in enumerate(self._sections) if s.mode != "fixed"),
+            key=lambda i: self._sections[i].tokens,
+        )
+        allocation = {}
+        for position, i in enumerate(variable):
+            share = remaining // (len(variable) - position)
+            allocation[i] = min(self._sections[i].tokens, share)
+            remaining -= allocation[i]
+        return allocation
+
+    def build(self) -> Prompt:
+        allocation = self._allocate()
+        parts, truncated, original = [], [], 0
+        for i, section in enumerate(self._sections):
+            original += section.tokens
+            if section.mode == "fixed":
+                parts.append(section.content)
+                continue
+
+            limit = allocation[i]
+            if section.tokens > limit:
+                truncated.append(section.key)
+            if section.mode == "head_tail":
+                parts.append(truncate_head_tail(section.content, limit))
+            elif section.mode == "recent_first":
+                parts.append(truncate_recent_first(section.content, limit, section.separator))
+            else:
+                parts.append(truncate_items(section.content, limit, section.separator))
+
+        text = "\n".join(parts)
+        return Prompt(
+            workflow=self.workflow,
+            text=text,
+            input_tokens=count_tokens(text),
+            original_tokens=original,
+            max_output_tokens=self.output_budget,
+            truncated=truncated,
+            prefix=self._prefix,
+        )
+
+
+# ---------------------------------------------------
+# Usage accounting
+# ---------------------------------------------------
+_usage: dict[str, dict] = {}
+_recent: deque = deque(maxlen=_RECENT_CALLS)
+_usage_lock = threading.Lock()
+
+
+def _usage_metadata(response) -> tuple[Optional[int], Optional[int], int]:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None, None, 0
+    return (
+        getattr(usage, "prompt_token_count", None) or None,
+        getattr(usage, "candidates_token_count", None) or None,
+        getattr(usage, "cached_content_token_count", None) or 0,
+    )
+
+
+def record_usage(prompt: Prompt, response=None, output_text: Optional[str] = None, started: Optional[float] = None) -> dict:
+    """
+    Record one LLM call's token usage.
+
+    Args:
+        prompt: The built prompt that was sent
+        response: Gemini response (its usage_metadata is preferred)
+        output_text: Generated text, used to estimate output tokens when
+            the response carries no usage metadata
+        started: time.perf_counter() at request start, for latency
+
+    Returns:
+        The recorded call entry
+    """
+    input_tokens, output_tokens, cached_tokens = _usage_metadata(response)
+    if output_tokens is None:
+        if output_text is None:
+            try:
+                output_text = response.text if response is not None else ""
+            except Exception:
+                output_text = ""
+        output_tokens = count_tokens(output_text)
+
+    entry = {
+        "workflow": prompt.workflow,
+        "input_tokens": input_tokens or prompt.input_tokens,
+        "input_tokens_estimated": prompt.input_tokens,
+        "cached_input_tokens": cached_tokens,
+        "output_tokens": output_tokens,
+        "saved_tokens": max(prompt.original_tokens - prompt.input_tokens, 0),
+        "truncated": prompt.truncated,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1) if started else None,
+        "at": time.time(),
+    }
+    with _usage_lock:
+        totals = _usage.setdefault(prompt.workflow, {
+            "calls": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0,
+            "saved_tokens": 0, "truncated_calls": 0, "max_input_tokens": 0,
+        })
+        totals["calls"] += 1
+        totals["input_tokens"] += entry["input_tokens"]
+        totals["cached_input_tokens"] += cached_tokens
+        totals["output_tokens"] += output_tokens
+        totals["saved_tokens"] += entry["saved_tokens"]
+        totals["truncated_calls"] += bool(prompt.truncated)
+        totals["max_input_tokens"] = max(totals["max_input_tokens"], entry["input_tokens"])
+        _recent.append(entry)
+    return entry
+
+
+def token_stats(recent: int = 20) -> dict:
+    with _usage_lock:
+        workflows = {name: dict(totals) for name, totals in _usage.items()}
+        calls = list(_recent)[-recent:] if recent else []
+    for name, totals in workflows.items():
+        totals["budget"] = dict(zip(("input", "output"), budget_for(name)))
+        totals["avg_input_tokens"] = round(totals["input_tokens"] / totals["calls"], 1)
+        totals["avg_output_tokens"] = round(totals["output_tokens"] / totals["calls"], 1)
+        totals["cached_input_ratio"] = round(totals["cached_input_tokens"] / max(totals["input_tokens"], 1), 4)
+    return {"workflows": workflows, "recent_calls": calls}
@@ -0,0 +1,391 @@
+"""
+Provider-agnostic text generation backends
+
+Each provider turns (model, prompt, generation_config, prefix) into a response
+exposing ``.text`` and ``.usage_metadata`` (prompt_token_count /
+candidates_token_count, Gemini's shape). Streaming responses iterate
+chunks with ``.text``. ``generation_config`` uses Gemini's keys
+(response_mime_type, response_schema, max_output_tokens); other providers
+translate them. ``prefix`` is an optional prompt_prefix.PromptPrefix the
+prompt starts with; providers that can cache it send only the remainder.
+
+- ``gemini``: google-generativeai (default)
+- ``anthropic``: Anthropic Messages API (ANTHROPIC_API_KEY)
+- ``stub``: deterministic, offline; fills the response schema from a hash
+  of the prompt, for benchmarking the backend without network or cost
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Iterator, Optional
+
+
+logger = logging.getLogger(__name__)
+
+PROMPT_PREFIX_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_PREFIX_CACHE_MIN_TOKENS", "4096"))
+PROMPT_PREFIX_CACHE_TTL_SECONDS = int(os.getenv("PROMPT_PREFIX_CACHE_TTL_SECONDS", "3600"))
+
+
+@dataclass
+class Usage:
+    prompt_token_count: Optional[int] = None
+    candidates_token_count: Optional[int] = None
+    cached_content_token_count: int = 0
+
+
+@dataclass
+class TextResponse:
+    text: str
+    usage_metadata: Optional[Usage] = None
+
+
+@dataclass
+class TextChunk:
+    text: str
+    usage_metadata: Optional[Usage] = None
+
+
+class Provider:
+    name = "base"
+
+    def prepare(self, model: str) -> None:
+        """
+        Set up the SDK client for ``model``.
+
+        Raises:
+            RuntimeError: the provider is not configured (missing API key)
+        """
+
+    def generate(self, model: str, prompt: str, *, generation_config: Optional[dict] = None,
+                 stream: bool = False, timeout: Optional[float] = None, prefix=None):
+        raise NotImplementedError
+
+    def cancel(self, response) -> None:
+        """Stop an in-flight streaming response (best effort)."""
+
+
+def _suffix(prompt: str, prefix) -> str:
+    return prompt[len(prefix.text):] if prefix is not None and prompt.startswith(prefix.text) else prompt
+
+
+# ---------------------------------------------------
+# Gemini
+# ---------------------------------------------------
+class GeminiProvider(Provider):
+    """
+    Prefixes of at least PROMPT_PREFIX_CACHE_MIN_TOKENS are registered as
+    Gemini cached content (one per model and prefix, refreshed before the
+    TTL runs out) and only the email-specific remainder is sent. Content
+    for prefixes nobody uses any more is left to expire at its TTL: keys
+    are content-addressed, so other professors may share it. Models or
+    prefixes the API won't cache are remembered and sent whole.
+    """
+
+    name = "gemini"
+
+    def __init__(self):
+        self._cached: dict[tuple, tuple] = {}     # (model, key) -> (model obj | None, content | None, expires_at)
+        self._locks: dict[tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def prepare(self, model: str) -> None:
+        from .client import get_model
+
+        get_model(model)
+
+    def _cached_model(self, model: str, prefix):
+        if prefix is None or prefix.tokens < PROMPT_PREFIX_CACHE_MIN_TOKENS:
+            return None
+        slot = (model, prefix.key)
+        entry = self._cached.get(slot)
+        if entry and entry[2] > time.monotonic():
+            return entry[0]
+
+        with self._lock:
+            slot_lock = self._locks.setdefault(slot, threading.Lock())
+        with slot_lock:
+            entry = self._cached.get(slot)
+            if entry and entry[2] > time.monotonic():
+                return entry[0]
+            from .client import get_genai
+
+            genai = get_genai()
+            try:
+                content = genai.caching.CachedContent.create(
+                    model=model if model.startswith("models/") else f"models/{model}",
+                    display_name=prefix.key[:128],
+                    contents=[prefix.text],
+                    ttl=timedelta(seconds=PROMPT_PREFIX_CACHE_TTL_SECONDS),
+                )
+                cached_model = genai.GenerativeModel.from_cached_content(cached_content=content)
+            except Exception as e:
+                logger.warning("Gemini context cache unavailable for %s (%s): %s", model, prefix.key, e)
+                content = cached_model = None
+            # Refresh a minute early so calls never race the server-side expiry.
+            self._cached[slot] = (cached_model, content, time.monotonic() + PROMPT_PREFIX_CACHE_TTL_SECONDS - 60)
+            self._prune()
+            return cached_model
+
+    def _prune(self) -> None:
+        """Forget expired handles; the server-side TTL removes the content itself."""
+        now = time.monotonic()
+        with self._lock:
+            for slot in [slot for slot, entry in self._cached.items() if entry[2] <= now]:
+                lock = self._locks.get(slot)
+                if lock is not None and lock.locked():
+                    continue        # being refreshed right now
+                self._cached.pop(slot, None)
+                self._locks.pop(slot, None)
+
+    def _drop(self, slots) -> None:
+        """
+        Forget local handles only. The content may be shared with other
+        professors and processes, so the server-side TTL removes it.
+        """
+        for slot in slots:
+            self._cached.pop(slot, None)
+
+    def generate(self, model, prompt, *, generation_config=None, stream=False, timeout=None, prefix=None):
+        from .client import get_model, is_transient
+
+        kwargs = {"stream": stream}
+        if generation_config:
+            kwargs["generation_config"] = generation_config
+        if timeout:
+            kwargs["request_options"] = {"timeout": timeout}
+
+        cached_model = self._cached_model(model, prefix)
+        if cached_model is not None:
+            try:
+                return cached_model.generate_content(_suffix(prompt, prefix), **kwargs)
+            except Exception as e:
+                if is_transient(e):
+                    raise
+                # Cached content expired server-side, or this prompt failed:
+                # forget the handle (re-created next time) and send it whole.
+                self._drop([(model, prefix.key)])
+        return get_model(model).generate_content(prompt, **kwargs)
+
+    def cancel(self, response) -> None:
+        iterator = getattr(response, "_iterator", None)
+        cancel = getattr(iterator, "cancel", None)
+        if callable(cancel):
+            cancel()
+
+
+# ---------------------------------------------------
+# Anthropic
+# ---------------------------------------------------
+class AnthropicProvider(Provider):
+    name = "anthropic"
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    api_key = os.getenv("ANTHROPIC_API_KEY")
+                    if not api_key:
+                        raise RuntimeError("❌ ANTHROPIC_API_KEY not found. Please add it to your .env file.")
+                    import anthropic
+
+                    self._client = anthropic.Anthropic(api_key=api_key, max_retries=0)
+        return self._client
+
+    def prepare(self, model: str) -> None:
+        self._get_client()
+
+    @staticmethod
+    def _prompt(prompt: str, generation_config: dict) -> str:
+        schema = generation_config.get("response_schema")
+        if generation_config.get("response_mime_type") == "application/json":
+            prompt += "\n\nRespond with a single JSON object only, no prose or code fences."
+            if schema:
+                prompt += f"\nJSON schema:\n{json.dumps(schema)}"
+        return prompt
+
+    def generate(self, model, prompt, *, generation_config=None, stream=False, timeout=None, prefix=None):
+        generation_config = generation_config or {}
+        kwargs = {
+            "model": model,
+            "max_tokens": generation_config.get("max_output_tokens") or 1024,
+            "messages": [{"role": "user", "content": self._prompt(_suffix(prompt, prefix), generation_config)}],
+        }
+        if prefix is not None and prompt.startswith(prefix.text):
+            # Cacheable system block: repeat calls bill the prefix at the cache-read rate.
+            kwargs["system"] = [{"type": "text", "text": prefix.text, "cache_control": {"type": "ephemeral"}}]
+        if timeout:
+            kwargs["timeout"] = timeout
+        client = self._get_client()
+
+        if not stream:
+            message = client.messages.create(**kwargs)
+            text = "".join(getattr(block, "text", "") for block in message.content)
+            usage = _anthropic_usage(message.usage, message.usage.output_tokens)
+            return TextResponse(text=_strip_fences(text), usage_metadata=usage)
+        return _AnthropicStream(client.messages.create(stream=True, **kwargs))
+
+    def cancel(self, response) -> None:
+        if isinstance(response, _AnthropicStream):
+            response.close()
+
+
+class _AnthropicStream:
+    """Adapts Messages API stream events to text chunks."""
+
+    def __init__(self, events):
+        self._events = events
+        self._usage = None
+
+    def __iter__(self) -> Iterator[TextChunk]:
+        for event in self._events:
+            kind = getattr(event, "type", "")
+            if kind == "message_start":
+                self._usage = event.message.usage
+            elif kind == "content_block_delta" and getattr(event.delta, "text", None):
+                yield TextChunk(event.delta.text)
+            elif kind == "message_delta" and getattr(event, "usage", None):
+                yield TextChunk("", _anthropic_usage(self._usage, event.usage.output_tokens))
+
+    def close(self) -> None:
+        close = getattr(self._events, "close", None) or getattr(getattr(self._events, "response", None), "close", None)
+        if callable(close):
+            close()
+
+
+def _anthropic_usage(usage, output_tokens: int) -> Usage:
+    if usage is None:
+        return Usage(None, output_tokens)
+    cached = getattr(usage, "cache_read_input_tokens", None) or 0
+    created = getattr(usage, "cache_creation_input_tokens", None) or 0
+    return Usage(usage.input_tokens + cached + created, output_tokens, cached)
+
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def _strip_fences(text: str) -> str:
+    return _FENCE_RE.sub("", text.strip())
+
+
+# ---------------------------------------------------
+# Deterministic local stub
+# ---------------------------------------------------
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "0"))
+STUB_EMBEDDING_DIM = 768
+_BATCH_ID_RE = re.compile(r'<email email_id="([^"]+)">')
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+class StubProvider(Provider):
+    """
+    Same prompt in, same response out, with no network. Structured calls
+    get a value for every schema field; batch prompts get one result per
+    ``<email email_id=...>`` block so batching paths are exercised too.
+    Repeat prefixes are reported as cached input tokens.
+    """
+
+    name = "stub"
+
+    def __init__(self):
+        self._seen_prefixes: set = set()
+
+    def generate(self, model, prompt, *, generation_config=None, stream=False, timeout=None, prefix=None):
+        generation_config = generation_config or {}
+        if STUB_LATENCY_MS:
+            time.sleep(STUB_LATENCY_MS / 1000)
+
+        seed = hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).digest()
+        schema = generation_config.get("response_schema")
+        if schema:
+            text = json.dumps(_fill_schema(schema, seed, _BATCH_ID_RE.findall(prompt)))
+        else:
+            text = f"[stub:{model}] Deterministic reply {seed[:4].hex()} to a {len(prompt)}-character prompt."
+        usage = Usage(len(prompt) // 4 + 1, len(text) // 4 + 1)
+        if prefix is not None:
+            # Mimic provider prefix caching so token accounting can be benchmarked.
+            if (model, prefix.key) in self._seen_prefixes:
+                usage.cached_content_token_count = prefix.tokens
+            self._seen_prefixes.add((model, prefix.key))
+
+        if not stream:
+            return TextResponse(text=text, usage_metadata=usage)
+        words = text.split(" ")
+        chunks = [TextChunk(word + (" " if i < len(words) - 1 else "")) for i, word in enumerate(words)]
+        chunks.append(TextChunk("", usage))
+        return iter(chunks)
+
+    @staticmethod
+    def embed(texts: list[str], dim: int = STUB_EMBEDDING_DIM) -> list[list[float]]:
+        """Hashed bag-of-words vectors: similar texts get similar vectors."""
+        import numpy as np
+
+        vectors = np.zeros((len(texts), dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in _WORD_RE.findall((text or "").lower()):
+                h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+                vectors[row, h % dim] += 1.0 if (h >> 63) else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+
+
+def _fill_schema(schema: dict, seed: bytes, batch_ids: list[str], key: str = ""):
+    kind = schema.get("type")
+    pick = seed[len(key) % len(seed)]
+    if kind == "object":
+        return {
+            name: _fill_schema(sub, seed, batch_ids, name)
+            for name, sub in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        items = schema.get("items", {"type": "string"})
+        if batch_ids and "email_id" in items.get("properties", {}):
+            results = []
+            for email_id in batch_ids:
+                item = _fill_schema(items, hashlib.sha256(seed + email_id.encode()).digest(), [], key)
+                item["email_id"] = email_id
+                results.append(item)
+            return results
+        return [_fill_schema(items, seed, [], f"{key}{i}") for i in range(1 + pick % 3)]
+    if kind in ("number", "integer"):
+        return 1 + pick % 10
+    if kind == "boolean":
+        return bool(pick % 2)
+    if schema.get("enum"):
+        return schema["enum"][pick % len(schema["enum"])]
+    if key == "category":
+        from .schemas import CATEGORY_NAMES
+
+        return CATEGORY_NAMES[pick % len(CATEGORY_NAMES)]
+    return f"stub {key or 'text'} {seed[:3].hex()}"
+
+
+# ---------------------------------------------------
+# Registry
+# ---------------------------------------------------
+_providers: dict[str, Provider] = {}
+_providers_lock = threading.Lock()
+_PROVIDER_TYPES = {"gemini": GeminiProvider, "anthropic": AnthropicProvider, "stub": StubProvider}
+
+
+def get_provider(name: str) -> Provider:
+    with _providers_lock:
+        if name not in _providers:
+            if name not in _PROVIDER_TYPES:
+                raise ValueError(f"Unknown LLM provider: {name!r}")
+            _providers[name] = _PROVIDER_TYPES[name]()
+        return _providers[name]
+
@@ -0,0 +1,114 @@
+"""
+Per-workflow model routing
+
+Each workflow maps to a ``provider:model`` route, optionally switching to a
+stronger model once the prompt passes a size threshold:
+
+    LLM_MODEL_<WORKFLOW>=provider:model            # e.g. anthropic:claude-3-5-haiku-latest
+    LLM_MODEL_<WORKFLOW>_LARGE=provider:model      # used when input_tokens >= threshold
+    LLM_LARGE_INPUT_TOKENS_<WORKFLOW>=6000          # per-workflow threshold
+    LLM_LARGE_INPUT_TOKENS=6000                     # default threshold
+
+``LLM_PROVIDER=stub`` sends every workflow to the deterministic offline
+stub (model names are kept, so routing still shows up in stats).
+A bare model name (no ``provider:``) means Gemini.
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from .client import DEFAULT_MODEL_NAME, FALLBACK_MODEL_NAME
+
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "").strip().lower()
+LLM_LARGE_INPUT_TOKENS = int(os.getenv("LLM_LARGE_INPUT_TOKENS", "6000"))
+
+# workflow -> (default route, large-input route or None)
+# Classification is short and latency-bound; digests and RAG answers read a
+# lot of context and benefit from the stronger model once inputs get big.
+_DEFAULT_ROUTES = {
+    "categorize_email": ("gemini:gemini-2.0-flash-lite", None),
+    "categorize_batch": (f"gemini:{DEFAULT_MODEL_NAME}", None),
+    "generate_reply": (f"gemini:{DEFAULT_MODEL_NAME}", None),
+    "summarize_thread": (f"gemini:{DEFAULT_MODEL_NAME}", "gemini:gemini-2.5-pro"),
+    "thread_summary_update": (f"gemini:{DEFAULT_MODEL_NAME}", None),
+    "daily_digest": (f"gemini:{DEFAULT_MODEL_NAME}", "gemini:gemini-2.5-pro"),
+    "digest_chunk": (f"gemini:{DEFAULT_MODEL_NAME}", None),
+    "search_inbox": (f"gemini:{DEFAULT_MODEL_NAME}", "gemini:gemini-2.5-pro"),
+}
+
+
+@dataclass(frozen=True)
+class Route:
+    provider: str
+    model: str
+
+    @classmethod
+    def parse(cls, spec: str) -> "Route":
+        provider, _, model = spec.strip().rpartition(":")
+        return cls(provider or "gemini", model)
+
+    def __str__(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+
+def _route_specs(workflow: str) -> tuple[str, Optional[str], int]:
+    key = workflow.upper()
+    default, large = _DEFAULT_ROUTES.get(workflow, (f"gemini:{DEFAULT_MODEL_NAME}", None))
+    return (
+        os.getenv(f"LLM_MODEL_{key}") or default,
+        os.getenv(f"LLM_MODEL_{key}_LARGE") or large,
+        int(os.getenv(f"LLM_LARGE_INPUT_TOKENS_{key}", LLM_LARGE_INPUT_TOKENS)),
+    )
+
+
+def _override(route: Route) -> Route:
+    return Route(LLM_PROVIDER, route.model) if LLM_PROVIDER else route
+
+
+def route_for(workflow: Optional[str], input_tokens: Optional[int] = None) -> list[Route]:
+    """
+    Routes to try for one call, in order: the workflow's model (or its
+    large-input model) and then the fallback model.
+    """
+    if workflow is None:
+        primary = Route("gemini", DEFAULT_MODEL_NAME)
+    else:
+        default, large, threshold = _route_specs(workflow)
+        use_large = large and input_tokens is not None and input_tokens >= threshold
+        primary = Route.parse(large if use_large else default)
+
+    routes = [_override(primary)]
+    if FALLBACK_MODEL_NAME:
+        fallback = _override(Route("gemini", FALLBACK_MODEL_NAME))
+        if fallback != routes[0]:
+            routes.append(fallback)
+    return routes
+
+
+def route_signature(workflow: str) -> str:
+    """Stable description of a workflow's routing, for cache keys."""
+    default, large, threshold = _route_specs(workflow)
+    signature = str(_override(Route.parse(default)))
+    if large:
+        signature += f"|{_override(Route.parse(large))}@{threshold}"
+    return signature
+
+
+def describe_routes() -> dict:
+    routes = {}
+    for workflow in _DEFAULT_ROUTES:
+        default, large, threshold = _route_specs(workflow)
+        routes[workflow] = {
+            "model": str(_override(Route.parse(default))),
+            "large_model": str(_override(Route.parse(large))) if large else None,
+            "large_input_tokens": threshold if large else None,
+        }
+    return {
+        "provider_override": LLM_PROVIDER or None,
+        "fallback_model": FALLBACK_MODEL_NAME or None,
+        "workflows": routes,
+    }
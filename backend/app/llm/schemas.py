@@ -2,6 +2,12 @@
 JSON schemas for all Gemini workflow functions
 """
 
+# Categories every categorization workflow chooses from
+CATEGORY_NAMES = [
+    "academic_question", "administrative", "technical_issue", "personal_matter",
+    "appointment_request", "clarification", "complaint", "other",
+]
+
 # Schema for email categorization
 categorize_schema = {
     "type": "object",
@@ -15,6 +21,25 @@ categorize_schema = {
     "required": ["category", "priority_score", "tone", "summary"]
 }
 
+# Schema for batched categorization (one result per email, keyed by email_id)
+categorize_batch_schema = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "email_id": {"type": "string"},
+                    **categorize_schema["properties"],
+                },
+                "required": ["email_id", *categorize_schema["required"]],
+            },
+        }
+    },
+    "required": ["results"]
+}
+
 # Schema for thread summarization
 summarize_thread_schema = {
     "type": "object",
@@ -36,13 +61,28 @@ generate_reply_schema = {
     "required": ["draft"]
 }
 
-# Schema for daily digest
+# Schema for daily digest (mirrors the fields the digest prompt asks for;
+# Gemini needs explicit properties on every object)
 daily_digest_schema = {
     "type": "object",
     "properties": {
-        "digest": {"type": "string"}
+        "summary": {"type": "string"},
+        "high_priority": {"type": "array", "items": {"type": "string"}},
+        "common_themes": {"type": "array", "items": {"type": "string"}},
+        "recommendations": {"type": "array", "items": {"type": "string"}},
     },
-    "required": ["digest"]
+    "required": ["summary"]
+}
+
+# Schema for one group of a hierarchical daily digest (map step)
+digest_chunk_schema = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "high_priority": {"type": "array", "items": {"type": "string"}},
+        "common_themes": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["summary"]
 }
 
 # Schema for inbox search (RAG)
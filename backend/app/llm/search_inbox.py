@@ -1,10 +1,40 @@
 """
 Inbox search (RAG) workflow using Gemini
 """
-import json
-import google.generativeai as genai
-from .client import get_model
-from .schemas import search_inbox_schema
+import time
+from typing import Iterator
+
+from .client import cancel_stream, degraded_reason, generate_content
+from .prompting import Prompt, PromptBuilder, record_usage
+from .structured import generate_structured
+
+
+def _build_prompt(query: str, retrieved_chunks: list[str], output_instructions: str) -> Prompt:
+    return (
+        PromptBuilder("search_inbox")
+        .text("You are an AI assistant helping a professor search through their email history. "
+              "Answer their question using the provided email contexts.\n")
+        .text("Professor's question:")
+        .body("query", query)
+        .text("\nRelevant email contexts:")
+        .items("contexts", [f"Context {i+1}: {chunk}" for i, chunk in enumerate(retrieved_chunks)])
+        .text(f"""
+Instructions:
+1. Answer the professor's question based on the provided email contexts
+2. Be specific and cite which contexts you're referencing
+3. If the contexts don't fully answer the question, say what information is available and what's missing
+4. Provide direct quotes when relevant
+5. Suggest follow-up actions if appropriate
+{output_instructions}
+
+Guidelines:
+- Be factual and only use information from the provided contexts
+- Don't make assumptions beyond what's in the emails
+- If no relevant information is found, clearly state that
+- Organize the answer logically and clearly
+- Include context numbers in your source list""")
+        .build()
+    )
 
 
 def search_inbox(query: str, retrieved_chunks: list[str]) -> dict:
@@ -18,49 +48,71 @@ def search_inbox(query: str, retrieved_chunks: list[str]) -> dict:
     Returns:
         Dictionary with answer and source references
     """
-    model = get_model()
     
     # Build the prompt
-    prompt = f"""
-    You are an AI assistant helping a professor search through their email history. Answer their question using the provided email contexts.
-
-    Professor's question: {query}
-    
-    Relevant email contexts:
-    {chr(10).join([f"Context {i+1}: {chunk}" for i, chunk in enumerate(retrieved_chunks)])}
-    
-    Instructions:
-    1. Answer the professor's question based on the provided email contexts
-    2. Be specific and cite which contexts you're referencing
-    3. If the contexts don't fully answer the question, say what information is available and what's missing
-    4. Provide direct quotes when relevant
-    5. Suggest follow-up actions if appropriate
-    6. List the source contexts you used in your answer
-    
-    Guidelines:
-    - Be factual and only use information from the provided contexts
-    - Don't make assumptions beyond what's in the emails
-    - If no relevant information is found, clearly state that
-    - Organize the answer logically and clearly
-    - Include context numbers in your source list
-    """
+    prompt = _build_prompt(
+        query,
+        retrieved_chunks,
+        "6. List the source contexts you used in your answer",
+    )
     
     try:
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-                response_schema=search_inbox_schema
-            )
-        )
-        
-        # Parse the JSON response
-        result = json.loads(response.text)
-        return result
+        return generate_structured(prompt)
         
     except Exception as e:
         # Return a fallback response if Gemini fails
         return {
             "answer": f"Search failed: {str(e)}. Please try rephrasing your question or search manually.",
-            "sources": ["Error occurred during search"]
-        }
\ No newline at end of file
+            "sources": ["Error occurred during search"],
+            "degraded": True,
+            "degraded_reason": degraded_reason(e),
+        }
+
+
+def search_inbox_stream(query: str, retrieved_chunks: list[str]) -> Iterator[str]:
+    """
+    Streaming variant of search_inbox: yields answer text as Gemini generates it.
+
+    The answer is plain text (no JSON envelope) with inline "[Context N]"
+    citations, since sources are sent to the client separately.
+    Closing the generator cancels the upstream Gemini call.
+
+    Args:
+        query: The professor's question or search query
+        retrieved_chunks: List of relevant email chunks from vector search
+
+    Yields:
+        Answer text fragments, in order
+    """
+
+    prompt = _build_prompt(
+        query,
+        retrieved_chunks,
+        "6. Reply in plain text and cite contexts inline as [Context N]",
+    )
+
+    started = time.perf_counter()
+    response = generate_content(
+        prompt.text,
+        workflow=prompt.workflow,
+        input_tokens=prompt.input_tokens,
+        stream=True,
+        generation_config=dict(max_output_tokens=prompt.max_output_tokens),
+    )
+    parts, last_chunk = [], None
+    try:
+        for chunk in response:
+            last_chunk = chunk
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk without text parts (e.g. only safety metadata)
+                continue
+            if text:
+                parts.append(text)
+                yield text
+    finally:
+        # GeneratorExit on client disconnect lands here; stop Gemini too.
+        cancel_stream(response)
+        # The final chunk carries usage metadata for the whole stream.
+        record_usage(prompt, last_chunk, output_text="".join(parts), started=started)
@@ -0,0 +1,445 @@
+"""
+Tolerant parsing of structured (JSON) model output
+
+Models occasionally return JSON wrapped in prose or code fences, cut off at
+max_output_tokens, or with fields of the wrong type. Rather than failing
+the call (and paying for another one), output is repaired locally:
+
+1. extract the outermost JSON value, ignoring surrounding text
+2. close truncated strings, arrays and objects, dropping a dangling
+   incomplete element
+3. coerce fields into the workflow's typed result model (schemas.py
+   decides which fields are required)
+
+Only output that still has no usable required fields raises
+StructuredOutputError; generate_structured() then re-requests once.
+Clean / repaired / failed counts per workflow back /llm/parse-stats.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from .client import generate_content
+from .prompting import Prompt, record_usage
+from .schemas import (
+    CATEGORY_NAMES,
+    categorize_batch_schema,
+    categorize_schema,
+    daily_digest_schema,
+    digest_chunk_schema,
+    generate_reply_schema,
+    search_inbox_schema,
+    summarize_thread_schema,
+)
+
+
+STRUCTURED_OUTPUT_RETRIES = int(os.getenv("STRUCTURED_OUTPUT_RETRIES", "1"))
+_MAX_TRIMS = 64
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+class StructuredOutputError(ValueError):
+    """Model output could not be turned into a valid result."""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason        # "no_json" | "unparseable" | "invalid"
+
+
+# ---------------------------------------------------
+# Extraction and repair
+# ---------------------------------------------------
+def _scan(text: str, start: int) -> tuple[int, list[str], bool, list[int]]:
+    """
+    Walk a JSON value starting at ``start``.
+
+    Returns:
+        (end index or -1 if truncated, unclosed closers, inside a string,
+        positions of structural commas)
+    """
+    stack: list[str] = []
+    commas: list[int] = []
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+        elif c in "}]":
+            if not stack or stack[-1] != c:
+                return i, stack, False, commas      # stray closer: stop here
+            stack.pop()
+            if not stack:
+                return i + 1, [], False, commas
+        elif c == ",":
+            commas.append(i)
+    return -1, stack, in_string, commas
+
+
+def _close(fragment: str) -> Optional[object]:
+    """Close a truncated JSON fragment; None if that doesn't parse."""
+    end, stack, in_string, _ = _scan(fragment, 0)
+    if end != -1:
+        return None
+    text = fragment
+    if in_string:
+        text = text[:-1] if text.endswith("\\") else text
+        text += '"'
+    text = text.rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    text += "".join(reversed(stack))
+    try:
+        return json.loads(_TRAILING_COMMA_RE.sub(r"\1", text))
+    except json.JSONDecodeError:
+        return None
+
+
+def extract_json(text: str) -> tuple[object, list[str]]:
+    """
+    Parse the outermost JSON object/array in ``text``, repairing it if needed.
+
+    Returns:
+        (value, repairs) where repairs names what had to be fixed
+
+    Raises:
+        StructuredOutputError: no JSON value could be recovered
+    """
+    text = text or ""
+    try:
+        return json.loads(text), []
+    except json.JSONDecodeError:
+        pass
+
+    repairs: list[str] = []
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        raise StructuredOutputError("no JSON object in model output", "no_json")
+    start = min(starts)
+    if text[:start].strip():
+        repairs.append("stripped_prefix")
+
+    end, _, _, commas = _scan(text, start)
+    if end != -1:
+        candidate = text[start:end]
+        if text[end:].strip():
+            repairs.append("stripped_suffix")
+        try:
+            return json.loads(candidate), repairs
+        except json.JSONDecodeError:
+            pass
+        fixed = _TRAILING_COMMA_RE.sub(r"\1", candidate)
+        try:
+            return json.loads(fixed), repairs + ["trailing_comma"]
+        except json.JSONDecodeError:
+            raise StructuredOutputError("model output is not valid JSON", "unparseable")
+
+    # Truncated: close what is open; failing that, drop the trailing
+    # (incomplete) element and try again.
+    fragment = text[start:]
+    value = _close(fragment)
+    if value is not None:
+        return value, repairs + ["closed_truncated"]
+    for comma in reversed(commas[-_MAX_TRIMS:]):
+        value = _close(fragment[: comma - start])
+        if value is not None:
+            return value, repairs + ["closed_truncated", "dropped_partial_element"]
+    raise StructuredOutputError("truncated model output could not be repaired", "unparseable")
+
+
+# ---------------------------------------------------
+# Coercion helpers
+# ---------------------------------------------------
+def _text(value, default: Optional[str] = None) -> Optional[str]:
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, list):
+        return " ".join(str(v) for v in value)
+    return str(value)
+
+
+def _number(value, default: Optional[float] = None) -> Optional[float]:
+    if isinstance(value, bool):
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.search(str(value or ""))   # "7", "7/10", "priority: 8"
+    return float(match.group()) if match else default
+
+
+def _text_list(value) -> list[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        lines = [line.strip(" -•*\t") for line in value.splitlines()]
+        return [line for line in lines if line]
+    if isinstance(value, list):
+        return [_text(v) for v in value if v is not None and _text(v)]
+    return [_text(value)]
+
+
+def _normalize_category(value) -> Optional[str]:
+    text = (_text(value) or "").lower().replace(" ", "_").replace("-", "_")
+    if text in CATEGORY_NAMES:
+        return text
+    return next((c for c in CATEGORY_NAMES if c in text), None)
+
+
+# ---------------------------------------------------
+# Typed result models
+# ---------------------------------------------------
+@dataclass
+class CategorizeResult:
+    category: str
+    priority_score: float
+    tone: str
+    summary: str
+    hidden_intent: Optional[str] = None
+
+    @classmethod
+    def from_payload(cls, data: dict, repairs: list[str]) -> "CategorizeResult":
+        priority = _number(data.get("priority_score"))
+        if priority is None:
+            raise StructuredOutputError("priority_score missing", "invalid")
+        if not 1 <= priority <= 10:
+            repairs.append("clamped_priority")
+            priority = min(max(priority, 1.0), 10.0)
+        category = _normalize_category(data.get("category"))
+        if category is None:
+            repairs.append("unknown_category")
+            category = "other"
+        return cls(
+            category=category,
+            priority_score=priority,
+            tone=_text(data.get("tone"), "professional"),
+            summary=_text(data.get("summary"), ""),
+            hidden_intent=_text(data.get("hidden_intent")),
+        )
+
+
+@dataclass
+class CategorizeBatchResult:
+    results: list[dict] = field(default_factory=list)
+
+    @classmethod
+    def from_payload(cls, data, repairs: list[str]) -> "CategorizeBatchResult":
+        items = data.get("results") if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise StructuredOutputError("results array missing", "invalid")
+        results = []
+        for item in items:
+            if not isinstance(item, dict) or item.get("email_id") in (None, ""):
+                repairs.append("dropped_invalid_item")
+                continue
+            try:
+                parsed = asdict(CategorizeResult.from_payload(item, repairs))
+            except StructuredOutputError:
+                repairs.append("dropped_invalid_item")
+                continue
+            results.append({"email_id": str(item["email_id"]).strip(), **parsed})
+        return cls(results=results)
+
+
+@dataclass
+class ReplyResult:
+    draft: str
+    reasoning: Optional[str] = None
+
+    @classmethod
+    def from_payload(cls, data: dict, repairs: list[str]) -> "ReplyResult":
+        return cls(draft=_text(data.get("draft"), ""), reasoning=_text(data.get("reasoning")))
+
+
+@dataclass
+class ThreadSummaryResult:
+    summary: str
+    key_points: list[str] = field(default_factory=list)
+    latest_student_question: Optional[str] = None
+
+    @classmethod
+    def from_payload(cls, data: dict, repairs: list[str]) -> "ThreadSummaryResult":
+        return cls(
+            summary=_text(data.get("summary"), ""),
+            key_points=_text_list(data.get("key_points")),
+            latest_student_question=_text(data.get("latest_student_question")),
+        )
+
+
+@dataclass
+class DigestResult:
+    # Counts are computed in SQL and merged in by the caller
+    summary: str
+    high_priority: list[str] = field(default_factory=list)
+    common_themes: list[str] = field(default_factory=list)
+    recommendations: list[str] = field(default_factory=list)
+
+    @classmethod
+    def from_payload(cls, data: dict, repairs: list[str]) -> "DigestResult":
+        return cls(
+            summary=_text(data.get("summary") or data.get("digest"), ""),
+            high_priority=_text_list(data.get("high_priority")),
+            common_themes=_text_list(data.get("common_themes")),
+            recommendations=_text_list(data.get("recommendations")),
+        )
+
+
+@dataclass
+class DigestChunkResult:
+    summary: str
+    high_priority: list[str] = field(default_factory=list)
+    common_themes: list[str] = field(default_factory=list)
+
+    @classmethod
+    def from_payload(cls, data: dict, repairs: list[str]) -> "DigestChunkResult":
+        return cls(
+            summary=_text(data.get("summary"), ""),
+            high_priority=_text_list(data.get("high_priority")),
+            common_themes=_text_list(data.get("common_themes")),
+        )
+
+
+@dataclass
+class SearchResult:
+    answer: str
+    sources: list[str] = field(default_factory=list)
+
+    @classmethod
+    def from_payload(cls, data: dict, repairs: list[str]) -> "SearchResult":
+        return cls(answer=_text(data.get("answer"), ""), sources=_text_list(data.get("sources")))
+
+
+# workflow -> (response schema, result model)
+RESULT_MODELS = {
+    "categorize_email": (categorize_schema, CategorizeResult),
+    "categorize_batch": (categorize_batch_schema, CategorizeBatchResult),
+    "generate_reply": (generate_reply_schema, ReplyResult),
+    "summarize_thread": (summarize_thread_schema, ThreadSummaryResult),
+    "thread_summary_update": (summarize_thread_schema, ThreadSummaryResult),
+    "daily_digest": (daily_digest_schema, DigestResult),
+    "digest_chunk": (digest_chunk_schema, DigestChunkResult),
+    "search_inbox": (search_inbox_schema, SearchResult),
+}
+
+
+# ---------------------------------------------------
+# Parsing and accounting
+# ---------------------------------------------------
+_stats: dict[str, dict] = {}
+_stats_lock = threading.Lock()
+
+
+def _record(workflow: str, outcome: str, repairs: list[str] = ()) -> None:
+    with _stats_lock:
+        counters = _stats.setdefault(workflow, {"clean": 0, "repaired": 0, "failed": 0, "re_requests": 0, "repairs": {}})
+        counters[outcome] += 1
+        for repair in repairs:
+            counters["repairs"][repair] = counters["repairs"].get(repair, 0) + 1
+
+
+def parse_output(workflow: str, text: str) -> dict:
+    """
+    Parse and validate a workflow's model output.
+
+    Returns:
+        The typed result as a dict (``"repaired": [...]`` lists any fixes)
+
+    Raises:
+        StructuredOutputError: nothing usable could be recovered
+    """
+    schema, model = RESULT_MODELS[workflow]
+    try:
+        data, repairs = extract_json(text)
+        if isinstance(data, list) and schema.get("type") == "object" and workflow != "categorize_batch":
+            data = next((d for d in data if isinstance(d, dict)), {})
+            repairs.append("unwrapped_array")
+        if not isinstance(data, (dict, list)):
+            raise StructuredOutputError("model output is not a JSON object", "invalid")
+
+        if isinstance(data, dict):
+            missing = [key for key in schema.get("required", []) if data.get(key) in (None, "")]
+            if missing:
+                # A missing field that the model can default is a repair;
+                # missing every required field means nothing was salvaged.
+                if len(missing) == len(schema.get("required", [])):
+                    raise StructuredOutputError(f"required fields missing: {missing}", "invalid")
+                repairs.append("defaulted_required")
+        result = asdict(model.from_payload(data, repairs))
+    except StructuredOutputError:
+        _record(workflow, "failed")
+        raise
+
+    _record(workflow, "repaired" if repairs else "clean", repairs)
+    if repairs:
+        result["repaired"] = sorted(set(repairs))
+    return result
+
+
+def generate_structured(prompt: Prompt, retries: int = STRUCTURED_OUTPUT_RETRIES) -> dict:
+    """
+    Call the model for ``prompt`` with its workflow's response schema and
+    return the parsed result, re-requesting only when the output could not
+    be repaired.
+
+    Raises:
+        LLMUnavailableError: no model could answer
+        StructuredOutputError: every attempt was unrecoverable
+    """
+    schema, _ = RESULT_MODELS[prompt.workflow]
+    for attempt in range(retries + 1):
+        if attempt:
+            _record(prompt.workflow, "re_requests")
+        started = time.perf_counter()
+        response = generate_content(
+            prompt.text,
+            workflow=prompt.workflow,
+            input_tokens=prompt.input_tokens,
+            prefix=prompt.prefix,
+            generation_config=dict(
+                response_mime_type="application/json",
+                response_schema=schema,
+                max_output_tokens=prompt.max_output_tokens,
+            ),
+        )
+        record_usage(prompt, response, started=started)
+        try:
+            text = response.text
+        except ValueError as e:
+            # No text parts (safety block); asking again won't change that.
+            raise StructuredOutputError(f"model returned no text: {e}", "no_json") from e
+        try:
+            return parse_output(prompt.workflow, text)
+        except StructuredOutputError as e:
+            error = e
+    raise error
+
+
+def parse_stats() -> dict:
+    with _stats_lock:
+        workflows = {name: {**c, "repairs": dict(c["repairs"])} for name, c in _stats.items()}
+    for counters in workflows.values():
+        parsed = counters["clean"] + counters["repaired"] + counters["failed"]
+        # Share of not-clean outputs that were rescued without another call
+        broken = counters["repaired"] + counters["failed"]
+        counters["salvage_rate"] = round(counters["repaired"] / broken, 4) if broken else None
+        counters["failure_rate"] = round(counters["failed"] / parsed, 4) if parsed else 0.0
+    return {"workflows": workflows}
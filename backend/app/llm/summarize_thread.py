@@ -1,60 +1,120 @@
 """
 Thread summarization workflow using Gemini
 """
-import json
-import google.generativeai as genai
-from .client import get_model
-from .schemas import summarize_thread_schema
+from typing import Union
 
+from .client import degraded_reason
+from .cache import llm_cache
+from .prompting import PromptBuilder
+from .structured import generate_structured
 
-def summarize_thread(thread_text: str) -> dict:
+
+@llm_cache("summarize_thread", prompt_version=2)
+def summarize_thread(thread_text: Union[str, list[str]]) -> dict:
     """
     Summarize an entire email thread
     
     Args:
-        thread_text: Complete email thread text with all messages
+        thread_text: Complete email thread text, or its messages oldest
+            first (over-budget threads then keep the most recent messages)
     
     Returns:
         Dictionary with summary, key_points, and latest_student_question
     """
-    model = get_model()
     
     # Build the prompt
-    prompt = f"""
-    You are an AI assistant helping a professor understand email threads. Analyze the following email thread and provide a structured summary.
+    builder = (
+        PromptBuilder("summarize_thread")
+        .text("You are an AI assistant helping a professor understand email threads. "
+              "Analyze the following email thread and provide a structured summary.\n")
+        .text("Email thread:")
+    )
+    if isinstance(thread_text, str):
+        builder.body("thread", thread_text)
+    else:
+        builder.thread("thread", thread_text)
+    prompt = builder.text("""
+Please provide:
+1. A concise summary of the entire conversation
+2. Key points or decisions made in the thread
+3. The latest question or request from the student (if any)
+
+Guidelines:
+- Keep the summary under 200 words
+- Extract 3-5 key points maximum
+- Focus on actionable items and important information
+- Identify what the student is currently asking for or needs""").build()
 
-    Email thread:
-    {thread_text}
-    
-    Please provide:
-    1. A concise summary of the entire conversation
-    2. Key points or decisions made in the thread
-    3. The latest question or request from the student (if any)
-    
-    Guidelines:
-    - Keep the summary under 200 words
-    - Extract 3-5 key points maximum
-    - Focus on actionable items and important information
-    - Identify what the student is currently asking for or needs
-    """
-    
     try:
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-                response_schema=summarize_thread_schema
-            )
-        )
-        
-        # Parse the JSON response
-        result = json.loads(response.text)
-        return result
-        
+        return generate_structured(prompt)
+
     except Exception as e:
         # Return a fallback response if Gemini fails
         return {
             "summary": f"Thread summarization failed: {str(e)}",
             "key_points": ["Unable to extract key points"],
-            "latest_student_question": "Unable to determine latest question"
-        }
\ No newline at end of file
+            "latest_student_question": "Unable to determine latest question",
+            "degraded": True,
+            "degraded_reason": degraded_reason(e)
+        }
+
+
+def format_thread_summary(result: dict) -> str:
+    """A summarize_thread / update_thread_summary result as prompt text."""
+    lines = [result.get("summary") or ""]
+    lines += [f"- {point}" for point in result.get("key_points") or []]
+    if result.get("latest_student_question"):
+        lines.append(f"Latest student question: {result['latest_student_question']}")
+    return "\n".join(line for line in lines if line)
+
+
+@llm_cache("thread_summary_update", prompt_version=1)
+def update_thread_summary(previous_summary: str, new_message: str) -> dict:
+    """
+    Fold one new message into an existing thread summary
+    
+    Costs one summary plus one message regardless of how long the thread
+    has grown; the previous summary stands in for the earlier messages.
+    
+    Args:
+        previous_summary: format_thread_summary() of the summary so far
+        new_message: The message to fold in
+    
+    Returns:
+        Dictionary with summary, key_points, and latest_student_question
+        covering the thread up to and including ``new_message``
+    """
+    prompt = (
+        PromptBuilder("thread_summary_update")
+        .text("You are an AI assistant helping a professor understand email threads. "
+              "Below is a summary of an email thread so far, followed by a new message in the thread. "
+              "Update the summary so it covers the whole thread including the new message.\n")
+        .text("Summary so far:")
+        .body("previous_summary", previous_summary)
+        .text("\nNew message:")
+        .body("new_message", new_message)
+        .text("""
+Please provide:
+1. A concise summary of the entire conversation, including the new message
+2. Key points or decisions made in the thread (keep earlier ones that still matter)
+3. The latest question or request from the student (if any)
+
+Guidelines:
+- Keep the summary under 200 words
+- Extract 3-5 key points maximum
+- Focus on actionable items and important information
+- Identify what the student is currently asking for or needs""")
+        .build()
+    )
+
+    try:
+        return generate_structured(prompt)
+
+    except Exception as e:
+        return {
+            "summary": previous_summary,
+            "key_points": [],
+            "latest_student_question": None,
+            "degraded": True,
+            "degraded_reason": degraded_reason(e)
+        }
@@ -4,6 +4,8 @@ from .embedding import Embedding
 from .preference import Preference
 from .digest import DailyDigest
 from .email_action import EmailAction
+from .llm_cache import LLMCacheEntry
+from .thread_summary import ThreadSummary
 
 __all__ = [
     "User",
@@ -12,4 +14,6 @@ __all__ = [
     "Preference",
     "DailyDigest",
     "EmailAction",
+    "LLMCacheEntry",
+    "ThreadSummary",
 ]
\ No newline at end of file
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import json
 import uuid
 from datetime import date, datetime
+from typing import Optional
 
-from sqlalchemy import Date, DateTime, ForeignKey, Index, Text, func
-from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy import Date, DateTime, ForeignKey, Index, Integer, String, Text, UniqueConstraint, func
+from sqlalchemy.dialects.postgresql import JSONB, UUID as PG_UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.db import Base
@@ -12,7 +14,10 @@ from app.db import Base
 
 class DailyDigest(Base):
     __tablename__ = "daily_digests"
-    __table_args__ = (Index("ix_daily_digests_user_id", "user_id"),)
+    __table_args__ = (
+        UniqueConstraint("user_id", "summary_date", name="uq_daily_digests_user_date"),
+        Index("ix_daily_digests_user_id", "user_id"),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(
         PG_UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
@@ -22,6 +27,14 @@ class DailyDigest(Base):
     )
     digest_text: Mapped[str] = mapped_column(Text, nullable=False)
     summary_date: Mapped[date] = mapped_column(Date, nullable=False)
+
+    # What the digest was generated from (app/workers/digests.py): the day's
+    # email ids, User.inbox_version at the time, and a hash of the ids with
+    # their classifications. A digest is regenerated only when the hash changes.
+    email_ids: Mapped[list] = mapped_column(JSONB, nullable=False, default=list, server_default="[]")
+    inbox_version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    source_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), nullable=False, server_default=func.now()
     )
@@ -33,3 +46,12 @@ class DailyDigest(Base):
     )
 
     user: Mapped["User"] = relationship("User", back_populates="daily_digests")
+
+    def to_dict(self):
+        return {
+            "date": self.summary_date.isoformat(),
+            "digest": json.loads(self.digest_text),
+            "email_count": len(self.email_ids or []),
+            "inbox_version": self.inbox_version,
+            "generated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
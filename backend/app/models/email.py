@@ -5,6 +5,7 @@ from datetime import datetime
 from typing import List, Optional
 
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     DateTime,
     ForeignKey,
@@ -22,7 +23,10 @@ from app.db import Base
 
 class Email(Base):
     __tablename__ = "emails"
-    __table_args__ = (Index("ix_emails_user_id", "user_id"),)
+    __table_args__ = (
+        Index("ix_emails_user_id", "user_id"),
+        Index("ix_emails_duplicate_of_id", "duplicate_of_id"),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(
         PG_UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
@@ -56,6 +60,19 @@ class Email(Base):
     risk_flag: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="false")
     summary: Mapped[Optional[str]] = mapped_column(Text)
     draft_reply: Mapped[Optional[str]] = mapped_column(Text)
+    # Hash of the inputs draft_reply was generated from (app/workers/drafts.py)
+    draft_fingerprint: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    # "llm", "local" (fast-path model) or "near_duplicate" (copied from duplicate_of)
+    classification_source: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+
+    # Near-duplicate detection (app/search/near_duplicate.py)
+    simhash: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    duplicate_of_id: Mapped[Optional[uuid.UUID]] = mapped_column(
+        PG_UUID(as_uuid=True), ForeignKey("emails.id", ondelete="SET NULL"), nullable=True
+    )
+
+    # Set once the email has been chunked and embedded for RAG search
+    indexed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
@@ -101,4 +118,6 @@ class Email(Base):
             "risk_flag": self.risk_flag,
             "summary": self.summary,
             "draft_reply": self.draft_reply,
+            "classification_source": self.classification_source,
+            "duplicate_of": str(self.duplicate_of_id) if self.duplicate_of_id else None,
         }
@@ -28,6 +28,8 @@ class Preference(Base):
     reply_length: Mapped[Optional[str]] = mapped_column(String(64))
     course_policies: Mapped[Optional[dict]] = mapped_column(JSONB)
     signature: Mapped[Optional[str]] = mapped_column(Text)
+    # IANA name, e.g. "America/New_York"; schedules digest precomputation
+    timezone: Mapped[Optional[str]] = mapped_column(String(64))
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), nullable=False, server_default=func.now()
     )
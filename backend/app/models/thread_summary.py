@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import DateTime, ForeignKey, Integer, String, Text, UniqueConstraint, func
+from sqlalchemy.dialects.postgresql import JSONB, UUID as PG_UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db import Base
+
+
+class ThreadSummary(Base):
+    """Rolling summary of a conversation, up to and including ``last_email``."""
+
+    __tablename__ = "thread_summaries"
+    __table_args__ = (
+        UniqueConstraint("user_id", "conversation_id", name="uq_thread_summaries_user_conversation"),
+    )
+
+    id: Mapped[uuid.UUID] = mapped_column(
+        PG_UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
+    )
+    user_id: Mapped[uuid.UUID] = mapped_column(
+        PG_UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    conversation_id: Mapped[str] = mapped_column(String(255), nullable=False)
+
+    summary: Mapped[str] = mapped_column(Text, nullable=False)
+    key_points: Mapped[list] = mapped_column(JSONB, nullable=False, default=list)
+    latest_student_question: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    # The newest message folded into the summary
+    last_email_id: Mapped[Optional[uuid.UUID]] = mapped_column(
+        PG_UUID(as_uuid=True), ForeignKey("emails.id", ondelete="SET NULL"), nullable=True
+    )
+    last_received_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
@@ -4,7 +4,7 @@ import uuid
 from datetime import datetime
 from typing import List, Optional
 
-from sqlalchemy import DateTime, String, Text, func
+from sqlalchemy import DateTime, Integer, String, Text, func
 from sqlalchemy.dialects.postgresql import JSONB, UUID as PG_UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -27,6 +27,10 @@ class User(Base):
     reply_length_preference: Mapped[Optional[str]] = mapped_column(String(64))
     course_policies: Mapped[Optional[dict]] = mapped_column(JSONB)
     signature: Mapped[Optional[str]] = mapped_column(Text)
+    # Bumped whenever new mail is synced; keys inbox-derived caches.
+    inbox_version: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), nullable=False, server_default=func.now()
     )
@@ -0,0 +1,217 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+import time
+
+from app.db import SessionLocal
+from app.models import User
+from app.search.cache import cache_stats, cached_embedder, get_cached_answer, invalidate_user, store_answer
+from app.llm.embeddings import embed_query
+from app.llm.search_inbox import search_inbox, search_inbox_stream
+from app.modules.streaming import elapsed_ms, sse, sse_response
+
+ask_bp = Blueprint("ask", __name__)
+
+embed_query_cached = cached_embedder(embed_query)
+
+
+# Retrieval and indexing pull in NumPy and the vector index; import them on
+# first use so worker start-up doesn't pay for it.
+def retrieve(*args, **kwargs):
+    from app.search.retrieval import retrieve as _retrieve
+
+    return _retrieve(*args, **kwargs)
+
+
+def index_user_emails(*args, **kwargs):
+    from app.search.indexing import index_user_emails as _index_user_emails
+
+    return _index_user_emails(*args, **kwargs)
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# ===================================================
+# ASK THE INBOX (hybrid retrieval + Gemini RAG)
+# POST /ask
+# ===================================================
+@ask_bp.route("/", methods=["POST"], strict_slashes=False)
+@jwt_required()
+def ask_inbox():
+    db = next(get_db())
+    user_id = get_jwt_identity()
+
+    payload = request.get_json() or {}
+    query = (payload.get("query") or "").strip()
+    if not query:
+        return jsonify({"success": False, "error": "query required"}), 400
+
+    started = time.perf_counter()
+
+    user = db.query(User).filter_by(id=user_id).first()
+    if not user:
+        return jsonify({"success": False, "error": "User not found"}), 404
+    inbox_version = user.inbox_version
+    db.close()
+
+    # ---- ANSWER CACHE ----
+    cached = get_cached_answer(user_id, query, inbox_version)
+    if cached is not None:
+        return jsonify({
+            **cached,
+            "cached": True,
+            "timings_ms": {"total": elapsed_ms(started)},
+        })
+
+    # ---- RETRIEVAL (BM25 + vector, fused) ----
+    retrieval = retrieve(user_id, query, embed_query=embed_query_cached)
+    timings = dict(retrieval.timings_ms)
+
+    if not retrieval.chunks:
+        timings["total"] = elapsed_ms(started)
+        return jsonify({
+            "success": True,
+            "answer": "I couldn't find any emails related to that question.",
+            "sources": [],
+            "cached": False,
+            "timings_ms": timings,
+        })
+
+    # ---- GEMINI CALL ----
+    generate_start = time.perf_counter()
+    result = search_inbox(query, [c.to_context() for c in retrieval.chunks])
+    timings["generate"] = elapsed_ms(generate_start)
+    timings["total"] = elapsed_ms(started)
+
+    response = {
+        "success": True,
+        "answer": result.get("answer"),
+        "cited": result.get("sources", []),
+        "sources": [c.to_source() for c in retrieval.chunks],
+        "retrieval": {
+            "lexical_hits": retrieval.lexical_hits,
+            "vector_hits": retrieval.vector_hits,
+            "context_tokens": retrieval.context_tokens,
+        },
+    }
+    store_answer(user_id, query, inbox_version, response)
+
+    return jsonify({**response, "cached": False, "timings_ms": timings})
+
+
+# ===================================================
+# ASK THE INBOX, STREAMED (Server-Sent Events)
+# POST /ask/stream
+#
+# Events: "sources" (retrieved chunks, sent before generation starts),
+# "token" (answer text as it arrives), "done" (timings), "error".
+# ===================================================
+@ask_bp.route("/stream", methods=["POST"])
+@jwt_required()
+def ask_inbox_stream():
+    db = next(get_db())
+    user_id = get_jwt_identity()
+
+    payload = request.get_json() or {}
+    query = (payload.get("query") or "").strip()
+    if not query:
+        return jsonify({"success": False, "error": "query required"}), 400
+
+    started = time.perf_counter()
+
+    user = db.query(User).filter_by(id=user_id).first()
+    if not user:
+        return jsonify({"success": False, "error": "User not found"}), 404
+    inbox_version = user.inbox_version
+    db.close()
+
+    def events():
+        # Flush headers immediately so the client sees the stream open.
+        yield ": stream open\n\n"
+
+        cached = get_cached_answer(user_id, query, inbox_version)
+        if cached is not None:
+            yield sse("sources", {"sources": cached["sources"], "cached": True})
+            yield sse("token", {"text": cached["answer"]})
+            yield sse("done", {"cached": True, "timings_ms": {"total": elapsed_ms(started)}})
+            return
+
+        retrieval = retrieve(user_id, query, embed_query=embed_query_cached)
+        timings = dict(retrieval.timings_ms)
+        sources = [c.to_source() for c in retrieval.chunks]
+        stats = {
+            "lexical_hits": retrieval.lexical_hits,
+            "vector_hits": retrieval.vector_hits,
+            "context_tokens": retrieval.context_tokens,
+        }
+        yield sse("sources", {"sources": sources, "retrieval": stats, "cached": False})
+
+        if not retrieval.chunks:
+            yield sse("token", {"text": "I couldn't find any emails related to that question."})
+            yield sse("done", {"cached": False, "timings_ms": {**timings, "total": elapsed_ms(started)}})
+            return
+
+        # ---- GEMINI CALL (streamed) ----
+        generate_start = time.perf_counter()
+        tokens = search_inbox_stream(query, [c.to_context() for c in retrieval.chunks])
+        parts = []
+        try:
+            for text in tokens:
+                if not parts:
+                    timings["first_token"] = elapsed_ms(started)
+                parts.append(text)
+                yield sse("token", {"text": text})
+        except Exception as e:
+            yield sse("error", {"error": f"Search failed: {e}"})
+            return
+        finally:
+            # On client disconnect the server closes this generator, which
+            # closes the token stream and cancels the upstream Gemini call.
+            tokens.close()
+
+        timings["generate"] = elapsed_ms(generate_start)
+        timings["total"] = elapsed_ms(started)
+
+        store_answer(user_id, query, inbox_version, {
+            "success": True,
+            "answer": "".join(parts),
+            "cited": [],
+            "sources": sources,
+            "retrieval": stats,
+        })
+        yield sse("done", {"cached": False, "timings_ms": timings})
+
+    return sse_response(events())
+
+
+# ===================================================
+# INDEX NEW EMAILS FOR RAG (thread-aware chunking + embeddings)
+# POST /ask/index
+# ===================================================
+@ask_bp.route("/index", methods=["POST"])
+@jwt_required()
+def index_emails():
+    db = next(get_db())
+    user_id = get_jwt_identity()
+
+    limit = min(request.args.get("limit", 500, type=int), 2000)
+    report = index_user_emails(db, user_id, limit=limit)
+    if report["chunks_written"]:
+        invalidate_user(user_id)
+
+    return jsonify({"success": True, "index": report})
+
+
+# ===================================================
+# CACHE STATISTICS
+# GET /ask/cache-stats
+# ===================================================
+@ask_bp.route("/cache-stats", methods=["GET"])
+@jwt_required()
+def ask_cache_stats():
+    return jsonify({"success": True, "cache": cache_stats()})
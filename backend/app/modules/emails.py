@@ -6,9 +6,15 @@ from datetime import datetime
 
 from app.db import SessionLocal
 from app.models import User, Email
+from app.search.cache import invalidate_user
+from app.search.near_duplicate import assign_near_duplicates, index_canonical
+from app.singleflight import get_group
+from app.workers.drafts import invalidate_threads
 
 emails_bp = Blueprint("emails", __name__)
 
+_sync_flight = get_group("sync")
+
 
 # Utility: get DB session
 def get_db():
@@ -103,6 +109,16 @@ def sync_emails():
             "error": "User not authenticated with Microsoft",
         }), 401
 
+    # A second sync for the same user while one is running (double-click,
+    # client retry) waits for it and returns its result instead of fetching
+    # and inserting the same messages again.
+    (body, status), shared = _sync_flight.do(str(user_id), lambda: _sync(db, user, user_id))
+    if shared:
+        body = {**body, "coalesced": True}
+    return jsonify(body), status
+
+
+def _sync(db, user, user_id) -> tuple[dict, int]:
     headers = {"Authorization": f"Bearer {user.access_token}"}
 
     graph_url = "https://graph.microsoft.com/v1.0/me/messages"
@@ -115,19 +131,20 @@ def sync_emails():
     response = requests.get(graph_url, headers=headers, params=params)
 
     if response.status_code == 401:
-        return jsonify({"success": False, "error": "Token expired"}), 401
+        return {"success": False, "error": "Token expired"}, 401
 
     if response.status_code != 200:
-        return jsonify({
+        return {
             "success": False,
             "error": "Microsoft Graph error",
             "details": response.text,
-        }), 500
+        }, 500
 
     data = response.json()
     messages = data.get("value", [])
 
     new_emails = 0
+    added = []
 
     for msg in messages:
         ms_id = msg["id"]
@@ -157,15 +174,33 @@ def sync_emails():
         )
 
         db.add(email)
+        added.append(email)
         new_emails += 1
 
+    near_duplicates, canonical = 0, []
+    if added:
+        # Link near-duplicates to a canonical email so classification can be reused
+        db.flush()
+        near_duplicates, canonical = assign_near_duplicates(db, user_id, added)
+
+    if new_emails:
+        # Invalidates Ask-the-Inbox answers cached against the old inbox.
+        user.inbox_version = User.inbox_version + 1
+        # Drafts written before these messages arrived answer a stale thread.
+        invalidate_threads(db, user_id, {email.conversation_id for email in added})
+
     db.commit()
+    index_canonical(user_id, canonical)
 
-    return jsonify({
+    if new_emails:
+        invalidate_user(user_id)
+
+    return {
         "success": True,
         "new_emails": new_emails,
+        "near_duplicates": near_duplicates,
         "message": f"Synced {new_emails} emails",
-    })
+    }, 200
 
 
 # ============================================
@@ -243,6 +278,16 @@ def get_stats():
         .filter(Email.user_id == user_id, Email.risk_flag == True)
         .scalar()
     )
+    near_duplicates = (
+        db.query(func.count(Email.id))
+        .filter(Email.user_id == user_id, Email.duplicate_of_id.isnot(None))
+        .scalar()
+    )
+    reused = (
+        db.query(func.count(Email.id))
+        .filter(Email.user_id == user_id, Email.classification_source == "near_duplicate")
+        .scalar()
+    )
 
     return jsonify({
         "success": True,
@@ -253,5 +298,8 @@ def get_stats():
             "urgent_emails": urgent,
             "risk_flagged_emails": risks,
             "processing_rate": (processed / total * 100) if total > 0 else 0,
+            "near_duplicate_emails": near_duplicates,
+            "dedup_rate": (near_duplicates / total * 100) if total > 0 else 0,
+            "reused_classifications": reused,
         },
     })
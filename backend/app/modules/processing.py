@@ -2,18 +2,37 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
 from sqlalchemy import func
-import json
+import time
 
-from app.db import SessionLocal
-from app.models import User, Email, DailyDigest
+from app.db import SessionLocal, get_session
+from app.models import User, Email
 
 # Gemini utilities (your existing LLM functions)
 from app.llm.categorize_email import categorize_email
-from app.llm.generate_reply import generate_reply
-from app.llm.daily_digest import generate_daily_digest
+from app.llm.generate_reply import generate_reply_stream
+from app.modules.streaming import elapsed_ms, sse, sse_response
+from app.search.near_duplicate import copy_classification
+from app.singleflight import get_group, input_hash
+from app.workers.classification import (
+    CLASSIFY_JOB_MAX_EMAILS,
+    apply_classification,
+    classification_input,
+    get_classification_engine,
+)
+from app.workers.digests import digest_source, ensure_daily_digest, stored_digest
+from app.workers.drafts import (
+    draft_fingerprint,
+    generate_draft,
+    get_draft_prefetcher,
+    reply_inputs,
+    stored_draft,
+)
+from app.workers.thread_summaries import thread_context
 
 processing_bp = Blueprint("processing", __name__)
 
+_classify_flight = get_group("classify")
+
 
 # ---------------------------------------------------
 # Helper: SQLAlchemy Session
@@ -46,26 +65,78 @@ def classify_email():
     if not email:
         return jsonify({"success": False, "error": "Email not found"}), 404
 
-    # ---- GEMINI CALL ----
-    result = categorize_email(
-        subject=email.subject or "",
-        body=email.body_content or "",
-        sender=email.sender_name or "",
-    )
+    # ---- NEAR-DUPLICATE REUSE (skipped with "force": true) ----
+    canonical = None
+    if email.duplicate_of_id and not payload.get("force"):
+        canonical = db.query(Email).filter_by(id=email.duplicate_of_id, user_id=user_id).first()
+
+    if canonical is not None and canonical.processed:
+        copy_classification(canonical, email)
+        db.commit()
+        get_draft_prefetcher().schedule(user_id, [email])
+        return jsonify({
+            "success": True,
+            "classification": {
+                "category": email.category,
+                "priority_score": email.urgency,
+                "summary": email.summary,
+            },
+            "near_duplicate": True,
+            "reused_from": str(canonical.id),
+        })
+
+    text = classification_input(email)
+    force = bool(payload.get("force"))
+
+    # ---- SINGLE-FLIGHT (concurrent identical requests share one call) ----
+    key = (str(user_id), "categorize_email", str(email.id), input_hash(text, force))
+    (body, status), shared = _classify_flight.do(key, lambda: _classify(db, email, text, force))
+    if shared:
+        body = {**body, "coalesced": True}
+    return jsonify(body), status
+
+
+def _classify(db, email, text: str, force: bool) -> tuple[dict, int]:
+    # ---- LOCAL FAST PATH (confident predictions skip Gemini) ----
+    # Imported on first use: NumPy is not needed to start a worker.
+    from app.llm.local_classifier import Triage, record_llm_result, triage
+
+    decision = Triage(prediction=None, escalate=True) if force else triage(text)
+    if decision.use_local:
+        result = decision.prediction.to_result()
+        apply_classification(email, result, source="local")
+        db.commit()
+        get_draft_prefetcher().schedule(email.user_id, [email])
+        return {
+            "success": True,
+            "classification": result,
+            "near_duplicate": False,
+        }, 200
+
+    # ---- GEMINI CALL (earlier messages as a rolling thread summary) ----
+    result = categorize_email(text, thread_context=thread_context(db, email))
+    record_llm_result(decision, result)
+
+    if result.get("degraded"):
+        # Don't persist a placeholder; the email stays unprocessed.
+        return {
+            "success": False,
+            "degraded": True,
+            "error": "Classification is temporarily unavailable",
+            "reason": result.get("degraded_reason"),
+        }, 503
 
     # Save results to DB
-    email.category = result.category
-    email.urgency = result.urgency
-    email.risk_flag = result.risk_flag
-    email.summary = result.summary
-    email.processed = True
+    apply_classification(email, result)
 
     db.commit()
+    get_draft_prefetcher().schedule(email.user_id, [email])
 
-    return jsonify({
+    return {
         "success": True,
-        "classification": result.model_dump(),
-    })
+        "classification": {**result, "source": "llm"},
+        "near_duplicate": False,
+    }, 200
 
 
 # ===================================================
@@ -90,21 +161,87 @@ def draft_reply():
     if not email:
         return jsonify({"success": False, "error": "Email not found"}), 404
 
-    # -------- GEMINI CALL ----------
-    reply = generate_reply(
-        email_subject=email.subject or "",
-        email_body=email.body_content or "",
-        professor_name=user.name,
-        tone=user.tone_preference or "professional",
-        length=user.reply_length_preference or "medium",
-        signature=user.signature or f"Best,\n{user.name}",
-    )
+    inputs = reply_inputs(db, email, user)
+    fingerprint = draft_fingerprint(inputs)
 
-    # Save draft to DB
-    email.draft_reply = reply.reply
-    db.commit()
+    # ---- PRE-GENERATED DRAFT ("regenerate": true asks for a new one) ----
+    draft = None if payload.get("regenerate") else stored_draft(email, fingerprint)
+    if draft is not None:
+        get_draft_prefetcher().record_served()
+        return jsonify({"success": True, "draft": {"draft": draft}, "prefetched": True})
+
+    # ---- GEMINI CALL (concurrent identical requests share one call) ----
+    body, status = generate_draft(db, email, inputs, fingerprint, user_id)
+    return jsonify(body), status
+
+
+# ===================================================
+# 2b) STREAM A DRAFT REPLY (Server-Sent Events)
+# POST /process/draft/stream
+#
+# Events: "token" (draft text as it arrives), "done" (saved + timings),
+# "error". The draft is saved to Email.draft_reply only once the stream
+# completes; a client disconnect cancels the Gemini call and saves nothing.
+# ===================================================
+@processing_bp.route("/draft/stream", methods=["POST"])
+@jwt_required()
+def draft_reply_stream():
+    db = next(get_db())
+    user_id = get_jwt_identity()
+
+    payload = request.get_json() or {}
+    email_id = payload.get("email_id")
 
-    return jsonify({"success": True, "draft": reply.model_dump()})
+    if not email_id:
+        return jsonify({"success": False, "error": "email_id required"}), 400
+
+    email = db.query(Email).filter_by(id=email_id, user_id=user_id).first()
+    user = db.query(User).filter_by(id=user_id).first()
+
+    if not email:
+        return jsonify({"success": False, "error": "Email not found"}), 404
+
+    inputs = reply_inputs(db, email, user)
+    fingerprint = draft_fingerprint(inputs)
+    draft = None if payload.get("regenerate") else stored_draft(email, fingerprint)
+    db.close()
+
+    def events():
+        started = time.perf_counter()
+        # Flush headers immediately so the client sees the stream open.
+        yield ": stream open\n\n"
+
+        if draft is not None:
+            # Pre-generated draft: one token event, nothing to save
+            get_draft_prefetcher().record_served()
+            yield sse("token", {"text": draft})
+            yield sse("done", {"saved": True, "prefetched": True, "length": len(draft), "timings_ms": {"total": elapsed_ms(started)}})
+            return
+
+        tokens = generate_reply_stream(**inputs)
+        parts, timings = [], {}
+        try:
+            for text in tokens:
+                if not parts:
+                    timings["first_token"] = elapsed_ms(started)
+                parts.append(text)
+                yield sse("token", {"text": text})
+        except Exception as e:
+            yield sse("error", {"error": f"Draft generation failed: {e}", "degraded": True})
+            return
+        finally:
+            # Runs on client disconnect too: cancels the upstream Gemini call.
+            tokens.close()
+
+        text = "".join(parts).strip()
+        with get_session() as session:
+            session.query(Email).filter_by(id=email_id, user_id=user_id).update(
+                {"draft_reply": text, "draft_fingerprint": fingerprint}, synchronize_session=False
+            )
+        timings["total"] = elapsed_ms(started)
+        yield sse("done", {"saved": True, "length": len(text), "timings_ms": timings})
+
+    return sse_response(events())
 
 
 # ===================================================
@@ -160,80 +297,82 @@ def digest():
     user_id = get_jwt_identity()
 
     user = db.query(User).filter_by(id=user_id).first()
-    date_str = request.json.get("date")
+    payload = request.get_json() or {}
+    date_str = payload.get("date")
 
     day = datetime.fromisoformat(date_str).date() if date_str else datetime.utcnow().date()
 
-    emails = (
-        db.query(Email)
-        .filter(
-            Email.user_id == user_id,
-            Email.received_at >= datetime.combine(day, datetime.min.time()),
-            Email.received_at <= datetime.combine(day, datetime.max.time()),
-        )
-        .all()
-    )
+    # ----- STORED DIGEST, REGENERATED ONLY IF THE DAY'S MAIL CHANGED -----
+    # ("force": true regenerates regardless)
+    stored, generated = ensure_daily_digest(db, user, day, force=bool(payload.get("force")))
 
-    summaries = [
-        {
-            "subject": e.subject,
-            "sender": e.sender_name,
-            "category": e.category,
-            "urgency": e.urgency,
-            "summary": e.summary or e.body_preview,
-        }
-        for e in emails
-    ]
-
-    # ----- GEMINI CALL -----
-    digest_json = generate_daily_digest(user.name, summaries)
-
-    # Store in DB
-    db.add(DailyDigest(
-        user_id=user_id,
-        summary_date=day,
-        digest_text=json.dumps(digest_json),
-    ))
+    return jsonify({"success": True, **stored, "cached": not generated})
 
-    db.commit()
 
-    return jsonify({"success": True, "digest": digest_json})
+# GET /process/digest?date=YYYY-MM-DD — read a stored digest (no LLM call)
+@processing_bp.route("/digest", methods=["GET"])
+@jwt_required()
+def get_digest():
+    db = next(get_db())
+    user_id = get_jwt_identity()
+
+    date_str = request.args.get("date")
+    try:
+        day = datetime.fromisoformat(date_str).date() if date_str else datetime.utcnow().date()
+    except ValueError:
+        return jsonify({"success": False, "error": "date must be YYYY-MM-DD"}), 400
+
+    row = stored_digest(db, user_id, day)
+    if row is None:
+        return jsonify({"success": False, "error": "No digest for this date"}), 404
+
+    _, source_hash = digest_source(db, user_id, day)
+    return jsonify({"success": True, **row.to_dict(), "stale": row.source_hash != source_hash})
 
 
 # ===================================================
-# 5) BATCH CLASSIFY (defaults to simple local classifier)
-# POST /process/batch-classify
+# 5) BATCH CLASSIFY (background job, concurrent + rate-limited)
+# POST /process/batch-classify   -> 202 {job}
+# GET  /process/jobs/<job_id>    -> progress and throughput
 # ===================================================
 @processing_bp.route("/batch-classify", methods=["POST"])
 @jwt_required()
 def batch_classify():
-    db = next(get_db())
     user_id = get_jwt_identity()
 
-    # Only classify 10 at a time for speed
-    emails = (
-        db.query(Email)
-        .filter_by(user_id=user_id, processed=False)
-        .limit(10)
-        .all()
-    )
+    payload = request.get_json(silent=True) or {}
+    limit = payload.get("limit", CLASSIFY_JOB_MAX_EMAILS)
+    try:
+        limit = max(1, min(int(limit), CLASSIFY_JOB_MAX_EMAILS))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "limit must be an integer"}), 400
 
-    count = 0
-    for email in emails:
-        result = categorize_email(
-            subject=email.subject or "",
-            body=email.body_content or "",
-            sender=email.sender_name or "",
-        )
+    job = get_classification_engine().submit(user_id, limit=limit)
 
-        email.category = result.category
-        email.urgency = result.urgency
-        email.risk_flag = result.risk_flag
-        email.summary = result.summary
-        email.processed = True
+    return jsonify({"success": True, "job": job.to_dict()}), 202
 
-        count += 1
 
-    db.commit()
+@processing_bp.route("/jobs/<job_id>", methods=["GET"])
+@jwt_required()
+def classification_job_status(job_id):
+    user_id = get_jwt_identity()
+
+    job = get_classification_engine().get(job_id, user_id=user_id)
+    if not job:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+
+    return jsonify({"success": True, "job": job.to_dict()})
+
+
+# ===================================================
+# 6) LOCAL FAST-PATH CLASSIFIER
+# GET  /process/local-classifier/stats  -> escalation rate, LLM agreement
+# (retraining replaces the model shared by all users, so it runs as a job:
+#  python -m app.llm.local_classifier)
+# ===================================================
+@processing_bp.route("/local-classifier/stats", methods=["GET"])
+@jwt_required()
+def classifier_stats():
+    from app.llm.local_classifier import local_classifier_stats
 
-    return jsonify({"success": True, "processed": count})
+    return jsonify({"success": True, "local_classifier": local_classifier_stats()})
@@ -0,0 +1,26 @@
+"""
+Server-Sent Events helpers shared by the streaming endpoints
+"""
+
+import json
+import time
+
+from flask import Response
+
+
+def sse(event: str, data) -> str:
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def sse_response(events) -> Response:
+    """Stream a generator of SSE messages without proxy buffering."""
+    return Response(
+        events,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
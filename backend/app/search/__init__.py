@@ -0,0 +1,3 @@
+"""
+Retrieval components for Ask-the-Inbox (vector index, lexical search, fusion)
+"""
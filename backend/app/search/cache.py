@@ -0,0 +1,71 @@
+"""
+Ask-the-Inbox caches: normalized query -> embedding, and
+(user, query, inbox version) -> final answer with sources
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from typing import Callable, Optional
+
+from app.cache import TTLCache
+
+
+RAG_EMBED_CACHE_SIZE = int(os.getenv("RAG_EMBED_CACHE_SIZE", "4096"))
+RAG_EMBED_CACHE_TTL = float(os.getenv("RAG_EMBED_CACHE_TTL", "86400"))
+RAG_ANSWER_CACHE_SIZE = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "1024"))
+RAG_ANSWER_CACHE_TTL = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n?!.,;:\"'"
+
+query_embedding_cache = TTLCache(RAG_EMBED_CACHE_SIZE, RAG_EMBED_CACHE_TTL)
+answer_cache = TTLCache(RAG_ANSWER_CACHE_SIZE, RAG_ANSWER_CACHE_TTL)
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and strip edge punctuation."""
+    return _WHITESPACE_RE.sub(" ", (query or "").casefold()).strip(_EDGE_PUNCTUATION)
+
+
+def cached_embedder(embed: Callable[[str], list]) -> Callable[[str], list]:
+    """Wrap an embedding function with the shared query-embedding cache."""
+
+    def embed_query(query: str) -> list:
+        key = normalize_query(query)
+        vector = query_embedding_cache.get(key)
+        if vector is None:
+            vector = embed(query)
+            query_embedding_cache.set(key, vector)
+        return vector
+
+    return embed_query
+
+
+def _answer_key(user_id, query: str, inbox_version: int) -> tuple:
+    return (str(user_id), normalize_query(query), inbox_version)
+
+
+def get_cached_answer(user_id, query: str, inbox_version: int) -> Optional[dict]:
+    return answer_cache.get(_answer_key(user_id, query, inbox_version))
+
+
+def store_answer(user_id, query: str, inbox_version: int, response: dict) -> None:
+    answer_cache.set(_answer_key(user_id, query, inbox_version), response)
+
+
+def invalidate_user(user_id) -> int:
+    """
+    Drop every cached answer for a user. Answers are already keyed on the
+    inbox version, so this only frees memory early after a sync.
+    """
+    user_key = str(user_id)
+    return answer_cache.discard_where(lambda key: key[0] == user_key)
+
+
+def cache_stats() -> dict:
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "answers": answer_cache.stats(),
+    }
@@ -0,0 +1,250 @@
+"""
+Thread-aware, token-bounded chunking of emails for the RAG index
+
+Reply chains quote earlier messages over and over. Chunking each email on
+its own would index the same quoted paragraphs once per reply, inflating
+the index and returning duplicates at retrieval time. ThreadChunker walks a
+conversation oldest-first and skips any paragraph already seen earlier in
+the same ``conversation_id``, then packs what is left into overlapping,
+paragraph-aligned chunks.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import html
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, Optional, Sequence
+
+
+CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "40"))
+
+_BLANK_LINES_RE = re.compile(r"\n\s*\n")
+_QUOTE_PREFIX_RE = re.compile(r"^(?:[ \t]*>)+ ?", re.MULTILINE)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_WHITESPACE_RE = re.compile(r"\s+")
+_QUOTE_HEADER_RE = re.compile(
+    r"^(?:on .{0,200} wrote:|-{2,}\s*original message\s*-{2,}|"
+    r"(?:from|sent|to|cc|subject|date):\s.*)$",
+    re.IGNORECASE,
+)
+
+_HTML_DROP_RE = re.compile(r"<(script|style|head)[^>]*>.*?</\1>", re.IGNORECASE | re.DOTALL)
+_HTML_BREAK_RE = re.compile(r"<\s*(br|/p|/div|/li|/tr|/h[1-6])\b[^>]*>", re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def html_to_text(markup: str) -> str:
+    """Strip tags from an HTML body, keeping block boundaries as newlines."""
+    text = _HTML_DROP_RE.sub("", markup)
+    text = _HTML_BREAK_RE.sub("\n", text)
+    text = _HTML_TAG_RE.sub("", text)
+    text = html.unescape(text).replace("\xa0", " ")
+    return "\n".join(line.rstrip() for line in text.splitlines())
+
+
+def email_text(email) -> str:
+    """Best available plain-text body for an Email row."""
+    if email.body_plain:
+        return email.body_plain
+    if email.body_content:
+        if email.body_html or "<" in email.body_content:
+            return html_to_text(email.body_content)
+        return email.body_content
+    return email.body_preview or ""
+
+
+def _fingerprint(paragraph: str) -> bytes:
+    normalized = _WHITESPACE_RE.sub(" ", paragraph.casefold()).strip()
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+
+
+def split_paragraphs(text: str) -> list[str]:
+    """
+    Split on blank lines, removing ``>`` quote markers and reply headers
+    ("On ... wrote:", "-----Original Message-----", Outlook From/Sent blocks).
+    """
+    text = _QUOTE_PREFIX_RE.sub("", (text or "").replace("\r\n", "\n"))
+    paragraphs = []
+    for block in _BLANK_LINES_RE.split(text):
+        lines = [line for line in block.strip().splitlines() if not _QUOTE_HEADER_RE.match(line.strip())]
+        paragraph = "\n".join(lines).strip()
+        if paragraph:
+            paragraphs.append(paragraph)
+    return paragraphs
+
+
+@dataclass
+class Chunk:
+    email_id: object
+    chunk_index: int
+    text: str
+    tokens: int
+
+
+@dataclass
+class ChunkingStats:
+    messages: int = 0
+    paragraphs: int = 0
+    duplicate_paragraphs: int = 0
+    naive_chunks: int = 0
+    naive_tokens: int = 0
+    chunks: int = 0
+    tokens: int = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "messages": self.messages,
+            "paragraphs": self.paragraphs,
+            "duplicate_paragraphs": self.duplicate_paragraphs,
+            "naive_chunks": self.naive_chunks,
+            "naive_tokens": self.naive_tokens,
+            "chunks": self.chunks,
+            "tokens": self.tokens,
+            "chunk_reduction": round(1 - self.chunks / self.naive_chunks, 4) if self.naive_chunks else 0.0,
+            "token_reduction": round(1 - self.tokens / self.naive_tokens, 4) if self.naive_tokens else 0.0,
+        }
+
+
+@dataclass
+class ThreadChunker:
+    max_tokens: int = CHUNK_TOKENS
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+    stats: ChunkingStats = field(default_factory=ChunkingStats)
+
+    def chunk_thread(
+        self,
+        messages: Sequence[tuple[object, str]],
+        seen: Optional[set] = None,
+        emit: Optional[set] = None,
+    ) -> list[Chunk]:
+        """
+        Chunk one conversation.
+
+        Args:
+            messages: (email_id, text) pairs, oldest first
+            seen: Paragraph fingerprints already indexed for this thread;
+                updated in place
+            emit: If given, only these email_ids produce chunks; the others
+                only contribute to ``seen`` (used when re-indexing a thread
+                that already has indexed messages)
+
+        Returns:
+            Chunks for the emitted messages, with cross-message duplicates removed
+        """
+        seen = set() if seen is None else seen
+        chunks: list[Chunk] = []
+
+        for email_id, text in messages:
+            paragraphs = split_paragraphs(text)
+            fresh = []
+            for paragraph in paragraphs:
+                fingerprint = _fingerprint(paragraph)
+                if fingerprint in seen:
+                    if emit is None or email_id in emit:
+                        self.stats.duplicate_paragraphs += 1
+                    continue
+                seen.add(fingerprint)
+                fresh.append(paragraph)
+
+            if emit is not None and email_id not in emit:
+                continue
+
+            naive = self.pack(paragraphs)
+            packed = self.pack(fresh)
+            self.stats.messages += 1
+            self.stats.paragraphs += len(paragraphs)
+            self.stats.naive_chunks += len(naive)
+            self.stats.naive_tokens += sum(estimate_tokens(c) for c in naive)
+            self.stats.chunks += len(packed)
+
+            for i, chunk_text in enumerate(packed):
+                tokens = estimate_tokens(chunk_text)
+                self.stats.tokens += tokens
+                chunks.append(Chunk(email_id=email_id, chunk_index=i, text=chunk_text, tokens=tokens))
+
+        return chunks
+
+    # ---------- packing ----------
+    def pack(self, paragraphs: Iterable[str]) -> list[str]:
+        """Pack paragraphs into chunks of at most ~max_tokens with overlap."""
+        chunks: list[str] = []
+        current: list[str] = []
+        current_tokens = 0
+        has_new = False
+
+        for paragraph in paragraphs:
+            for piece in self._split_long(paragraph):
+                cost = estimate_tokens(piece)
+                if current and current_tokens + cost > self.max_tokens:
+                    if has_new:
+                        chunks.append("\n\n".join(current))
+                    current = self._overlap_tail(current)
+                    current_tokens = sum(estimate_tokens(p) for p in current)
+                    if current_tokens + cost > self.max_tokens:
+                        current, current_tokens = [], 0
+                    has_new = False
+                current.append(piece)
+                current_tokens += cost
+                has_new = True
+
+        if current and has_new:
+            chunks.append("\n\n".join(current))
+        return chunks
+
+    def _split_long(self, paragraph: str) -> list[str]:
+        if estimate_tokens(paragraph) <= self.max_tokens:
+            return [paragraph]
+
+        pieces, current = [], ""
+        for sentence in _SENTENCE_RE.split(paragraph):
+            for part in self._split_words(sentence):
+                candidate = f"{current} {part}".strip()
+                if current and estimate_tokens(candidate) > self.max_tokens:
+                    pieces.append(current)
+                    current = part
+                else:
+                    current = candidate
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def _split_words(self, sentence: str) -> list[str]:
+        if estimate_tokens(sentence) <= self.max_tokens:
+            return [sentence]
+        parts, current = [], []
+        for word in sentence.split():
+            if current and estimate_tokens(" ".join(current + [word])) > self.max_tokens:
+                parts.append(" ".join(current))
+                current = []
+            current.append(word)
+        if current:
+            parts.append(" ".join(current))
+        return parts
+
+    def _overlap_tail(self, pieces: list[str]) -> list[str]:
+        if self.overlap_tokens <= 0:
+            return []
+        tail, budget = [], self.overlap_tokens
+        for piece in reversed(pieces):
+            cost = estimate_tokens(piece)
+            if cost <= budget:
+                tail.insert(0, piece)
+                budget -= cost
+                continue
+            words = piece.split()
+            kept = []
+            while words and estimate_tokens(" ".join([words[-1]] + kept)) <= budget:
+                kept.insert(0, words.pop())
+            if kept:
+                tail.insert(0, " ".join(kept))
+            break
+        return tail
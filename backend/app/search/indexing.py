@@ -0,0 +1,136 @@
+"""
+RAG indexing: chunk unindexed emails thread-by-thread, embed the chunks and
+store them in ``embeddings`` (and the local vector index, when built)
+"""
+
+from __future__ import annotations
+
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import numpy as np
+from sqlalchemy import or_
+
+from app.models import Email, Embedding, User
+
+from .chunking import ThreadChunker, email_text
+from .vector_index import get_vector_store
+
+
+EMBED_BATCH_SIZE = 64
+
+logger = logging.getLogger(__name__)
+
+
+def index_user_emails(
+    db,
+    user_id,
+    embed_documents: Optional[Callable[[list[str]], list[list[float]]]] = None,
+    limit: int = 500,
+) -> dict:
+    """
+    Chunk and embed up to ``limit`` of the user's unindexed emails.
+
+    Messages are grouped by ``conversation_id`` so quoted text already
+    indexed for an earlier message in the thread is not indexed again.
+
+    Returns:
+        Chunking statistics (including the size reduction versus naive
+        per-email chunking) plus counts of emails and chunks written.
+    """
+    if embed_documents is None:
+        from app.llm.embeddings import embed_documents
+
+    pending = (
+        db.query(Email)
+        .filter(Email.user_id == user_id, Email.indexed_at.is_(None))
+        .order_by(Email.received_at.asc())
+        .limit(limit)
+        .all()
+    )
+    if not pending:
+        return {"emails_indexed": 0, "chunks_written": 0, **ThreadChunker().stats.to_dict()}
+
+    # conversation key -> pending email ids (emails without a conversation stand alone)
+    threads: "OrderedDict[str, set]" = OrderedDict()
+    for email in pending:
+        threads.setdefault(email.conversation_id or str(email.id), set()).add(email.id)
+
+    conversation_ids = [email.conversation_id for email in pending if email.conversation_id]
+    history = {}
+    if conversation_ids:
+        rows = (
+            db.query(Email)
+            .filter(
+                Email.user_id == user_id,
+                Email.conversation_id.in_(set(conversation_ids)),
+                or_(Email.indexed_at.isnot(None), Email.id.in_([e.id for e in pending])),
+            )
+            .order_by(Email.received_at.asc())
+            .all()
+        )
+        for email in rows:
+            history.setdefault(email.conversation_id, []).append(email)
+
+    pending_by_id = {email.id: email for email in pending}
+    chunker = ThreadChunker()
+    chunks = []
+    for key, emit in threads.items():
+        messages = history.get(key) or [pending_by_id[next(iter(emit))]]
+        chunks.extend(chunker.chunk_thread(
+            [(email.id, email_text(email)) for email in messages],
+            emit=emit,
+        ))
+
+    # ---------- embed + store ----------
+    rows = []
+    for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+        batch = chunks[start:start + EMBED_BATCH_SIZE]
+        vectors = embed_documents([chunk.text for chunk in batch])
+        for chunk, vector in zip(batch, vectors):
+            rows.append(Embedding(
+                id=uuid.uuid4(),
+                email_id=chunk.email_id,
+                chunk_text=chunk.text,
+                chunk_index=chunk.chunk_index,
+                embedding={"values": list(vector)},
+            ))
+
+    now = datetime.now(timezone.utc)
+    db.add_all(rows)
+    for email in pending:
+        email.indexed_at = now
+    if rows:
+        # New retrievable content: cached Ask-the-Inbox answers are stale.
+        db.query(User).filter(User.id == user_id).update(
+            {User.inbox_version: User.inbox_version + 1}, synchronize_session=False
+        )
+
+    # Commit and append under the user's build lock, so a concurrent rebuild
+    # runs either before the commit (the append adds the rows to it) or after
+    # the append (it reads them from the database), never both.
+    store = get_vector_store()
+    with store.build_lock(user_id):
+        db.commit()
+        if rows and store.exists(user_id):
+            try:
+                store.append(
+                    user_id,
+                    [row.id for row in rows],
+                    [row.email_id for row in rows],
+                    np.asarray([row.embedding["values"] for row in rows], dtype=np.float32),
+                )
+            except ValueError as e:
+                # Embedding dimension changed (e.g. another embedder): the
+                # resident index can't take these rows, so rebuild on next query.
+                logger.warning("Dropping vector index for %s: %s", user_id, e)
+                store.drop(user_id)
+
+    return {
+        "emails_indexed": len(pending),
+        "chunks_written": len(rows),
+        **chunker.stats.to_dict(),
+    }
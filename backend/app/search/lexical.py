@@ -0,0 +1,145 @@
+"""
+In-process BM25 index over a user's email chunks
+"""
+
+from __future__ import annotations
+
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Optional, Sequence
+
+import numpy as np
+from sqlalchemy import func
+
+from app.models import Email, Embedding
+
+
+LEXICAL_CACHE_USERS = 64
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in is it its me my of on or
+our so that the their them there they this to was we were what when which who
+will with you your
+""".split())
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens with stopwords removed."""
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed set of documents.
+
+    Postings are stored as numpy arrays per term so scoring a query is a few
+    vectorised scatter-adds rather than a loop over documents.
+    """
+
+    def __init__(self, doc_ids: Sequence, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.doc_ids = list(doc_ids)
+        self.k1 = k1
+        self.b = b
+
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        lengths = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[i] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                docs, tfs = postings.setdefault(term, ([], []))
+                docs.append(i)
+                tfs.append(tf)
+
+        self._doc_len = lengths
+        self._avgdl = float(lengths.mean()) if len(lengths) else 0.0
+        self._postings = {
+            term: (np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            for term, (docs, tfs) in postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def search(self, query: str, k: int = 10) -> list[tuple[object, float]]:
+        """
+        Returns:
+            Up to k (doc_id, score) pairs, best first, excluding zero scores.
+        """
+        n = len(self.doc_ids)
+        if not n:
+            return []
+
+        scores = np.zeros(n, dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self._doc_len / (self._avgdl or 1.0))
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            docs, tfs = posting
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return []
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.doc_ids[i], float(scores[i])) for i in hits]
+
+
+# ---------------------------------------------------
+# Per-user index cache
+# ---------------------------------------------------
+_cache: "OrderedDict[str, tuple[tuple, BM25Index]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _chunk_signature(db, user_id) -> tuple:
+    count, latest = (
+        db.query(func.count(Embedding.id), func.max(Embedding.updated_at))
+        .join(Email, Email.id == Embedding.email_id)
+        .filter(Email.user_id == user_id)
+        .one()
+    )
+    return (count, latest)
+
+
+def get_lexical_index(db, user_id) -> Optional[BM25Index]:
+    """
+    Return the user's BM25 index over ``embeddings.chunk_text``, rebuilding
+    it only when their chunk set has changed since it was last built.
+    """
+    key = str(user_id)
+    signature = _chunk_signature(db, user_id)
+    if not signature[0]:
+        return None
+
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == signature:
+            _cache.move_to_end(key)
+            return cached[1]
+
+    rows = (
+        db.query(Embedding.id, Embedding.chunk_text)
+        .join(Email, Email.id == Embedding.email_id)
+        .filter(Email.user_id == user_id)
+        .yield_per(2000)
+    )
+    ids, texts = [], []
+    for row in rows:
+        ids.append(row.id)
+        texts.append(row.chunk_text)
+    index = BM25Index(ids, texts)
+
+    with _cache_lock:
+        _cache[key] = (signature, index)
+        _cache.move_to_end(key)
+        while len(_cache) > LEXICAL_CACHE_USERS:
+            _cache.popitem(last=False)
+    return index
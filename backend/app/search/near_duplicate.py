@@ -0,0 +1,209 @@
+"""
+Near-duplicate email detection with 64-bit SimHash + LSH banding
+
+Course inboxes are full of near-identical messages (the same question from
+ten students, templated LMS notifications). At ingest each email gets a
+SimHash of its normalized subject and body. An email within
+``NEAR_DUPLICATE_MAX_DISTANCE`` bits of an earlier canonical email is
+linked to it via ``emails.duplicate_of_id``, so its classification can be
+copied instead of asking Gemini again.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Optional
+
+from app.cache import TTLCache
+
+
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "6"))
+NEAR_DUPLICATE_INDEX_EMAILS = 20000
+_BANDS = 8                              # 8 x 8 bits: distance <= 7 shares a band
+_BAND_BITS = 64 // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+_MIN_TOKENS = 4                         # too short to call anything a duplicate
+
+_SUBJECT_PREFIX_RE = re.compile(r"^\s*((re|fw|fwd|aw)\s*:\s*)+", re.IGNORECASE)
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+_EMAIL_RE = re.compile(r"\S+@\S+")
+_NUMBER_RE = re.compile(r"\b\d+\b")
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_for_simhash(subject: Optional[str], body: Optional[str]) -> list[str]:
+    """
+    Tokens with reply prefixes, URLs, addresses and standalone numbers
+    neutralised, so templated notifications that differ only in
+    names/dates/links collide. Digits inside words are kept ("hw3" and
+    "hw4" differ), and words in any script count.
+    """
+    subject = _SUBJECT_PREFIX_RE.sub("", subject or "")
+    text = f"{subject}\n{body or ''}".lower()
+    text = _URL_RE.sub(" ", text)
+    text = _EMAIL_RE.sub(" ", text)
+    text = _NUMBER_RE.sub("0", text)
+    return _WORD_RE.findall(text)
+
+
+def simhash64(tokens: list[str]) -> Optional[int]:
+    """Unsigned 64-bit SimHash over word 3-gram shingles (None if too short)."""
+    if len(tokens) < _MIN_TOKENS:
+        return None
+    shingles = [" ".join(tokens[i:i + 3]) for i in range(max(1, len(tokens) - 2))]
+
+    weights = [0] * 64
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    value = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            value |= 1 << bit
+    return value
+
+
+def email_simhash(subject: Optional[str], body: Optional[str]) -> Optional[int]:
+    """Signed SimHash for storage in ``emails.simhash`` (Postgres BIGINT)."""
+    value = simhash64(normalize_for_simhash(subject, body))
+    return None if value is None else to_signed(value)
+
+
+def to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count("1")
+
+
+class NearDuplicateIndex:
+    """
+    Banded LSH over SimHashes: any two hashes within 7 bits share at least
+    one 8-bit band, so only same-band candidates need a Hamming check.
+    """
+
+    def __init__(self, max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE):
+        self.max_distance = min(max_distance, _BANDS - 1)
+        self._buckets: dict[tuple[int, int], list[tuple[object, int]]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bands(value: int):
+        value = to_unsigned(value)
+        for band in range(_BANDS):
+            yield band, (value >> (band * _BAND_BITS)) & _BAND_MASK
+
+    def add(self, email_id, simhash: int) -> None:
+        with self._lock:
+            for key in self._bands(simhash):
+                self._buckets[key].append((email_id, simhash))
+
+    def nearest(self, simhash: int) -> Optional[tuple[object, int]]:
+        """Closest indexed email within max_distance, as (email_id, distance)."""
+        best = None
+        with self._lock:
+            for key in self._bands(simhash):
+                for email_id, other in self._buckets.get(key, ()):
+                    distance = hamming(simhash, other)
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (email_id, distance)
+        return best
+
+
+# Per-user indexes of canonical emails; rebuilt from the DB after the TTL so
+# other workers' ingests are picked up.
+_indexes = TTLCache(max_size=256, ttl=600)
+_build_lock = threading.Lock()
+
+
+def get_user_index(db, user_id) -> NearDuplicateIndex:
+    from app.models import Email
+
+    key = str(user_id)
+    index = _indexes.get(key)
+    if index is not None:
+        return index
+
+    with _build_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            return index
+        index = NearDuplicateIndex()
+        rows = (
+            db.query(Email.id, Email.simhash)
+            .filter(
+                Email.user_id == user_id,
+                Email.simhash.isnot(None),
+                Email.duplicate_of_id.is_(None),
+            )
+            .order_by(Email.received_at.desc())
+            .limit(NEAR_DUPLICATE_INDEX_EMAILS)
+        )
+        for email_id, simhash in rows:
+            index.add(email_id, simhash)
+        _indexes.set(key, index)
+        return index
+
+
+def assign_near_duplicates(db, user_id, emails: list) -> tuple[int, list]:
+    """
+    Compute SimHashes for freshly ingested Email rows (oldest first) and
+    link each near-duplicate to its canonical email.
+
+    Emails must already have ids (flush first). New canonical emails are
+    not added to the shared per-user index here: call index_canonical with
+    the returned entries once the transaction has committed, so a rolled
+    back sync never leaves ids in the index that were not stored.
+
+    Returns:
+        (number of emails marked as near-duplicates, [(email_id, simhash)]
+        of the new canonical emails)
+    """
+    from .chunking import email_text
+
+    index = get_user_index(db, user_id)
+    batch = NearDuplicateIndex(index.max_distance)      # canonicals of this sync
+    canonical = []
+    duplicates = 0
+    for email in sorted(emails, key=lambda e: (e.received_at is None, e.received_at or 0)):
+        email.simhash = email_simhash(email.subject, email_text(email))
+        if email.simhash is None:
+            continue
+        matches = [m for m in (index.nearest(email.simhash), batch.nearest(email.simhash)) if m is not None]
+        if matches:
+            email.duplicate_of_id = min(matches, key=lambda m: m[1])[0]
+            duplicates += 1
+        else:
+            batch.add(email.id, email.simhash)
+            canonical.append((email.id, email.simhash))
+    return duplicates, canonical
+
+
+def index_canonical(user_id, entries: list) -> None:
+    """Add committed canonical emails to the user's cached index, if one is loaded."""
+    index = _indexes.get(str(user_id))
+    if index is None:
+        return      # built from the DB on next use, which includes them
+    for email_id, simhash in entries:
+        index.add(email_id, simhash)
+
+
+def copy_classification(source, target) -> None:
+    """Reuse a canonical email's classification for its near-duplicate."""
+    target.category = source.category
+    target.urgency = source.urgency
+    target.risk_flag = source.risk_flag
+    target.summary = source.summary
+    target.processed = True
+    target.classification_source = "near_duplicate"
@@ -0,0 +1,255 @@
+"""
+Hybrid retrieval for Ask-the-Inbox: BM25 + vector search fused with
+reciprocal-rank fusion, deduplicated per thread and packed to a token budget
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterable, Optional
+
+import numpy as np
+
+from app.db import get_session
+from app.models import Email, Embedding
+
+from .chunking import estimate_tokens
+from .lexical import get_lexical_index
+from .vector_index import build_user_index, get_vector_store
+
+
+logger = logging.getLogger(__name__)
+
+RRF_K = 60
+CANDIDATES_PER_RETRIEVER = 50
+MAX_SEARCH_RESULTS = int(os.getenv("MAX_SEARCH_RESULTS", "10"))
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "3000"))
+CHUNKS_PER_THREAD = 2
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+
+@dataclass
+class RetrievedChunk:
+    embedding_id: object
+    email_id: object
+    conversation_id: Optional[str]
+    subject: Optional[str]
+    sender_name: Optional[str]
+    received_at: Optional[datetime]
+    text: str
+    score: float
+
+    def to_context(self) -> str:
+        """Chunk text with a one-line header, as handed to search_inbox."""
+        date = self.received_at.strftime("%Y-%m-%d") if self.received_at else "unknown date"
+        return f"From: {self.sender_name or 'unknown'} | Subject: {self.subject or '(no subject)'} | {date}\n{self.text}"
+
+    def to_source(self) -> dict:
+        return {
+            "email_id": str(self.email_id),
+            "subject": self.subject,
+            "sender_name": self.sender_name,
+            "received_at": self.received_at.isoformat() if self.received_at else None,
+            "snippet": self.text[:240],
+            "score": round(self.score, 6),
+        }
+
+
+@dataclass
+class RetrievalResult:
+    chunks: list[RetrievedChunk]
+    timings_ms: dict[str, float] = field(default_factory=dict)
+    lexical_hits: int = 0
+    vector_hits: int = 0
+    context_tokens: int = 0
+
+
+# ---------------------------------------------------
+# Helpers
+# ---------------------------------------------------
+@contextmanager
+def _timed(timings: dict, stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 2)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[list], k: int = RRF_K) -> list[tuple[object, float]]:
+    """
+    Fuse several best-first id rankings: score(d) = sum(1 / (k + rank_i(d))).
+
+    Returns:
+        (id, fused_score) pairs, best first.
+    """
+    scores: dict = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def dedupe_per_thread(chunks: list[RetrievedChunk], per_thread: int = CHUNKS_PER_THREAD) -> list[RetrievedChunk]:
+    """
+    Keep at most ``per_thread`` chunks per conversation (or per email when
+    the conversation is unknown) and drop repeated chunk texts.
+    """
+    kept, per_key, seen_texts = [], {}, set()
+    for chunk in chunks:
+        key = chunk.conversation_id or chunk.email_id
+        normalized = " ".join(chunk.text.split()).lower()
+        if per_key.get(key, 0) >= per_thread or normalized in seen_texts:
+            continue
+        per_key[key] = per_key.get(key, 0) + 1
+        seen_texts.add(normalized)
+        kept.append(chunk)
+    return kept
+
+
+def pack_to_budget(chunks: list[RetrievedChunk], budget: int, limit: int) -> tuple[list[RetrievedChunk], int]:
+    """
+    Greedily take chunks in rank order while they fit in ``budget`` tokens.
+
+    Returns:
+        (packed chunks, tokens used)
+    """
+    packed, used = [], 0
+    for chunk in chunks:
+        if len(packed) >= limit:
+            break
+        cost = estimate_tokens(chunk.to_context())
+        if used + cost > budget:
+            continue
+        packed.append(chunk)
+        used += cost
+    return packed, used
+
+
+# ---------------------------------------------------
+# Retrievers (each runs in its own thread with its own session)
+# ---------------------------------------------------
+def _lexical_search(user_id, query: str, k: int) -> list:
+    with get_session() as db:
+        index = get_lexical_index(db, user_id)
+    if index is None:
+        return []
+    return [doc_id for doc_id, _ in index.search(query, k)]
+
+
+def _vector_search(user_id, query_vector: Optional[list], k: int) -> list:
+    if not query_vector:
+        return []
+    store = get_vector_store()
+    if not store.exists(user_id):
+        with get_session() as db:
+            if build_user_index(db, user_id, store, if_missing=True) is None:
+                return []
+    hits = store.search(user_id, np.asarray(query_vector, dtype=np.float32), k)[0]
+    return [hit.embedding_id for hit in hits]
+
+
+def _hydrate(ids_with_scores: list[tuple[object, float]], user_id) -> list[RetrievedChunk]:
+    if not ids_with_scores:
+        return []
+    scores = dict(ids_with_scores)
+    with get_session() as db:
+        rows = (
+            db.query(
+                Embedding.id,
+                Embedding.email_id,
+                Embedding.chunk_text,
+                Email.conversation_id,
+                Email.subject,
+                Email.sender_name,
+                Email.received_at,
+            )
+            .join(Email, Email.id == Embedding.email_id)
+            .filter(Email.user_id == user_id, Embedding.id.in_(list(scores)))
+            .all()
+        )
+    chunks = [
+        RetrievedChunk(
+            embedding_id=row.id,
+            email_id=row.email_id,
+            conversation_id=row.conversation_id,
+            subject=row.subject,
+            sender_name=row.sender_name,
+            received_at=row.received_at,
+            text=row.chunk_text,
+            score=scores[row.id],
+        )
+        for row in rows
+    ]
+    chunks.sort(key=lambda c: c.score, reverse=True)
+    return chunks
+
+
+# ---------------------------------------------------
+# Entry point
+# ---------------------------------------------------
+def retrieve(
+    user_id,
+    query: str,
+    embed_query=None,
+    top_k: int = MAX_SEARCH_RESULTS,
+    token_budget: int = RAG_CONTEXT_TOKENS,
+) -> RetrievalResult:
+    """
+    Run lexical and vector retrieval concurrently and fuse the results.
+
+    Args:
+        user_id: Owner of the inbox to search
+        query: The professor's question
+        embed_query: Callable turning text into a vector; defaults to Gemini embeddings
+        top_k: Maximum number of chunks to return
+        token_budget: Approximate token budget for the packed chunks
+
+    Returns:
+        RetrievalResult with packed chunks and per-stage latency in ms
+    """
+    if embed_query is None:
+        from app.llm.embeddings import embed_query
+
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
+
+    def timed(stage, fn, *args):
+        with _timed(timings, stage):
+            return fn(*args)
+
+    def vector_branch():
+        try:
+            vector = timed("embed", embed_query, query)
+        except Exception as e:
+            logger.warning("Query embedding failed, using lexical results only: %s", e)
+            vector = None
+        return timed("vector", _vector_search, user_id, vector, CANDIDATES_PER_RETRIEVER)
+
+    lexical_future = _executor.submit(timed, "lexical", _lexical_search, user_id, query, CANDIDATES_PER_RETRIEVER)
+    vector_future = _executor.submit(vector_branch)
+    lexical_ids = lexical_future.result()
+    vector_ids = vector_future.result()
+
+    with _timed(timings, "fusion"):
+        fused = reciprocal_rank_fusion([lexical_ids, vector_ids])
+        chunks = dedupe_per_thread(_hydrate(fused[:CANDIDATES_PER_RETRIEVER], user_id))
+
+    with _timed(timings, "pack"):
+        packed, used = pack_to_budget(chunks, token_budget, top_k)
+
+    timings["retrieval_total"] = round((time.perf_counter() - started) * 1000, 2)
+    return RetrievalResult(
+        chunks=packed,
+        timings_ms=timings,
+        lexical_hits=len(lexical_ids),
+        vector_hits=len(vector_ids),
+        context_tokens=used,
+    )
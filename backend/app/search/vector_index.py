@@ -0,0 +1,635 @@
+"""
+Memory-mapped per-user vector index for deployments without pgvector
+
+Each user's chunk embeddings live in one contiguous, L2-normalised float32
+matrix on disk. Cosine top-k is a single matmul plus ``argpartition`` over
+that matrix. New vectors go to an append-only delta log that a background
+thread folds back into the matrix. An LRU keeps hot users' matrices mapped.
+
+On-disk layout per user (``<VECTOR_INDEX_DIR>/<user_id>/``):
+
+    meta.json             {"dim": int, "count": int, "generation": int}
+    vectors.<gen>.f32     (count, dim) float32, row-major
+    keys.<gen>.npy        (count,) [("id", 16 x u1), ("email_id", 16 x u1)]
+    delta.f32             appended float32 rows not yet compacted
+    delta_keys.bin        appended key records matching delta.f32
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import mmap
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Iterable, Iterator, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(os.getcwd(), ".vector_index"))
+VECTOR_INDEX_CACHE_MB = int(os.getenv("VECTOR_INDEX_CACHE_MB", "1024"))
+VECTOR_INDEX_COMPACT_ROWS = int(os.getenv("VECTOR_INDEX_COMPACT_ROWS", "4096"))
+
+KEY_DTYPE = np.dtype([("id", np.uint8, (16,)), ("email_id", np.uint8, (16,))])
+_COPY_BLOCK_ROWS = 65536
+
+
+class VectorHit(NamedTuple):
+    embedding_id: uuid.UUID
+    email_id: uuid.UUID
+    score: float
+
+
+# ---------------------------------------------------
+# Vector helpers
+# ---------------------------------------------------
+def embedding_to_vector(value) -> Optional[list]:
+    """
+    Extract the float list from an ``embeddings.embedding`` JSONB value.
+
+    The column is declared as a dict but writers store either a bare list or
+    ``{"values": [...]}`` (the shape returned by ``genai.embed_content``).
+    """
+    if isinstance(value, dict):
+        value = value.get("values") or value.get("embedding")
+    if not value:
+        return None
+    return value
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalise rows so a dot product is a cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Row-wise top-k of a (queries, rows) score matrix.
+
+    Returns:
+        (indices, scores), each of shape (queries, min(k, rows)), best first.
+    """
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape).copy()
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return (
+        np.take_along_axis(candidates, order, axis=1),
+        np.take_along_axis(candidate_scores, order, axis=1),
+    )
+
+
+def _pack_keys(embedding_ids: Sequence, email_ids: Sequence) -> np.ndarray:
+    keys = np.empty(len(embedding_ids), dtype=KEY_DTYPE)
+    keys["id"] = _uuid_bytes(embedding_ids)
+    keys["email_id"] = _uuid_bytes(email_ids)
+    return keys
+
+
+def _uuid_bytes(values: Sequence) -> np.ndarray:
+    raw = b"".join(_uuid(v).bytes for v in values)
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, 16)
+
+
+def _uuid(value) -> uuid.UUID:
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+# ---------------------------------------------------
+# Single-user index
+# ---------------------------------------------------
+class UserVectorIndex:
+    """
+    One user's vectors: an immutable memory-mapped base matrix plus an
+    append-only delta. Searches and appends are thread-safe; compaction
+    copies outside the lock and only holds it to swap files.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._retired = False
+
+        with open(self._path("meta.json")) as f:
+            meta = json.load(f)
+
+        self.dim = int(meta["dim"])
+        self._open_base(int(meta["count"]), int(meta["generation"]))
+        self._open_delta()
+
+    # ---------- construction ----------
+    @classmethod
+    def create(
+        cls,
+        directory: str,
+        dim: int,
+        count: int,
+        batches: Iterable[tuple[Sequence, Sequence, np.ndarray]],
+    ) -> "UserVectorIndex":
+        """
+        Write a fresh index from (embedding_ids, email_ids, vectors) batches.
+
+        ``count`` is an upper bound used to size the file; rows that are never
+        written are simply not counted.
+        """
+        os.makedirs(directory, exist_ok=True)
+        generation = cls._next_generation(directory)
+        vectors_path = os.path.join(directory, f"vectors.{generation}.f32")
+        keys_path = os.path.join(directory, f"keys.{generation}.npy")
+
+        keys = np.empty(count, dtype=KEY_DTYPE)
+        written = 0
+        matrix = None
+        if count:
+            matrix = np.memmap(vectors_path, dtype=np.float32, mode="w+", shape=(count, dim))
+
+        for embedding_ids, email_ids, vectors in batches:
+            vectors = normalize(vectors)
+            n = min(len(vectors), count - written)
+            if n <= 0:
+                break
+            matrix[written:written + n] = vectors[:n]
+            keys[written:written + n] = _pack_keys(embedding_ids[:n], email_ids[:n])
+            written += n
+
+        if matrix is not None:
+            matrix.flush()
+            del matrix
+        else:
+            open(vectors_path, "wb").close()
+        np.save(keys_path, keys[:written])
+
+        for name in ("delta.f32", "delta_keys.bin"):
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+        cls._write_meta(directory, dim, written, generation)
+        return cls(directory)
+
+    # ---------- queries ----------
+    def __len__(self) -> int:
+        return self._base_count + len(self._delta_keys)
+
+    @property
+    def nbytes(self) -> int:
+        return self._base_count * self.dim * 4 + self._delta_vectors.nbytes
+
+    @property
+    def delta_rows(self) -> int:
+        return len(self._delta_keys)
+
+    def search(self, queries: np.ndarray, k: int = 10) -> list[list[VectorHit]]:
+        """
+        Cosine top-k for one query vector or a (m, dim) batch of them.
+
+        Returns:
+            One best-first list of hits per query.
+        """
+        queries = normalize(np.atleast_2d(queries))
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Query dimension {queries.shape[1]} != index dimension {self.dim}")
+
+        with self._lock:
+            base, base_keys = self._base, self._base_keys
+            delta, delta_keys = self._delta_vectors, self._delta_keys
+
+        scores = queries @ base.T
+        if len(delta):
+            scores = np.concatenate([scores, queries @ delta.T], axis=1)
+
+        indices, best = top_k(scores, k)
+        n_base = len(base)
+
+        results = []
+        for row_idx, row_scores in zip(indices, best):
+            hits = []
+            for i, score in zip(row_idx, row_scores):
+                key = base_keys[i] if i < n_base else delta_keys[i - n_base]
+                hits.append(VectorHit(
+                    uuid.UUID(bytes=key["id"].tobytes()),
+                    uuid.UUID(bytes=key["email_id"].tobytes()),
+                    float(score),
+                ))
+            results.append(hits)
+        return results
+
+    # ---------- updates ----------
+    def append(self, embedding_ids: Sequence, email_ids: Sequence, vectors: np.ndarray) -> int:
+        """
+        Append vectors to the delta log. Returns the number of pending delta rows.
+        """
+        vectors = normalize(np.atleast_2d(vectors))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Vector dimension {vectors.shape[1]} != index dimension {self.dim}")
+        keys = _pack_keys(embedding_ids, email_ids)
+
+        with self._lock:
+            with open(self._path("delta.f32"), "ab") as f:
+                vectors.tofile(f)
+            with open(self._path("delta_keys.bin"), "ab") as f:
+                keys.tofile(f)
+
+            self._delta_vectors = np.concatenate([self._delta_vectors, vectors])
+            self._delta_keys = np.concatenate([self._delta_keys, keys])
+            return len(self._delta_keys)
+
+    def compact(self) -> None:
+        """
+        Fold the delta log into a new base generation.
+
+        The copy runs without the lock (the current base is immutable); rows
+        appended while copying stay in the delta for the next compaction.
+        """
+        with self._lock:
+            if self._retired or self._compacting or not len(self._delta_keys):
+                return
+            self._compacting = True
+            base, base_keys = self._base, self._base_keys
+            delta, delta_keys = self._delta_vectors, self._delta_keys
+            old_generation = self._generation
+
+        try:
+            generation = self._next_generation(self.directory)
+            total = len(base) + len(delta)
+            matrix = np.memmap(
+                self._path(f"vectors.{generation}.f32"),
+                dtype=np.float32, mode="w+", shape=(total, self.dim),
+            )
+            for start in range(0, len(base), _COPY_BLOCK_ROWS):
+                end = min(start + _COPY_BLOCK_ROWS, len(base))
+                matrix[start:end] = base[start:end]
+            matrix[len(base):] = delta
+            matrix.flush()
+            del matrix
+            np.save(self._path(f"keys.{generation}.npy"), np.concatenate([base_keys, delta_keys]))
+
+            with self._lock:
+                remaining_vectors = self._delta_vectors[len(delta):]
+                remaining_keys = self._delta_keys[len(delta):]
+                with open(self._path("delta.f32.tmp"), "wb") as f:
+                    remaining_vectors.tofile(f)
+                with open(self._path("delta_keys.bin.tmp"), "wb") as f:
+                    remaining_keys.tofile(f)
+
+                self._write_meta(self.directory, self.dim, total, generation)
+                os.replace(self._path("delta.f32.tmp"), self._path("delta.f32"))
+                os.replace(self._path("delta_keys.bin.tmp"), self._path("delta_keys.bin"))
+
+                self._open_base(total, generation)
+                self._delta_vectors = remaining_vectors
+                self._delta_keys = remaining_keys
+
+            # Open memmaps of the old generation stay valid after unlink on POSIX.
+            self._remove_generation(old_generation)
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def retire(self) -> None:
+        """
+        Mark this index as replaced by a rebuild. Its directory now belongs to
+        the new index, so it must never compact again; searches still work
+        on the old mapped files.
+        """
+        with self._lock:
+            self._retired = True
+
+    def prefetch(self) -> None:
+        """Ask the kernel to page the base matrix in ahead of the first search."""
+        raw = getattr(self._base, "_mmap", None)
+        if raw is not None and hasattr(mmap, "MADV_WILLNEED"):
+            try:
+                raw.madvise(mmap.MADV_WILLNEED)
+            except (OSError, ValueError):
+                pass
+
+    # ---------- internals ----------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open_base(self, count: int, generation: int) -> None:
+        self._generation = generation
+        self._base_count = count
+        if count:
+            self._base = np.memmap(
+                self._path(f"vectors.{generation}.f32"),
+                dtype=np.float32, mode="r", shape=(count, self.dim),
+            )
+            self._base_keys = np.load(self._path(f"keys.{generation}.npy"), mmap_mode="r")
+        else:
+            self._base = np.empty((0, self.dim), dtype=np.float32)
+            self._base_keys = np.empty(0, dtype=KEY_DTYPE)
+
+    def _open_delta(self) -> None:
+        vectors_path, keys_path = self._path("delta.f32"), self._path("delta_keys.bin")
+        vectors = np.fromfile(vectors_path, dtype=np.float32) if os.path.exists(vectors_path) else np.empty(0, np.float32)
+        keys = np.fromfile(keys_path, dtype=KEY_DTYPE) if os.path.exists(keys_path) else np.empty(0, KEY_DTYPE)
+
+        # A crash between the two appends leaves one file ahead; trust the shorter.
+        rows = min(len(vectors) // self.dim, len(keys))
+        self._delta_vectors = vectors[: rows * self.dim].reshape(rows, self.dim)
+        self._delta_keys = keys[:rows]
+
+    def _remove_generation(self, generation: int) -> None:
+        for name in (f"vectors.{generation}.f32", f"keys.{generation}.npy"):
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _next_generation(directory: str) -> int:
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return 0
+        with open(meta_path) as f:
+            return int(json.load(f)["generation"]) + 1
+
+    @staticmethod
+    def _write_meta(directory: str, dim: int, count: int, generation: int) -> None:
+        tmp = os.path.join(directory, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"dim": dim, "count": count, "generation": generation}, f)
+        os.replace(tmp, os.path.join(directory, "meta.json"))
+
+
+# ---------------------------------------------------
+# LRU of open user indexes + background compaction
+# ---------------------------------------------------
+class VectorIndexStore:
+    """
+    Opens user indexes on demand and keeps the most recently used ones
+    mapped, bounded by ``max_resident_bytes``.
+    """
+
+    def __init__(
+        self,
+        root: str = VECTOR_INDEX_DIR,
+        max_resident_bytes: int = VECTOR_INDEX_CACHE_MB * 1024 * 1024,
+        compact_rows: int = VECTOR_INDEX_COMPACT_ROWS,
+    ):
+        self.root = root
+        self.max_resident_bytes = max_resident_bytes
+        self.compact_rows = compact_rows
+        self._indexes: "OrderedDict[str, UserVectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: dict[str, threading.RLock] = {}
+        self._compact_queue: "queue.Queue[str]" = queue.Queue()
+        self._pending_compactions: set[str] = set()
+        self._compactor: Optional[threading.Thread] = None
+
+    def _user_dir(self, user_id) -> str:
+        return os.path.join(self.root, str(user_id))
+
+    @contextlib.contextmanager
+    def build_lock(self, user_id) -> Iterator[None]:
+        """
+        Serialise builds, appends and compaction of one user's index, so a
+        rebuild never races another writer on the same directory.
+        """
+        key = str(user_id)
+        with self._lock:
+            lock = self._build_locks.setdefault(key, threading.RLock())
+        with lock:
+            yield
+
+    def exists(self, user_id) -> bool:
+        return os.path.exists(os.path.join(self._user_dir(user_id), "meta.json"))
+
+    def get(self, user_id) -> Optional[UserVectorIndex]:
+        """Return the user's index (opening it if needed), or None if never built."""
+        key = str(user_id)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+
+        if not self.exists(key):
+            return None
+
+        index = UserVectorIndex(self._user_dir(key))
+        index.prefetch()
+        with self._lock:
+            index = self._indexes.setdefault(key, index)
+            self._indexes.move_to_end(key)
+            self._enforce_budget()
+        return index
+
+    def build(
+        self,
+        user_id,
+        dim: int,
+        count: int,
+        batches: Iterable[tuple[Sequence, Sequence, np.ndarray]],
+    ) -> UserVectorIndex:
+        """(Re)build a user's index from scratch and make it resident."""
+        key = str(user_id)
+        directory = self._user_dir(key)
+        with self.build_lock(key):
+            os.makedirs(self.root, exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(prefix=f"{key}.building.", dir=self.root)
+            try:
+                UserVectorIndex.create(tmp_dir, dim, count, batches)
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+
+            old_dir = tempfile.mkdtemp(prefix=f"{key}.old.", dir=self.root)
+            with self._lock:
+                old = self._indexes.pop(key, None)
+                if old is not None:
+                    old.retire()
+                if os.path.exists(directory):
+                    os.replace(directory, os.path.join(old_dir, "index"))
+                os.replace(tmp_dir, directory)
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+            return self.get(key)
+
+    def append(self, user_id, embedding_ids: Sequence, email_ids: Sequence, vectors: np.ndarray) -> bool:
+        """
+        Append vectors to an existing index. Returns False if the user has no
+        index yet (callers should build one instead).
+        """
+        with self.build_lock(user_id):
+            index = self.get(user_id)
+            if index is None:
+                return False
+            pending = index.append(embedding_ids, email_ids, vectors)
+        if pending >= self.compact_rows:
+            self.schedule_compaction(user_id)
+        return True
+
+    def search(self, user_id, queries: np.ndarray, k: int = 10) -> list[list[VectorHit]]:
+        index = self.get(user_id)
+        if index is None:
+            return [[] for _ in np.atleast_2d(queries)]
+        return index.search(queries, k)
+
+    def drop(self, user_id) -> None:
+        """Delete a user's index; the next query rebuilds it from the database."""
+        key = str(user_id)
+        with self.build_lock(key):
+            with self._lock:
+                old = self._indexes.pop(key, None)
+                if old is not None:
+                    old.retire()
+            shutil.rmtree(self._user_dir(key), ignore_errors=True)
+
+    def evict(self, user_id) -> None:
+        with self._lock:
+            self._indexes.pop(str(user_id), None)
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(index.nbytes for index in self._indexes.values())
+
+    def _enforce_budget(self) -> None:
+        # Caller holds self._lock. Always keep the most recent index.
+        total = sum(index.nbytes for index in self._indexes.values())
+        while total > self.max_resident_bytes and len(self._indexes) > 1:
+            _, evicted = self._indexes.popitem(last=False)
+            total -= evicted.nbytes
+
+    # ---------- background compaction ----------
+    def schedule_compaction(self, user_id) -> None:
+        key = str(user_id)
+        with self._lock:
+            if key in self._pending_compactions:
+                return
+            self._pending_compactions.add(key)
+            if self._compactor is None or not self._compactor.is_alive():
+                self._compactor = threading.Thread(
+                    target=self._compact_loop, name="vector-index-compactor", daemon=True
+                )
+                self._compactor.start()
+        self._compact_queue.put(key)
+
+    def wait_for_compactions(self) -> None:
+        self._compact_queue.join()
+
+    def _compact_loop(self) -> None:
+        while True:
+            key = self._compact_queue.get()
+            try:
+                with self._lock:
+                    self._pending_compactions.discard(key)
+                with self.build_lock(key):
+                    index = self.get(key)
+                    if index is not None:
+                        index.compact()
+            except Exception:
+                logger.exception("Vector index compaction failed for %s", key)
+            finally:
+                self._compact_queue.task_done()
+
+
+_store: Optional[VectorIndexStore] = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorIndexStore:
+    """Process-wide index store, created on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VectorIndexStore()
+    return _store
+
+
+# ---------------------------------------------------
+# Building from the embeddings table
+# ---------------------------------------------------
+def build_user_index(
+    db, user_id, store: Optional[VectorIndexStore] = None, batch_size: int = 2048, if_missing: bool = False,
+):
+    """
+    Rebuild a user's index from their rows in ``embeddings``.
+
+    Rows are streamed with ``yield_per`` so memory stays bounded by one batch.
+    With ``if_missing``, an index built by a concurrent caller while this
+    one waited for the user's build lock is returned instead of rebuilt.
+
+    Returns:
+        The new UserVectorIndex, or None if the user has no embeddings.
+    """
+    store = store or get_vector_store()
+    with store.build_lock(user_id):
+        if if_missing and store.exists(user_id):
+            return store.get(user_id)
+        return _build_user_index(db, user_id, store, batch_size)
+
+
+def _build_user_index(db, user_id, store: VectorIndexStore, batch_size: int):
+    from sqlalchemy import func
+
+    from app.models import Email, Embedding
+
+    base_query = (
+        db.query(Embedding.id, Embedding.email_id, Embedding.embedding)
+        .join(Email, Email.id == Embedding.email_id)
+        .filter(Email.user_id == user_id)
+    )
+    count = (
+        db.query(func.count(Embedding.id))
+        .join(Email, Email.id == Embedding.email_id)
+        .filter(Email.user_id == user_id)
+        .scalar()
+    )
+    if not count:
+        return None
+
+    sample = next(
+        (v for (v,) in db.query(Embedding.embedding)
+            .join(Email, Email.id == Embedding.email_id)
+            .filter(Email.user_id == user_id)
+            .limit(50)
+            if embedding_to_vector(v)),
+        None,
+    )
+    if sample is None:
+        return None
+    dim = len(embedding_to_vector(sample))
+
+    def batches():
+        ids, email_ids, vectors = [], [], []
+        stream = base_query.order_by(Embedding.id).yield_per(batch_size)
+        for row in stream:
+            vector = embedding_to_vector(row.embedding)
+            if not vector or len(vector) != dim:
+                continue
+            ids.append(row.id)
+            email_ids.append(row.email_id)
+            vectors.append(vector)
+            if len(ids) >= batch_size:
+                yield ids, email_ids, np.asarray(vectors, dtype=np.float32)
+                ids, email_ids, vectors = [], [], []
+        if ids:
+            yield ids, email_ids, np.asarray(vectors, dtype=np.float32)
+
+    return store.build(user_id, dim, count, batches())
@@ -0,0 +1,109 @@
+"""
+Single-flight request coalescing
+
+Concurrent callers that ask for the same key share one execution: the
+first caller (the leader) runs the function, later callers that arrive
+while it is still running wait for it and receive the same result, or the
+same exception. Nothing is cached once the call finishes; a request that
+arrives afterwards runs again.
+
+Used for the handlers whose work is an upstream call that would otherwise
+be repeated by double-clicks and client retries: /process/classify and
+/process/draft (keyed by user, workflow, email and a hash of the model
+input) and /emails/sync (keyed by user).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Hashable
+
+
+def input_hash(*parts: Any) -> str:
+    """Stable short hash of the values a call's result depends on."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class _Call:
+    __slots__ = ("done", "value", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: BaseException | None = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "followers": 0, "errors": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """
+        Run ``fn`` once for all concurrent callers with the same ``key``.
+
+        Returns:
+            (value, shared) — ``shared`` is True for callers that received
+            another caller's result
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self._stats["followers"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        calls = stats["leaders"] + stats["followers"]
+        stats["shared_rate"] = round(stats["followers"] / calls, 3) if calls else 0.0
+        return stats
+
+
+_groups: dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name: str) -> SingleFlight:
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight(name)
+        return group
+
+
+def singleflight_stats() -> dict:
+    with _groups_lock:
+        groups = dict(_groups)
+    return {name: group.stats() for name, group in sorted(groups.items())}
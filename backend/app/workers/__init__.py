@@ -0,0 +1,3 @@
+"""
+Background workers for Professor Inbox Copilot (rate limiting, batch jobs)
+"""
@@ -0,0 +1,310 @@
+"""
+Concurrent, rate-limited classification of a user's unprocessed emails
+
+A job classifies up to ``limit`` emails with bounded concurrency, packing
+short emails several to a prompt (see app/llm/categorize_batch.py). Every
+Gemini call goes through the LLM work queue (batches with unread mail as
+"urgent", the rest as "backlog"), and results are
+committed in chunks so progress survives a crash part-way through; each
+committed chunk is handed to the draft prefetcher (drafts.py). Job
+state is held in this process, so clients must poll the worker that
+started the job.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Optional
+
+from app.db import get_session
+from app.models import Email
+from app.search.chunking import email_text
+from app.search.near_duplicate import copy_classification
+
+from .llm_queue import BACKLOG, URGENT, llm_priority
+
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+CLASSIFY_COMMIT_CHUNK = int(os.getenv("CLASSIFY_COMMIT_CHUNK", "100"))
+CLASSIFY_JOB_MAX_EMAILS = 5000
+_JOB_HISTORY = 200
+
+RISK_TONES = ("frustrated",)
+
+
+# ---------------------------------------------------
+# Mapping between Email rows and categorize_email
+# ---------------------------------------------------
+def classification_input(email) -> str:
+    """Subject, sender and plain-text body formatted for categorize_email."""
+    return (
+        f"Subject: {email.subject or '(no subject)'}\n"
+        f"From: {email.sender_name or email.sender_email or 'unknown'}\n\n"
+        f"{email_text(email)}"
+    )
+
+
+def apply_classification(email, result: dict, source: str = "llm") -> None:
+    """Copy a categorize_email result onto an Email row and mark it processed."""
+    try:
+        priority = int(round(float(result.get("priority_score", 5))))
+    except (TypeError, ValueError):
+        priority = 5
+    priority = max(1, min(10, priority))
+    category = result.get("category") or "other"
+
+    email.category = category
+    email.urgency = priority
+    email.risk_flag = priority >= 9 or category == "complaint" or result.get("tone") in RISK_TONES
+    email.summary = result.get("summary")
+    email.processed = True
+    email.classification_source = source
+
+
+# ---------------------------------------------------
+# Jobs
+# ---------------------------------------------------
+@dataclass
+class ClassificationJob:
+    id: str
+    user_id: str
+    limit: int
+    status: str = "queued"          # queued | running | completed | failed
+    total: int = 0
+    processed: int = 0
+    failed: int = 0
+    reused: int = 0                 # near-duplicates copied, no LLM call
+    degraded: int = 0               # LLM unavailable; left unprocessed for retry
+    local: int = 0                  # answered by the local fast-path model
+    escalated: int = 0              # local model unsure, sent to Gemini
+    llm_requests: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def to_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        done = self.processed + self.failed + self.degraded
+        throughput = done / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - done, 0)
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "failed": self.failed,
+            "degraded": self.degraded,
+            "reused": self.reused,
+            "dedup_rate": round(self.reused / done, 4) if done else 0.0,
+            "local": self.local,
+            "escalated": self.escalated,
+            "escalation_rate": round(self.escalated / (self.local + self.escalated), 4)
+            if self.local + self.escalated else 0.0,
+            "remaining": remaining,
+            "llm_requests": self.llm_requests,
+            "requests_per_email": round(self.llm_requests / done, 3) if done else None,
+            "elapsed_seconds": round(elapsed, 2),
+            "throughput_per_second": round(throughput, 3),
+            "eta_seconds": round(remaining / throughput, 1) if throughput and self.active else None,
+            "error": self.error,
+        }
+
+
+class ClassificationEngine:
+    """
+    Runs classification jobs: one coordinator thread per job, LLM calls on a
+    shared bounded pool, all calls admitted by the LLM work queue.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = LLM_CONCURRENCY,
+        commit_chunk: int = CLASSIFY_COMMIT_CHUNK,
+    ):
+        self.commit_chunk = commit_chunk
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="classify")
+        self._jobs: "OrderedDict[str, ClassificationJob]" = OrderedDict()
+        self._active_by_user: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, user_id, limit: int = CLASSIFY_JOB_MAX_EMAILS) -> ClassificationJob:
+        """
+        Start a job for the user, or return their already-running one.
+        """
+        user_key = str(user_id)
+        with self._lock:
+            existing = self._jobs.get(self._active_by_user.get(user_key, ""))
+            if existing is not None and existing.active:
+                return existing
+
+            job = ClassificationJob(id=uuid.uuid4().hex, user_id=user_key, limit=limit)
+            self._jobs[job.id] = job
+            self._active_by_user[user_key] = job.id
+            while len(self._jobs) > _JOB_HISTORY:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest.active:
+                    break
+                self._jobs.pop(oldest_id)
+
+        threading.Thread(target=self._run, args=(job,), name=f"classify-job-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id: str, user_id=None) -> Optional[ClassificationJob]:
+        job = self._jobs.get(job_id)
+        if job is None or (user_id is not None and job.user_id != str(user_id)):
+            return None
+        return job
+
+    # ---------- execution ----------
+    def _classify_batch(self, job: ClassificationJob, batch: list[tuple[str, str]], priority: str) -> dict:
+        from app.llm.categorize_batch import categorize_emails_batch
+
+        with llm_priority(priority, job.user_id):
+            return categorize_emails_batch(batch)
+
+    def _run(self, job: ClassificationJob) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            with get_session() as db:
+                ids = [
+                    email_id for (email_id,) in db.query(Email.id)
+                    .filter(Email.user_id == job.user_id, Email.processed == False)  # noqa: E712
+                    .order_by(Email.received_at.desc())
+                    .limit(job.limit)
+                ]
+            job.total = len(ids)
+
+            for start in range(0, len(ids), self.commit_chunk):
+                self._run_chunk(job, ids[start:start + self.commit_chunk])
+
+            job.status = "completed"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def _run_chunk(self, job: ClassificationJob, ids: list) -> None:
+        # ORM rows stay on this thread; workers only see prompt text.
+        with get_session() as db:
+            emails = {str(email.id): email for email in db.query(Email).filter(Email.id.in_(ids))}
+
+            # Near-duplicates of an already classified email (or of one in
+            # this chunk) copy its result instead of costing a Gemini call.
+            canonical_ids = {e.duplicate_of_id for e in emails.values() if e.duplicate_of_id}
+            canonicals = {
+                email.id: email
+                for email in db.query(Email).filter(Email.id.in_(canonical_ids))
+            } if canonical_ids else {}
+            reuse = {
+                key for key, email in emails.items()
+                if email.duplicate_of_id in canonicals
+                and (canonicals[email.duplicate_of_id].processed or str(email.duplicate_of_id) in emails)
+            }
+
+            decisions: dict = {}
+            pending = self._fast_path(job, emails, [key for key in emails if key not in reuse], decisions)
+            self._classify(job, emails, pending, decisions)
+
+            leftovers = []
+            for key in reuse:
+                email = emails[key]
+                canonical = canonicals[email.duplicate_of_id]
+                if canonical.processed:
+                    copy_classification(canonical, email)
+                    job.reused += 1
+                    job.processed += 1
+                else:
+                    leftovers.append((key, classification_input(email)))
+            if leftovers:
+                self._classify(job, emails, leftovers)
+
+        # Committed: pre-generate drafts for the ones likely to need a reply
+        from .drafts import get_draft_prefetcher
+
+        get_draft_prefetcher().schedule(job.user_id, emails.values())
+
+    def _fast_path(self, job: ClassificationJob, emails: dict, keys: list, decisions: dict) -> list:
+        """
+        Apply confident local-model predictions; return the (key, text)
+        items that still need Gemini (escalated or shadow-sampled). Their
+        local decisions go into ``decisions`` for agreement tracking.
+        """
+        from app.llm.local_classifier import triage
+
+        pending = []
+        for key in keys:
+            text = classification_input(emails[key])
+            decision = triage(text)
+            if decision.use_local:
+                apply_classification(emails[key], decision.prediction.to_result(), source="local")
+                job.local += 1
+                job.processed += 1
+                continue
+            if decision.prediction is not None:
+                job.escalated += decision.escalate
+                decisions[key] = decision
+            pending.append((key, text))
+        return pending
+
+    def _classify(self, job: ClassificationJob, emails: dict, items: list, decisions: Optional[dict] = None) -> None:
+        from app.llm.categorize_batch import plan_batches
+        from app.llm.local_classifier import record_llm_result
+
+        batches = plan_batches(items)
+        futures = {
+            self._pool.submit(
+                self._classify_batch, job, batch,
+                URGENT if any(not emails[key].is_read for key, _ in batch) else BACKLOG,
+            ): batch
+            for batch in batches
+        }
+
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                outcome = future.result()
+            except Exception:
+                job.failed += len(batch)
+                continue
+            job.llm_requests += outcome["requests"]
+            for email_id, _ in batch:
+                try:
+                    result = outcome["results"][email_id]
+                    if result.get("degraded"):
+                        # Placeholder, not a classification: keep the email
+                        # unprocessed so the next job retries it.
+                        job.degraded += 1
+                        continue
+                    apply_classification(emails[email_id], result)
+                    if decisions and email_id in decisions:
+                        record_llm_result(decisions[email_id], result)
+                    job.processed += 1
+                except Exception:
+                    job.failed += 1
+
+
+_engine: Optional[ClassificationEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_classification_engine() -> ClassificationEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = ClassificationEngine()
+    return _engine
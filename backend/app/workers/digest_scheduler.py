@@ -0,0 +1,202 @@
+"""
+Off-peak digest precomputation
+
+Professors ask for their digest first thing in the morning, mostly at the
+same time. This scheduler builds each user's digest during the
+DIGEST_PRECOMPUTE_WINDOW_MINUTES before DIGEST_MORNING_HOUR in the user's
+own timezone (Preference.timezone, else DIGEST_DEFAULT_TIMEZONE). Each
+user gets a fixed offset inside that window, derived from their id, so the
+LLM load is spread out instead of landing on the hour. The morning POST
+/process/digest then finds a stored, current digest and makes no LLM call
+(app/workers/digests.py).
+
+Builds run on a pool of DIGEST_SCHEDULER_WORKERS threads in the "digest"
+class of the LLM work queue. That is the lowest priority, and it cannot
+touch the slots and rate-limit tokens reserved for interactive calls.
+
+Run it as its own process:
+
+    python -m app.workers.digest_scheduler
+
+or inside the API process with DIGEST_SCHEDULER_ENABLED=true (only one
+process should run it).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from app.db import get_session
+from app.models import Email, Preference, User
+
+from .digests import day_bounds, ensure_daily_digest
+from .llm_queue import DIGEST, llm_priority
+
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SCHEDULER_ENABLED = os.getenv("DIGEST_SCHEDULER_ENABLED", "false").lower() in ("1", "true", "yes")
+DIGEST_MORNING_HOUR = int(os.getenv("DIGEST_MORNING_HOUR", "7"))
+DIGEST_PRECOMPUTE_WINDOW_MINUTES = int(os.getenv("DIGEST_PRECOMPUTE_WINDOW_MINUTES", "120"))
+DIGEST_DEFAULT_TIMEZONE = os.getenv("DIGEST_DEFAULT_TIMEZONE", "UTC")
+DIGEST_SCHEDULER_WORKERS = int(os.getenv("DIGEST_SCHEDULER_WORKERS", "4"))
+DIGEST_SCHEDULER_INTERVAL_SECONDS = float(os.getenv("DIGEST_SCHEDULER_INTERVAL_SECONDS", "60"))
+
+
+def _zone(name: Optional[str]) -> ZoneInfo:
+    for candidate in (name, DIGEST_DEFAULT_TIMEZONE, "UTC"):
+        if not candidate:
+            continue
+        try:
+            return ZoneInfo(candidate)
+        except (ZoneInfoNotFoundError, ValueError):
+            continue
+    return ZoneInfo("UTC")
+
+
+def next_run(user_id, zone: ZoneInfo, now: datetime) -> tuple[datetime, datetime]:
+    """
+    When to precompute ``user_id``'s next digest: (run_at, morning), both
+    aware datetimes. ``morning`` is the upcoming DIGEST_MORNING_HOUR local
+    time; ``run_at`` falls at the user's fixed offset in the window before it.
+    """
+    local = now.astimezone(zone)
+    morning = local.replace(hour=DIGEST_MORNING_HOUR, minute=0, second=0, microsecond=0)
+    if morning <= local:
+        morning += timedelta(days=1)
+    window = max(DIGEST_PRECOMPUTE_WINDOW_MINUTES, 1) * 60
+    offset = int(hashlib.sha256(str(user_id).encode("utf-8")).hexdigest()[:8], 16) % window
+    return morning - timedelta(seconds=window - offset), morning
+
+
+def target_day(morning: datetime) -> date:
+    """The day a POST /process/digest without a date asks for at ``morning``."""
+    return morning.astimezone(timezone.utc).date()
+
+
+class DigestScheduler:
+    def __init__(self, max_workers: int = DIGEST_SCHEDULER_WORKERS):
+        self.max_workers = max(max_workers, 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="digest-precompute")
+        self._done: dict[str, date] = {}         # user_id -> last day precomputed or in flight
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"ticks": 0, "scheduled": 0, "generated": 0, "current": 0, "empty": 0, "failed": 0}
+        self._last_tick: Optional[str] = None
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    # ---------- scheduling ----------
+    def tick(self, now: Optional[datetime] = None) -> int:
+        """Submit every user whose precompute time has come; returns how many."""
+        now = now or datetime.now(timezone.utc)
+        with get_session() as db:
+            users = (
+                db.query(User.id, Preference.timezone)
+                .outerjoin(Preference, Preference.user_id == User.id)
+                .all()
+            )
+        submitted = 0
+        for user_id, zone_name in users:
+            run_at, morning = next_run(user_id, _zone(zone_name), now)
+            if now < run_at:
+                continue
+            day, key = target_day(morning), str(user_id)
+            with self._lock:
+                if self._done.get(key) == day:
+                    continue
+                self._done[key] = day
+                self._stats["scheduled"] += 1
+            self._pool.submit(self._precompute, user_id, day)
+            submitted += 1
+        with self._lock:
+            self._stats["ticks"] += 1
+            self._last_tick = now.isoformat()
+        return submitted
+
+    def _precompute(self, user_id, day: date) -> None:
+        try:
+            with get_session() as db:
+                start, end = day_bounds(day)
+                has_mail = db.query(Email.id).filter(
+                    Email.user_id == user_id, Email.received_at >= start, Email.received_at < end,
+                ).first() is not None
+                if not has_mail:
+                    self._count("empty")
+                    return
+                user = db.query(User).filter_by(id=user_id).first()
+                with llm_priority(DIGEST, str(user_id)):
+                    _, generated = ensure_daily_digest(db, user, day)
+                self._count("generated" if generated else "current")
+        except Exception:
+            self._count("failed")
+            with self._lock:
+                self._done.pop(str(user_id), None)      # retried on the next tick
+            logger.exception("Digest precompute failed for user %s", user_id)
+
+    # ---------- loop ----------
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run_forever, name="digest-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run_forever(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Digest scheduler tick failed")
+            self._stop.wait(DIGEST_SCHEDULER_INTERVAL_SECONDS)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            last_tick = self._last_tick
+        return {
+            **stats,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "last_tick": last_tick,
+            "morning_hour": DIGEST_MORNING_HOUR,
+            "window_minutes": DIGEST_PRECOMPUTE_WINDOW_MINUTES,
+            "workers": self.max_workers,
+        }
+
+
+_scheduler: Optional[DigestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_digest_scheduler() -> DigestScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = DigestScheduler()
+    return _scheduler
+
+
+def main():
+    # Importing the app package has loaded .env already
+    print(
+        f"Precomputing digests before {DIGEST_MORNING_HOUR}:00 local time "
+        f"({DIGEST_PRECOMPUTE_WINDOW_MINUTES} min window, {DIGEST_SCHEDULER_WORKERS} workers)"
+    )
+    get_digest_scheduler().run_forever()
+
+
+if __name__ == "__main__":
+    main()
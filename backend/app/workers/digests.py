@@ -0,0 +1,357 @@
+"""
+Daily digests: SQL statistics, ranked items, map-reduce on busy days
+
+The numbers in a digest (emails per category, priority distribution,
+total) come from one grouped SQL aggregation over the day's emails, never
+from the model. The model writes the narrative only, and sees the exact
+totals plus a ranked top DIGEST_TOP_K of the day's emails: the most urgent
+(up to half of k, urgency >= DIGEST_URGENT_THRESHOLD), then the highest
+ranked email of each category in turn, so every category is represented.
+Prompt size no longer grows with email volume.
+
+With DIGEST_TOP_K=0 every email goes to the model. A quiet day then goes
+to daily_digest in one prompt; past DIGEST_SINGLE_PASS_MAX emails the
+digest is built in two levels:
+
+- map: emails are grouped by category, with each thread's messages kept
+  together, and cut into chunks of at most DIGEST_CHUNK_SIZE; every chunk
+  is summarized (summarize_digest_chunk) on a bounded pool, in parallel.
+  Chunk results go through the LLM cache, so an unchanged chunk is free
+  the next time the digest is built.
+- reduce: daily_digest runs once over the chunk summaries, most urgent
+  groups first.
+
+Rows are streamed with ``yield_per`` in (category, thread) order, and a
+chunk is handed to the pool as soon as it is full, so only one partial
+chunk of compact per-email lines is held in memory at a time.
+
+Digests are stored once per (user, day) together with what they were built
+from: the day's email ids, the inbox version, and a hash of the ids with
+their classifications. ensure_daily_digest recomputes that hash (one light
+column query) and regenerates only when it differs, so repeat requests and
+days whose mail hasn't changed cost no LLM call.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import and_, case, func
+from sqlalchemy.exc import IntegrityError
+
+from app.models import DailyDigest, Email
+from app.singleflight import get_group
+
+from .llm_queue import current_priority, llm_priority
+
+
+DIGEST_SINGLE_PASS_MAX = int(os.getenv("DIGEST_SINGLE_PASS_MAX", "60"))
+DIGEST_CHUNK_SIZE = int(os.getenv("DIGEST_CHUNK_SIZE", "40"))
+DIGEST_MAP_CONCURRENCY = int(os.getenv("DIGEST_MAP_CONCURRENCY", "4"))
+DIGEST_TOP_K = int(os.getenv("DIGEST_TOP_K", "40"))
+DIGEST_URGENT_THRESHOLD = int(os.getenv("DIGEST_URGENT_THRESHOLD", "8"))
+DIGEST_STREAM_BATCH = 500
+_DIGEST_FORMAT = 2          # bump when build_daily_digest's output changes shape
+
+_pool = ThreadPoolExecutor(max_workers=max(DIGEST_MAP_CONCURRENCY, 1), thread_name_prefix="digest-map")
+_flight = get_group("digest")
+
+
+def day_bounds(day: date) -> tuple[datetime, datetime]:
+    """[start, end) of ``day`` in UTC."""
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+_DIGEST_COLUMNS = (
+    Email.subject, Email.sender_name, Email.category, Email.urgency,
+    Email.summary, Email.body_preview, Email.conversation_id, Email.received_at,
+)
+
+
+def _digest_line(row) -> str:
+    return json.dumps({
+        "subject": row.subject,
+        "sender": row.sender_name,
+        "category": row.category,
+        "urgency": row.urgency,
+        "summary": row.summary or row.body_preview,
+    })
+
+
+class _Chunk:
+    __slots__ = ("category", "lines", "max_urgency")
+
+    def __init__(self, category: str):
+        self.category = category
+        self.lines: list[str] = []
+        self.max_urgency = 0
+
+
+def _summarize_chunk(chunk: _Chunk, priority: tuple) -> dict:
+    from app.llm.daily_digest import summarize_digest_chunk
+
+    # Pool threads don't inherit the caller's context
+    with llm_priority(*priority):
+        return summarize_digest_chunk(chunk.category, chunk.lines)
+
+
+# ---------------------------------------------------
+# Statistics and item selection (SQL)
+# ---------------------------------------------------
+def _priority_bucket():
+    return case(
+        (Email.urgency.is_(None), "unclassified"),
+        (Email.urgency <= 3, "low"),
+        (Email.urgency <= 6, "medium"),
+        else_="high",
+    )
+
+
+def digest_statistics(db, user_id, day: date) -> dict:
+    """Counts per category and per priority bucket, in one grouped query."""
+    start, end = day_bounds(day)
+    bucket = _priority_bucket()
+    rows = (
+        db.query(Email.category, bucket, func.count())
+        .filter(Email.user_id == user_id, Email.received_at >= start, Email.received_at < end)
+        .group_by(Email.category, bucket)
+        .all()
+    )
+    categories: dict[str, int] = {}
+    distribution = {"low": 0, "medium": 0, "high": 0}
+    for category, priority, count in rows:
+        category = category or "uncategorized"
+        categories[category] = categories.get(category, 0) + count
+        distribution[priority] = distribution.get(priority, 0) + count
+    return {
+        "total_emails": sum(categories.values()),
+        "categories": dict(sorted(categories.items(), key=lambda item: -item[1])),
+        "priority_distribution": distribution,
+    }
+
+
+def _format_totals(stats: dict) -> str:
+    categories = ", ".join(f"{name} {count}" for name, count in stats["categories"].items())
+    priorities = ", ".join(f"{name} {count}" for name, count in stats["priority_distribution"].items())
+    return f"{stats['total_emails']} emails\nBy category: {categories}\nBy priority: {priorities}"
+
+
+def _day_rows(db, user_id, day: date):
+    start, end = day_bounds(day)
+    return (
+        db.query(*_DIGEST_COLUMNS)
+        .filter(Email.user_id == user_id, Email.received_at >= start, Email.received_at < end)
+        .order_by(Email.category, Email.conversation_id, Email.received_at)
+        .execution_options(yield_per=DIGEST_STREAM_BATCH)
+    )
+
+
+def ranked_items(db, user_id, day: date, k: int) -> list:
+    """
+    The day's top ``k`` emails, most important first: up to k/2 of the most
+    urgent, then each category's best remaining email in turn.
+    """
+    start, end = day_bounds(day)
+    importance = (Email.urgency.desc().nulls_last(), Email.received_at.desc())
+    ranked = (
+        db.query(
+            *_DIGEST_COLUMNS,
+            func.row_number().over(partition_by=Email.category, order_by=importance).label("category_rank"),
+            func.row_number().over(order_by=importance).label("urgency_rank"),
+        )
+        .filter(Email.user_id == user_id, Email.received_at >= start, Email.received_at < end)
+        .subquery()
+    )
+    urgent = and_(ranked.c.urgency >= DIGEST_URGENT_THRESHOLD, ranked.c.urgency_rank <= k // 2)
+    return (
+        db.query(ranked)
+        .order_by(
+            case((urgent, 0), else_=1),
+            case((urgent, ranked.c.urgency_rank), else_=ranked.c.category_rank),
+            ranked.c.urgency_rank,
+        )
+        .limit(k)
+        .all()
+    )
+
+
+# ---------------------------------------------------
+# Building a digest
+# ---------------------------------------------------
+def build_daily_digest(db, user_id, day: date) -> dict:
+    """
+    The digest for ``user_id``'s emails received on ``day`` (UTC).
+
+    Returns:
+        daily_digest's narrative merged with the SQL statistics
+        ("total_emails", "categories", "statistics"), plus "items" (emails
+        sent to the model) and, for hierarchical digests, "chunks"
+    """
+    from app.llm.daily_digest import daily_digest
+
+    stats = digest_statistics(db, user_id, day)
+    totals = _format_totals(stats)
+
+    if DIGEST_TOP_K > 0:
+        rows = ranked_items(db, user_id, day, DIGEST_TOP_K)
+        if len(rows) <= DIGEST_SINGLE_PASS_MAX:
+            digest = {**daily_digest([_digest_line(row) for row in rows], totals), "items": len(rows)}
+        else:
+            rows.sort(key=lambda row: (row.category or "", row.conversation_id or "", row.received_at))
+            digest = _map_reduce(rows, totals)
+    else:
+        digest = _map_reduce(_day_rows(db, user_id, day), totals)
+
+    return {
+        **digest,
+        "total_emails": stats["total_emails"],
+        "categories": stats["categories"],
+        "statistics": {
+            "total_emails": stats["total_emails"],
+            "priority_distribution": stats["priority_distribution"],
+        },
+    }
+
+
+def _map_reduce(rows, totals: str) -> dict:
+    """Digest of ``rows`` (in category, thread order); map-reduce past DIGEST_SINGLE_PASS_MAX."""
+    from app.llm.daily_digest import daily_digest
+
+    priority = current_priority()
+    buffered: list[_Chunk] = []         # held back until the day is known to be busy
+    futures: list[tuple[_Chunk, Future]] = []
+    chunk: Optional[_Chunk] = None
+    total = 0
+
+    def flush(done: _Chunk) -> None:
+        if futures or total > DIGEST_SINGLE_PASS_MAX:
+            for pending in buffered + [done]:
+                futures.append((pending, _pool.submit(_summarize_chunk, pending, priority)))
+            buffered.clear()
+        else:
+            buffered.append(done)
+
+    for row in rows:
+        total += 1
+        category = row.category or "uncategorized"
+        if chunk is None or chunk.category != category or (
+            len(chunk.lines) >= DIGEST_CHUNK_SIZE
+        ):
+            if chunk is not None:
+                flush(chunk)
+            chunk = _Chunk(category)
+        chunk.lines.append(_digest_line(row))
+        chunk.max_urgency = max(chunk.max_urgency, row.urgency or 0)
+    if chunk is not None:
+        flush(chunk)
+
+    if not futures:
+        # Quiet day: one pass over the emails themselves
+        lines = [line for pending in buffered for line in pending.lines]
+        return {**daily_digest(lines, totals), "items": total}
+
+    # ----- reduce -----
+    futures.sort(key=lambda entry: entry[0].max_urgency, reverse=True)
+    group_inputs, degraded = [], 0
+    for pending, future in futures:
+        result = future.result()
+        degraded += bool(result.get("degraded"))
+        parts = [f"[{pending.category}: {len(pending.lines)} emails, max urgency {pending.max_urgency}]",
+                 result.get("summary") or ""]
+        if result.get("high_priority"):
+            parts.append("Urgent: " + "; ".join(result["high_priority"]))
+        if result.get("common_themes"):
+            parts.append("Themes: " + "; ".join(result["common_themes"]))
+        group_inputs.append(" ".join(part for part in parts if part))
+
+    digest = daily_digest(group_inputs, totals)
+    digest = {**digest, "items": total, "chunks": len(futures)}
+    if degraded:
+        digest["degraded_chunks"] = degraded
+    return digest
+
+
+# ---------------------------------------------------
+# Stored digests
+# ---------------------------------------------------
+def digest_source(db, user_id, day: date) -> tuple[list[str], str]:
+    """The day's email ids and a hash of them with their classifications."""
+    start, end = day_bounds(day)
+    rows = (
+        db.query(Email.id, Email.category, Email.urgency, Email.summary)
+        .filter(Email.user_id == user_id, Email.received_at >= start, Email.received_at < end)
+        .order_by(Email.id)
+        .execution_options(yield_per=DIGEST_STREAM_BATCH)
+    )
+    digest = hashlib.sha256(str(_DIGEST_FORMAT).encode("utf-8"))
+    email_ids = []
+    for row in rows:
+        email_ids.append(str(row.id))
+        digest.update(json.dumps([str(row.id), row.category, row.urgency, row.summary]).encode("utf-8"))
+    return email_ids, digest.hexdigest()
+
+
+def ensure_daily_digest(db, user, day: date, force: bool = False) -> tuple[dict, bool]:
+    """
+    The user's stored digest for ``day``, regenerated first if the day's
+    emails or their classifications changed since it was built (or
+    ``force``). Concurrent requests for the same day share one build.
+
+    Returns:
+        (DailyDigest.to_dict(), whether it was generated by this call)
+    """
+    key = (str(user.id), "daily_digest", day.isoformat(), force)
+    (payload, generated), shared = _flight.do(key, lambda: _ensure(db, user, day, force))
+    return payload, generated and not shared
+
+
+def _ensure(db, user, day: date, force: bool) -> tuple[dict, bool]:
+    row = db.query(DailyDigest).filter_by(user_id=user.id, summary_date=day).first()
+    email_ids, source_hash = digest_source(db, user.id, day)
+    if row is not None and row.source_hash == source_hash and not force:
+        return row.to_dict(), False
+
+    inbox_version = user.inbox_version
+    digest = build_daily_digest(db, user.id, day)
+    if digest.get("degraded"):
+        # Not stored: the next request tries again
+        return {
+            "date": day.isoformat(),
+            "digest": digest,
+            "email_count": len(email_ids),
+            "inbox_version": inbox_version,
+            "generated_at": None,
+        }, True
+
+    values = {
+        "digest_text": json.dumps(digest),
+        "email_ids": email_ids,
+        "inbox_version": inbox_version,
+        "source_hash": source_hash,
+    }
+    if row is None:
+        row = DailyDigest(user_id=user.id, summary_date=day, **values)
+        try:
+            with db.begin_nested():
+                db.add(row)
+        except IntegrityError:
+            # Built concurrently by another worker; store ours over it
+            row = db.query(DailyDigest).filter_by(user_id=user.id, summary_date=day).one()
+            for name, value in values.items():
+                setattr(row, name, value)
+    else:
+        for name, value in values.items():
+            setattr(row, name, value)
+    db.commit()
+    db.refresh(row)     # server-side timestamps
+    return row.to_dict(), True
+
+
+def stored_digest(db, user_id, day: date) -> Optional[DailyDigest]:
+    return db.query(DailyDigest).filter_by(user_id=user_id, summary_date=day).first()
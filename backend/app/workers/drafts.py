@@ -0,0 +1,300 @@
+"""
+Speculative draft pre-generation
+
+Once an email is classified, the ones a professor is most likely to answer
+(urgency >= DRAFT_PREFETCH_MIN_URGENCY, or a reply-worthy category) get a
+draft generated in the background, so /process/draft and GET /emails/<id>
+return it without waiting on the model. Each user may spend at most
+DRAFT_PREFETCH_BUDGET drafts per DRAFT_PREFETCH_WINDOW_SECONDS, and the
+calls run in the "backlog" class of the LLM work queue, behind anything a
+professor is waiting on.
+
+Every generated draft is stored with a fingerprint of the inputs it was
+written from (email, category, earlier thread messages, professor context).
+A stored draft is served only while its fingerprint still matches; in
+addition, drafts are cleared when a new message arrives in the thread
+(invalidate_threads, called by /emails/sync) or the professor's
+preferences change (listeners below).
+
+Concurrent on-demand requests for the same draft share one in-flight call
+(app/singleflight.py). They never join a speculative call, though: that
+one is queued in the backlog class, and a professor opening the email
+would wait behind the whole backlog. Coalescing is keyed by priority
+class, so an on-demand request starts its own interactive call.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+from sqlalchemy import event, inspect as sa_inspect, update
+
+from app.db import get_session
+from app.models import Email, Preference, User
+from app.singleflight import get_group, input_hash
+
+from .classification import classification_input
+from .llm_queue import BACKLOG, current_priority, llm_priority
+from .rate_limit import TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+DRAFT_PREFETCH_ENABLED = os.getenv("DRAFT_PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+DRAFT_PREFETCH_MIN_URGENCY = int(os.getenv("DRAFT_PREFETCH_MIN_URGENCY", "7"))
+DRAFT_PREFETCH_CATEGORIES = frozenset(
+    name.strip() for name in os.getenv(
+        "DRAFT_PREFETCH_CATEGORIES",
+        "academic_question,appointment_request,clarification,personal_matter",
+    ).split(",") if name.strip()
+)
+DRAFT_PREFETCH_BUDGET = float(os.getenv("DRAFT_PREFETCH_BUDGET", "20"))
+DRAFT_PREFETCH_WINDOW_SECONDS = float(os.getenv("DRAFT_PREFETCH_WINDOW_SECONDS", "3600"))
+DRAFT_PREFETCH_WORKERS = int(os.getenv("DRAFT_PREFETCH_WORKERS", "2"))
+_USER_PREFERENCE_FIELDS = ("tone_preference", "reply_length_preference", "course_policies", "signature")
+_PREFERENCE_FIELDS = ("tone", "reply_length", "course_policies", "signature")
+
+_draft_flight = get_group("draft")
+
+
+# ---------------------------------------------------
+# Reply inputs and their fingerprint
+# ---------------------------------------------------
+def reply_inputs(db, email, user) -> dict:
+    """generate_reply keyword arguments for an email."""
+    from app.llm.prompt_prefix import ProfessorContext
+
+    earlier = (
+        db.query(Email)
+        .filter(
+            Email.user_id == email.user_id,
+            Email.conversation_id == email.conversation_id,
+            Email.received_at < email.received_at,
+        )
+        .order_by(Email.received_at.desc())
+        .limit(5)
+        .all()
+    ) if email.conversation_id and email.received_at else []
+    thread = "\n".join(
+        f"- {e.sender_name or e.sender_email}: {e.summary or e.body_preview or ''}"
+        for e in reversed(earlier)
+    )
+
+    return {
+        "email_text": classification_input(email),
+        "category": email.category or "other",
+        "thread_summary": thread or "No previous messages",
+        "professor": ProfessorContext.from_user(user),
+    }
+
+
+def draft_fingerprint(inputs: dict) -> str:
+    return input_hash(
+        inputs["email_text"], inputs["category"], inputs["thread_summary"], inputs["professor"].fingerprint,
+    )
+
+
+def stored_draft(email, fingerprint: str) -> Optional[str]:
+    """The email's saved draft if it was written from the current inputs."""
+    if email.draft_reply and email.draft_fingerprint == fingerprint:
+        return email.draft_reply
+    return None
+
+
+def generate_draft(db, email, inputs: dict, fingerprint: str, user_id) -> tuple[dict, int]:
+    """
+    Generate and save a draft, sharing the call with any concurrent request
+    for the same inputs in the same LLM priority class. Returns the
+    /process/draft response body and status.
+    """
+    priority, _ = current_priority()
+    key = (str(user_id), "generate_reply", str(email.id), fingerprint, priority)
+    (body, status), shared = _draft_flight.do(key, lambda: _generate(db, email, inputs, fingerprint))
+    if shared:
+        body = {**body, "coalesced": True}
+    return body, status
+
+
+def _generate(db, email, inputs: dict, fingerprint: str) -> tuple[dict, int]:
+    from app.llm.generate_reply import generate_reply
+
+    reply = generate_reply(**inputs)
+
+    if reply.get("degraded"):
+        return {
+            "success": False,
+            "degraded": True,
+            "error": "Draft generation is temporarily unavailable",
+            "reason": reply.get("degraded_reason"),
+        }, 503
+
+    email.draft_reply = reply.get("draft")
+    email.draft_fingerprint = fingerprint
+    db.commit()
+
+    return {"success": True, "draft": reply}, 200
+
+
+def wants_draft(email) -> bool:
+    """Whether a classified email is worth drafting a reply for speculatively."""
+    if not email.processed or email.draft_reply:
+        return False
+    return (email.urgency or 0) >= DRAFT_PREFETCH_MIN_URGENCY or email.category in DRAFT_PREFETCH_CATEGORIES
+
+
+# ---------------------------------------------------
+# Background pre-generation
+# ---------------------------------------------------
+class DraftPrefetcher:
+    def __init__(
+        self,
+        max_workers: int = DRAFT_PREFETCH_WORKERS,
+        budget: float = DRAFT_PREFETCH_BUDGET,
+        window_seconds: float = DRAFT_PREFETCH_WINDOW_SECONDS,
+    ):
+        self.budget = budget
+        self.window_seconds = window_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="draft-prefetch")
+        self._budgets: dict[str, TokenBucket] = {}
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        self._stats = {
+            "scheduled": 0, "generated": 0, "over_budget": 0, "skipped": 0,
+            "degraded": 0, "failed": 0, "served": 0, "invalidated": 0,
+        }
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += n
+
+    def _budget(self, user_id: str) -> TokenBucket:
+        bucket = self._budgets.get(user_id)
+        if bucket is None:
+            bucket = self._budgets.setdefault(
+                user_id, TokenBucket(self.budget / self.window_seconds, self.budget),
+            )
+        return bucket
+
+    def schedule(self, user_id, emails: Iterable) -> int:
+        """
+        Queue drafts for those of ``emails`` (classified Email rows) that
+        want one, within the user's budget. Returns how many were queued.
+        """
+        if not DRAFT_PREFETCH_ENABLED:
+            return 0
+        user_key = str(user_id)
+        queued = 0
+        # Most urgent first, so the budget goes to the emails that matter
+        for email in sorted(emails, key=lambda e: e.urgency or 0, reverse=True):
+            if not wants_draft(email):
+                continue
+            email_key = str(email.id)
+            with self._lock:
+                if email_key in self._pending:
+                    continue
+                if not self._budget(user_key).try_acquire(1.0):
+                    self._stats["over_budget"] += 1
+                    continue
+                self._pending.add(email_key)
+                self._stats["scheduled"] += 1
+            self._pool.submit(self._run, email.user_id, email.id)
+            queued += 1
+        return queued
+
+    def _run(self, user_id, email_id) -> None:
+        try:
+            with get_session() as db:
+                email = db.query(Email).filter_by(id=email_id, user_id=user_id).first()
+                user = db.query(User).filter_by(id=user_id).first()
+                if email is None or user is None or not wants_draft(email):
+                    self._count("skipped")
+                    return
+                inputs = reply_inputs(db, email, user)
+                with llm_priority(BACKLOG, str(user_id)):
+                    _, status = generate_draft(db, email, inputs, draft_fingerprint(inputs), user_id)
+                self._count("generated" if status == 200 else "degraded")
+        except Exception:
+            self._count("failed")
+            logger.exception("Draft prefetch failed for email %s", email_id)
+        finally:
+            with self._lock:
+                self._pending.discard(str(email_id))
+
+    def record_served(self) -> None:
+        """A stored draft answered a request without a model call."""
+        self._count("served")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        return {
+            **stats,
+            "enabled": DRAFT_PREFETCH_ENABLED,
+            "min_urgency": DRAFT_PREFETCH_MIN_URGENCY,
+            "categories": sorted(DRAFT_PREFETCH_CATEGORIES),
+            "budget": self.budget,
+            "window_seconds": self.window_seconds,
+        }
+
+
+_prefetcher: Optional[DraftPrefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_draft_prefetcher() -> DraftPrefetcher:
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = DraftPrefetcher()
+    return _prefetcher
+
+
+# ---------------------------------------------------
+# Invalidation
+# ---------------------------------------------------
+def _clear_drafts(connection, *criteria) -> int:
+    result = connection.execute(
+        update(Email.__table__)
+        .where(Email.__table__.c.draft_fingerprint.isnot(None), *criteria)
+        .values(draft_reply=None, draft_fingerprint=None)
+    )
+    if result.rowcount:
+        get_draft_prefetcher()._count("invalidated", result.rowcount)
+    return result.rowcount
+
+
+def invalidate_threads(db, user_id, conversation_ids: Iterable[str]) -> int:
+    """Clear generated drafts in threads that just received new messages."""
+    conversation_ids = {c for c in conversation_ids if c}
+    if not conversation_ids:
+        return 0
+    table = Email.__table__
+    return _clear_drafts(
+        db.connection(), table.c.user_id == user_id, table.c.conversation_id.in_(conversation_ids),
+    )
+
+
+@event.listens_for(Preference, "after_insert")
+@event.listens_for(Preference, "after_delete")
+def _preference_changed(mapper, connection, target) -> None:
+    _clear_drafts(connection, Email.__table__.c.user_id == target.user_id)
+
+
+@event.listens_for(Preference, "after_update")
+def _preference_updated(mapper, connection, target) -> None:
+    state = sa_inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in _PREFERENCE_FIELDS):
+        _clear_drafts(connection, Email.__table__.c.user_id == target.user_id)
+
+
+@event.listens_for(User, "after_update")
+def _user_changed(mapper, connection, target) -> None:
+    state = sa_inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in _USER_PREFERENCE_FIELDS):
+        _clear_drafts(connection, Email.__table__.c.user_id == target.id)
@@ -0,0 +1,227 @@
+"""
+Priority-aware admission queue for outbound LLM calls
+
+Every generate_content call takes a slot here before reaching a provider,
+so interactive requests and background jobs share one view of the quota:
+
+- priority classes, strictly ordered: interactive > urgent (unread mail)
+  > backlog > digest precompute
+- within a class, start-time fair queuing across users: each user's calls
+  are tagged with a virtual start time, so a user with a 5000-email
+  backlog cannot starve another user's 10 emails
+- reserved capacity: background classes may use neither the last
+  LLM_QUEUE_RESERVED_SLOTS concurrent slots nor the last
+  LLM_QUEUE_RESERVED_TOKENS rate-limit tokens, so an interactive call
+  never waits behind a saturated backlog
+
+Callers don't run work on the queue's threads; they wait for admission on
+their own thread, make the call, and release the slot. The class and user
+come from ``llm_priority()`` (a context variable); calls made without one
+are treated as interactive. Interactive callers give up at their call
+deadline; background callers wait up to LLM_QUEUE_BACKGROUND_TIMEOUT.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from .rate_limit import TokenBucket, gemini_limiter
+
+
+INTERACTIVE = "interactive"
+URGENT = "urgent"
+BACKLOG = "backlog"
+DIGEST = "digest"
+PRIORITIES = (INTERACTIVE, URGENT, BACKLOG, DIGEST)
+
+LLM_QUEUE_CONCURRENCY = int(os.getenv("LLM_QUEUE_CONCURRENCY", "16"))
+LLM_QUEUE_RESERVED_SLOTS = int(os.getenv("LLM_QUEUE_RESERVED_SLOTS", "4"))
+LLM_QUEUE_RESERVED_TOKENS = float(os.getenv("LLM_QUEUE_RESERVED_TOKENS", "3"))
+LLM_QUEUE_BACKGROUND_TIMEOUT = float(os.getenv("LLM_QUEUE_BACKGROUND_TIMEOUT", "600"))
+_RECENT_WAITS = 500
+_MAX_IDLE_WAIT = 0.5        # re-check period; releases and admissions also notify
+
+_context: contextvars.ContextVar = contextvars.ContextVar("llm_priority", default=(INTERACTIVE, None))
+
+
+@contextlib.contextmanager
+def llm_priority(priority: str, user_id=None) -> Iterator[None]:
+    """Run the enclosed LLM calls in ``priority`` on behalf of ``user_id``."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority: {priority!r}")
+    token = _context.set((priority, str(user_id) if user_id is not None else None))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def current_priority() -> tuple[str, Optional[str]]:
+    return _context.get()
+
+
+class QueueTimeout(TimeoutError):
+    """No slot was granted before the caller's deadline."""
+
+
+@dataclass
+class _Ticket:
+    priority: str
+    user: Optional[str]
+    tag: float
+    cancelled: bool = False
+
+
+class LLMWorkQueue:
+    def __init__(
+        self,
+        concurrency: int = LLM_QUEUE_CONCURRENCY,
+        reserved_slots: int = LLM_QUEUE_RESERVED_SLOTS,
+        reserved_tokens: float = LLM_QUEUE_RESERVED_TOKENS,
+        limiter: Optional[TokenBucket] = gemini_limiter,
+    ):
+        self.concurrency = max(concurrency, 1)
+        self.reserved_slots = min(max(reserved_slots, 0), self.concurrency - 1)
+        self.limiter = limiter
+        # Background must be able to take a token at all
+        self.reserved_tokens = min(reserved_tokens, limiter.capacity - 1) if limiter else 0.0
+        self._cond = threading.Condition()
+        self._waiting: dict[str, list] = {p: [] for p in PRIORITIES}
+        self._vtime: dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        self._last_tag: dict[tuple, float] = {}
+        self._seq = itertools.count()
+        self._running = {p: 0 for p in PRIORITIES}
+        self._stats = {p: {"admitted": 0, "timeouts": 0} for p in PRIORITIES}
+        self._waits = {p: deque(maxlen=_RECENT_WAITS) for p in PRIORITIES}
+
+    # ---------- scheduling ----------
+    def _enqueue(self, priority: str, user: Optional[str], cost: float, weight: float) -> _Ticket:
+        key = (priority, user)
+        start = max(self._vtime[priority], self._last_tag.get(key, 0.0))
+        self._last_tag[key] = start + cost / weight
+        ticket = _Ticket(priority, user, start)
+        heapq.heappush(self._waiting[priority], (start, next(self._seq), ticket))
+        return ticket
+
+    def _head(self) -> Optional[_Ticket]:
+        for priority in PRIORITIES:
+            heap = self._waiting[priority]
+            while heap and heap[0][2].cancelled:
+                heapq.heappop(heap)
+            if heap:
+                return heap[0][2]
+        return None
+
+    def _try_admit(self, ticket: _Ticket) -> Optional[float]:
+        """Admit ``ticket`` if it is next and capacity allows; else seconds to wait."""
+        if self._head() is not ticket:
+            return _MAX_IDLE_WAIT
+        interactive = ticket.priority == INTERACTIVE
+        running = sum(self._running.values())
+        limit = self.concurrency if interactive else self.concurrency - self.reserved_slots
+        if running >= limit:
+            return _MAX_IDLE_WAIT
+        if self.limiter is not None:
+            reserve = 0.0 if interactive else self.reserved_tokens
+            if not self.limiter.try_acquire(1.0, reserve=reserve):
+                return min(self.limiter.wait_time(1.0, reserve=reserve), _MAX_IDLE_WAIT)
+
+        heapq.heappop(self._waiting[ticket.priority])
+        self._vtime[ticket.priority] = ticket.tag
+        self._running[ticket.priority] += 1
+        self._stats[ticket.priority]["admitted"] += 1
+        if len(self._last_tag) > 10000:
+            self._last_tag = {k: t for k, t in self._last_tag.items() if t > self._vtime[k[0]]}
+        return None
+
+    @contextlib.contextmanager
+    def slot(
+        self,
+        priority: Optional[str] = None,
+        user_id=None,
+        timeout: Optional[float] = None,
+        cost: float = 1.0,
+        weight: float = 1.0,
+    ) -> Iterator[None]:
+        """
+        Hold one LLM call slot for the enclosed block.
+
+        Priority and user default to the current ``llm_priority()`` context.
+
+        Raises:
+            QueueTimeout: not admitted within ``timeout`` seconds
+        """
+        if priority is None:
+            priority, context_user = current_priority()
+            user_id = user_id if user_id is not None else context_user
+        user = str(user_id) if user_id is not None else None
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+
+        with self._cond:
+            ticket = self._enqueue(priority, user, cost, weight)
+            while True:
+                wait = self._try_admit(ticket)
+                if wait is None:
+                    break
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        ticket.cancelled = True
+                        self._stats[priority]["timeouts"] += 1
+                        self._cond.notify_all()
+                        raise QueueTimeout(f"no {priority} LLM slot within {timeout:.1f}s")
+                    wait = min(wait, remaining)
+                self._cond.wait(wait)
+            self._waits[priority].append(time.monotonic() - started)
+            # The next head may be admissible too
+            self._cond.notify_all()
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running[priority] -= 1
+                self._cond.notify_all()
+
+    # ---------- introspection ----------
+    def stats(self) -> dict:
+        with self._cond:
+            classes = {}
+            for priority in PRIORITIES:
+                waits = sorted(self._waits[priority])
+                classes[priority] = {
+                    **self._stats[priority],
+                    "running": self._running[priority],
+                    "waiting": sum(not entry[2].cancelled for entry in self._waiting[priority]),
+                    "wait_ms_p50": round(waits[len(waits) // 2] * 1000, 1) if waits else None,
+                    "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else None,
+                }
+        return {
+            "concurrency": self.concurrency,
+            "reserved_slots": self.reserved_slots,
+            "reserved_tokens": self.reserved_tokens,
+            "classes": classes,
+        }
+
+
+_queue: Optional[LLMWorkQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_llm_queue() -> LLMWorkQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = LLMWorkQueue()
+    return _queue
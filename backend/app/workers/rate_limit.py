@@ -0,0 +1,79 @@
+"""
+Token-bucket rate limiting for outbound LLM calls
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+
+GEMINI_RATE_LIMIT_PER_MINUTE = float(os.getenv("GEMINI_RATE_LIMIT_PER_MINUTE", "60"))
+GEMINI_RATE_LIMIT_BURST = float(os.getenv("GEMINI_RATE_LIMIT_BURST", "10"))
+
+
+class TokenBucket:
+    """
+    Classic token bucket: ``rate`` tokens per second refill up to ``capacity``.
+    ``acquire`` blocks until enough tokens are available. Thread-safe.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0, reserve: float = 0.0) -> bool:
+        """
+        Take ``tokens`` without blocking, leaving at least ``reserve``
+        tokens in the bucket (headroom held back for higher-priority work).
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens - tokens >= reserve:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens: float = 1.0, reserve: float = 0.0) -> float:
+        """Seconds until ``try_acquire(tokens, reserve)`` could succeed."""
+        with self._lock:
+            self._refill()
+            missing = tokens + reserve - self._tokens
+        return max(missing, 0.0) / self.rate
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """
+        Block until ``tokens`` are available.
+
+        Returns:
+            True once acquired, False if ``timeout`` seconds elapsed first.
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+# Shared by every Gemini call made from this process
+gemini_limiter = TokenBucket(GEMINI_RATE_LIMIT_PER_MINUTE / 60.0, GEMINI_RATE_LIMIT_BURST)
@@ -0,0 +1,173 @@
+"""
+Rolling thread summaries
+
+One ThreadSummary row per (user, conversation_id) holds a summary of the
+thread up to the newest message folded into it. When a message needs its
+thread as context, the stored summary is brought up to date by folding in
+only the messages that arrived since (update_thread_summary: previous
+summary + one message), so the cost per new message stays flat however
+long the thread grows. A full summarize_thread pass runs only for a
+thread's first summary, or when more than THREAD_SUMMARY_MAX_FOLDS
+messages are missing.
+
+A stored summary can only serve messages newer than everything it covers;
+an older message (re-classified with "force") gets no thread context.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from app.models import Email, ThreadSummary
+from app.singleflight import get_group
+
+from .classification import classification_input
+
+
+THREAD_SUMMARY_MAX_FOLDS = int(os.getenv("THREAD_SUMMARY_MAX_FOLDS", "5"))
+THREAD_SUMMARY_MAX_MESSAGES = int(os.getenv("THREAD_SUMMARY_MAX_MESSAGES", "20"))
+
+_flight = get_group("thread_summary")
+_stats = {"hits": 0, "folds": 0, "rebuilds": 0, "stale": 0, "degraded": 0}
+_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _stats[name] += 1
+
+
+def thread_summary_stats() -> dict:
+    with _lock:
+        return dict(_stats)
+
+
+def thread_context(db, email) -> Optional[str]:
+    """
+    Summary of the messages before ``email`` in its thread, for
+    categorize_email's ``thread_context``; None for a thread's first message.
+    """
+    if not email.conversation_id or not email.received_at:
+        return None
+    key = (str(email.user_id), email.conversation_id, str(email.id))
+    context, _ = _flight.do(key, lambda: _thread_context(db, email))
+    return context
+
+
+def _thread_context(db, email) -> Optional[str]:
+    from app.llm.summarize_thread import format_thread_summary
+
+    earlier = (
+        db.query(Email.id, Email.received_at)
+        .filter(
+            Email.user_id == email.user_id,
+            Email.conversation_id == email.conversation_id,
+            Email.received_at < email.received_at,
+        )
+        .order_by(Email.received_at)
+        .all()
+    )
+    if not earlier:
+        return None
+    latest_id, latest_at = earlier[-1]
+
+    row = (
+        db.query(ThreadSummary)
+        .filter_by(user_id=email.user_id, conversation_id=email.conversation_id)
+        .first()
+    )
+    if row is not None and row.last_received_at > latest_at:
+        # Covers this message or later ones
+        _count("stale")
+        return None
+    if row is not None and row.last_email_id == latest_id:
+        _count("hits")
+        return format_thread_summary(_as_result(row))
+
+    missing = [
+        email_id for email_id, received_at in earlier
+        if row is None or received_at > row.last_received_at
+    ]
+    if row is not None and len(missing) <= THREAD_SUMMARY_MAX_FOLDS:
+        result = _fold(db, row, missing)
+    else:
+        result = _rebuild(db, email, [email_id for email_id, _ in earlier[-THREAD_SUMMARY_MAX_MESSAGES:]])
+        if result is not None:
+            row = _save(db, row, email, result, len(earlier), latest_id, latest_at)
+    if result is None:
+        _count("degraded")
+        return format_thread_summary(_as_result(row)) if row is not None else None
+    return format_thread_summary(result)
+
+
+def _as_result(row: ThreadSummary) -> dict:
+    return {
+        "summary": row.summary,
+        "key_points": row.key_points or [],
+        "latest_student_question": row.latest_student_question,
+    }
+
+
+def _messages(db, ids: list) -> list:
+    by_id = {e.id: e for e in db.query(Email).filter(Email.id.in_(ids))}
+    return [by_id[email_id] for email_id in ids if email_id in by_id]
+
+
+def _fold(db, row: ThreadSummary, ids: list) -> Optional[dict]:
+    """Fold messages (oldest first) into ``row``; None if the model was unavailable."""
+    from app.llm.summarize_thread import format_thread_summary, update_thread_summary
+
+    result = None
+    for message in _messages(db, ids):
+        result = update_thread_summary(format_thread_summary(_as_result(row)), classification_input(message))
+        if result.get("degraded"):
+            # Keep what has been folded so far
+            db.commit()
+            return None
+        _count("folds")
+        _apply(row, result)
+        row.last_email_id = message.id
+        row.last_received_at = message.received_at
+        row.message_count += 1
+    db.commit()
+    return result
+
+
+def _rebuild(db, email, ids: list) -> Optional[dict]:
+    from app.llm.summarize_thread import summarize_thread
+
+    result = summarize_thread([classification_input(message) for message in _messages(db, ids)])
+    if result.get("degraded"):
+        return None
+    _count("rebuilds")
+    return result
+
+
+def _apply(row: ThreadSummary, result: dict) -> None:
+    row.summary = result.get("summary") or ""
+    row.key_points = list(result.get("key_points") or [])
+    row.latest_student_question = result.get("latest_student_question")
+
+
+def _save(db, row, email, result: dict, count: int, latest_id, latest_at) -> ThreadSummary:
+    if row is None:
+        row = ThreadSummary(user_id=email.user_id, conversation_id=email.conversation_id)
+        _apply(row, result)
+        row.last_email_id, row.last_received_at, row.message_count = latest_id, latest_at, count
+        try:
+            with db.begin_nested():
+                db.add(row)
+        except IntegrityError:
+            # Another worker created it first; its summary is as good
+            return db.query(ThreadSummary).filter_by(
+                user_id=email.user_id, conversation_id=email.conversation_id,
+            ).first()
+    else:
+        _apply(row, result)
+        row.last_email_id, row.last_received_at, row.message_count = latest_id, latest_at, count
+    db.commit()
+    return row
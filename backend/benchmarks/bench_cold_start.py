@@ -0,0 +1,70 @@
+"""
+Worker cold-start benchmark
+
+Starts fresh interpreters that import the app and call create_app(), the
+work every gunicorn worker repeats on boot, and reports wall time. It also
+reports whether heavy optional modules (Gemini SDK, NumPy) were imported
+at start-up and how long the first Gemini client initialisation takes.
+
+Usage (from backend/):
+    python -m benchmarks.bench_cold_start
+    python -m benchmarks.bench_cold_start --runs 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+app = create_app()
+boot_ms = (time.perf_counter() - started) * 1000
+heavy = {name: name in sys.modules for name in ("google.generativeai", "numpy")}
+
+first_call_ms = None
+from app.llm.client import get_model, is_configured
+if is_configured():
+    started = time.perf_counter()
+    get_model()
+    first_call_ms = (time.perf_counter() - started) * 1000
+
+print(json.dumps({"boot_ms": boot_ms, "heavy": heavy, "first_model_ms": first_call_ms}))
+"""
+
+
+def _run_once(cwd: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", _PROBE],
+        cwd=cwd, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    backend = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    results = [_run_once(backend) for _ in range(args.runs)]
+
+    boots = sorted(r["boot_ms"] for r in results)
+    first = [r["first_model_ms"] for r in results if r["first_model_ms"] is not None]
+    print(f"runs {args.runs}")
+    print(f"import + create_app   p50 {statistics.median(boots):8.1f} ms   max {boots[-1]:8.1f} ms")
+    if first:
+        print(f"first get_model()     p50 {statistics.median(first):8.1f} ms   (deferred SDK import + configure)")
+    else:
+        print("first get_model()     skipped (GEMINI_API_KEY not set)")
+    print(f"loaded at boot        {json.dumps(results[-1]['heavy'])}")
+
+
+if __name__ == "__main__":
+    main()
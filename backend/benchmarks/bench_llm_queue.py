@@ -0,0 +1,101 @@
+"""
+Benchmark for the priority-aware LLM work queue (app/workers/llm_queue.py)
+
+Runs against the offline stub provider with a fixed per-call latency.
+Measures interactive call latency on an idle queue, then again while
+background threads for several users saturate the queue with backlog
+calls, and reports how evenly backlog admissions were spread per user.
+
+Usage (from backend/):
+    python -m benchmarks.bench_llm_queue
+    python -m benchmarks.bench_llm_queue --background-threads 64 --latency-ms 100
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+os.environ.setdefault("LLM_PROVIDER", "stub")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import app.llm.providers as providers  # noqa: E402
+import app.workers.llm_queue as llm_queue  # noqa: E402
+from app.llm.client import generate_content  # noqa: E402
+from app.workers.rate_limit import TokenBucket  # noqa: E402
+
+
+def _percentiles(samples: list[float]) -> str:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return f"p50 {statistics.median(samples):7.1f} ms   p95 {p95:7.1f} ms"
+
+
+def _interactive(n: int) -> list[float]:
+    timings = []
+    for i in range(n):
+        started = time.perf_counter()
+        generate_content(f"interactive {i}", workflow="generate_reply")
+        timings.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.01)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--reserved", type=int, default=2)
+    parser.add_argument("--rate-per-second", type=float, default=200)
+    parser.add_argument("--background-threads", type=int, default=32)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--interactive-calls", type=int, default=50)
+    args = parser.parse_args()
+
+    providers.STUB_LATENCY_MS = args.latency_ms
+    limiter = TokenBucket(args.rate_per_second, max(args.rate_per_second / 10, 5))
+    llm_queue._queue = llm_queue.LLMWorkQueue(args.concurrency, args.reserved, limiter=limiter)
+
+    print(f"idle queue     interactive  {_percentiles(_interactive(args.interactive_calls))}")
+
+    stop = threading.Event()
+    admitted: Counter = Counter()
+
+    def background(user: str) -> None:
+        with llm_queue.llm_priority(llm_queue.BACKLOG, user):
+            while not stop.is_set():
+                generate_content(f"backlog for {user}", workflow="categorize_batch")
+                admitted[user] += 1
+
+    # User 0 gets half of the threads: fair queuing should still split
+    # admissions roughly evenly.
+    threads = []
+    for i in range(args.background_threads):
+        user = "user-0" if i % 2 == 0 else f"user-{1 + i % (args.users - 1)}"
+        threads.append(threading.Thread(target=background, args=(user,), daemon=True))
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+
+    print(f"saturated      interactive  {_percentiles(_interactive(args.interactive_calls))}")
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    print("backlog calls admitted per user:")
+    for user, count in sorted(admitted.items()):
+        print(f"  {user:8s} {count}")
+    classes = llm_queue.get_llm_queue().stats()["classes"]
+    for name in (llm_queue.INTERACTIVE, llm_queue.BACKLOG):
+        print(f"queue wait     {name:12s} p50 {classes[name]['wait_ms_p50']} ms   p95 {classes[name]['wait_ms_p95']} ms")
+
+
+if __name__ == "__main__":
+    main()
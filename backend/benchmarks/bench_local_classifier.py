@@ -0,0 +1,63 @@
+"""
+Benchmark for the local fast-path classifier (app/llm/local_classifier.py)
+
+Trains on the LLM-written labels in the emails table, then reports on a
+held-out split: agreement with Gemini, per-email latency, and escalation
+rate vs. local agreement for each confidence threshold.
+
+Usage (from backend/, with DATABASE_URL set):
+    python -m benchmarks.bench_local_classifier
+    python -m benchmarks.bench_local_classifier --holdout 0.3 --limit 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.db import get_session  # noqa: E402
+from app.llm.local_classifier import evaluate, fit_classifier, training_examples  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--limit", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with get_session() as db:
+        texts, categories, priorities = training_examples(db, limit=args.limit)
+    if len(texts) < 10:
+        sys.exit(f"Only {len(texts)} labelled emails; classify some with Gemini first.")
+
+    order = np.random.default_rng(args.seed).permutation(len(texts))
+    cut = int(len(texts) * (1 - args.holdout))
+    pick = lambda values, idx: [values[i] for i in idx]  # noqa: E731
+    train, test = order[:cut], order[cut:]
+
+    started = time.perf_counter()
+    model = fit_classifier(pick(texts, train), pick(categories, train), pick(priorities, train), args.seed)
+    train_s = time.perf_counter() - started
+    report = evaluate(model, pick(texts, test), pick(categories, test), pick(priorities, test))
+
+    print(f"train examples {len(train)}, held out {len(test)}, train time {train_s:.2f}s")
+    print(f"category accuracy {report['category_accuracy']}, agreement (category + priority band) {report['agreement']}")
+    print(f"p50 latency {report['p50_latency_us']} us/email")
+    print()
+    header = f"{'threshold':>9} {'escalation':>11} {'local agreement':>16}"
+    print(header)
+    print("-" * len(header))
+    for row in report["thresholds"]:
+        agreement = "-" if row["local_agreement"] is None else f"{row['local_agreement']:.4f}"
+        print(f"{row['threshold']:>9.2f} {row['escalation_rate']:>11.4f} {agreement:>16}")
+
+
+if __name__ == "__main__":
+    main()
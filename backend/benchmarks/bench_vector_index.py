@@ -0,0 +1,116 @@
+"""
+Benchmark for the memory-mapped vector index (app/search/vector_index.py)
+
+Builds synthetic per-user indexes at several sizes and reports build time,
+cold and warm single-query latency, batched throughput and compaction cost.
+
+Usage (from backend/):
+    python -m benchmarks.bench_vector_index
+    python -m benchmarks.bench_vector_index --sizes 10000 100000 1000000 --dim 768
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.search.vector_index import VectorIndexStore  # noqa: E402
+
+
+def _synthetic_batches(n: int, dim: int, batch: int, rng: np.random.Generator):
+    email_pool = [uuid.uuid4() for _ in range(max(1, n // 4))]
+    for start in range(0, n, batch):
+        size = min(batch, n - start)
+        ids = [uuid.uuid4() for _ in range(size)]
+        email_ids = [email_pool[i % len(email_pool)] for i in range(start, start + size)]
+        yield ids, email_ids, rng.standard_normal((size, dim), dtype=np.float32)
+
+
+def _percentile(samples: list[float], p: float) -> float:
+    return float(np.percentile(np.asarray(samples), p)) * 1000
+
+
+def run(size: int, dim: int, k: int, queries: int, batch: int, root: str, rng) -> dict:
+    store = VectorIndexStore(root=root, max_resident_bytes=1 << 62)
+    user_id = uuid.uuid4()
+
+    t0 = time.perf_counter()
+    store.build(user_id, dim, size, _synthetic_batches(size, dim, 8192, rng))
+    build_s = time.perf_counter() - t0
+
+    # Cold: drop the store's mapping and reopen (page cache may still be warm).
+    store.evict(user_id)
+    q = rng.standard_normal((queries, dim), dtype=np.float32)
+    t0 = time.perf_counter()
+    store.search(user_id, q[0], k)
+    cold_ms = (time.perf_counter() - t0) * 1000
+
+    single = []
+    for row in q:
+        t0 = time.perf_counter()
+        store.search(user_id, row, k)
+        single.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    for start in range(0, queries, batch):
+        store.search(user_id, q[start:start + batch], k)
+    batched_qps = queries / (time.perf_counter() - t0)
+
+    append_rows = max(1, size // 100)
+    ids, email_ids, vectors = next(_synthetic_batches(append_rows, dim, append_rows, rng))
+    store.append(user_id, ids, email_ids, vectors)
+    t0 = time.perf_counter()
+    store.get(user_id).compact()
+    compact_s = time.perf_counter() - t0
+
+    return {
+        "size": size,
+        "build_s": build_s,
+        "cold_ms": cold_ms,
+        "p50_ms": _percentile(single, 50),
+        "p95_ms": _percentile(single, 95),
+        "batched_qps": batched_qps,
+        "compact_s": compact_s,
+        "matrix_mb": size * dim * 4 / 1e6,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--dir", default=None, help="Where to write index files (default: temp dir)")
+    args = parser.parse_args()
+
+    root = args.dir or tempfile.mkdtemp(prefix="vector-index-bench-")
+    rng = np.random.default_rng(0)
+
+    header = f"{'chunks':>9} {'matrix MB':>10} {'build s':>8} {'cold ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'batch q/s':>10} {'compact s':>10}"
+    print(header)
+    print("-" * len(header))
+    try:
+        for size in args.sizes:
+            r = run(size, args.dim, args.k, args.queries, args.batch, os.path.join(root, str(size)), rng)
+            print(
+                f"{r['size']:>9} {r['matrix_mb']:>10.1f} {r['build_s']:>8.2f} {r['cold_ms']:>8.2f} "
+                f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['batched_qps']:>10.0f} {r['compact_s']:>10.2f}"
+            )
+    finally:
+        if args.dir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()